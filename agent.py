@@ -1,56 +1,132 @@
 from llmclient import LLMClient
+from llm_errors import LLMUnavailableError
 from tools import Tool
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, Callable
+import asyncio
+import inspect
 import json,re
-from prompt import create_prompt, create_planning_prompt
+import time
+from prompt import create_prompt, create_planning_prompt, create_tool_calling_prompt
+import prompt_budget
+from prompt_budget import Section
 from log import logger, debug, info, warning, error, critical, exception
 from database import db
+from async_runtime import run_sync
+from generation_settings import resolve_stage_settings
+import tool_calling
+import step_bindings
+import fast_router
+import request_context
+import conversation_summary
+import chat_memory
+import long_term_memory
+import semantic_cache
+import tool_sandbox
+from request_context import RequestContext
+from tool_index import ToolIndex, select_tools
+import metrics
+from config import Config
 
 import datetime
 
+# 计划中可并发执行的工具步骤数上限
+PLAN_MAX_PARALLEL_STEPS = getattr(Config, 'PLAN_MAX_PARALLEL_STEPS', 4)
+
 class ReactAgent:
     """增强型React Agent，包含LLM、记忆、规划和工具使用功能"""
     
-    def __init__(self, llm: LLMClient ,tools : Dict[str, Tool]):
+    def __init__(self, llm: LLMClient ,tools : Dict[str, Tool], generation: Optional[Dict[str, dict]] = None,
+                 tool_index: Optional[ToolIndex] = None, tools_version: Optional[str] = None):
         self.llm = llm
         self.tools = tools
+        # 工具检索索引：提供时提示词只包含与问题最相关的 TOOL_RETRIEVAL_TOP_K 个工具，否则包含全部工具
+        self.tool_index = tool_index
+        # 工具注册表版本（见 tools_cache.get_tools_version）：提供时启用语义缓存，缓存按 (注册表版本, 模型) 区分
+        self.tools_version = tools_version
+        # 各阶段（plan/parse/answer/follow_up/summary）的生成参数，见 generation_settings.resolve_stage_settings
+        self.generation = generation or resolve_stage_settings()
+        # 流式事件回调（见 aprocess_query 的 on_event 参数），为None时不推送事件
+        self._on_event: Optional[Callable] = None
+        # 请求上下文：本次请求内共享对话历史与工具schema渲染（见 request_context.py）
+        self._ctx: Optional[RequestContext] = None
         info(f"ReactAgent初始化完成，加载工具数量: {len(tools)}")
 
-    def _create_analysis_prompt(self, user_input: str, user_id: int) -> str:
+    def _create_analysis_prompt(self, user_input: str, history: str) -> str:
         """创建分析用户输入内容，工具选择和参数输入提示词"""
-        tools_schema = []
-        for tool in self.tools.values():
-            tools_schema.append(tool.get_schema())
+        tools = self._select_tools(user_input)
         # 历史对话，这里的历史对话是短期记忆，包含最近的3次对话，必须添加，否则LLM会忘记之前的对话，因为这里是基于最近的对话去生成执行的工具信息，
         # 如果不添加，LLM会基于当前对话去生成执行的工具信息，而不是基于之前的对话去生成执行的工具信息，这样会导致工具的参数传递出问题
         # 例如当前问题的请问，是基于上一个问题的结果，现在需要把上一个问题的结果添加为当前问题中工具调用的某一个参数值
-        # print("查看第二个提示词的工具schema: ",tools_schema)
-        history=self._summarize_conversation(user_id)
+        # history 由调用方通过 _ahistory(user_id) 获取（同一请求内只读取一次数据库）
         # print("查看第二个提示词的历史记录: ",history)
-        # 提示词
-        prompt=create_prompt(user_input,tools_schema,history)
-        return prompt
+        # 提示词：超出模型上下文预算时依次降级 历史对话 -> 工具schema（工具选择需要参数定义，不降级为仅名称）
+        sections = [
+            Section('history', self._history_variants(history), priority=1),
+            Section('tools', self._tools_variants(tools, brief=False), priority=2),
+        ]
+        return self._fit_prompt('parse', lambda v: create_prompt(user_input, v['tools'], v['history']), sections)
         
-    def _create_planning_prompt(self, user_input: str, conversation_summary: str) -> str:
+    def _create_planning_prompt(self, user_input: str, conversation_summary: str, long_term_memory: str = '') -> str:
         """创建规划提示词"""
-        tools_schema = []
-        for tool in self.tools.values():
-            tools_schema.append(tool.get_schema())
-        # print("查看第一个提示词的工具schema: ",tools_schema)
+        tools = self._select_tools(user_input)
         # 下面创建的规划提示词，包含用户输入、工具schema和对话摘要（历史对话，可以不用添加，根据需要添加，对话的次数我限制为3次）
-        prompt = create_planning_prompt(user_input, tools_schema, conversation_summary) 
-        return prompt
+        sections = [
+            Section('memory', prompt_budget.text_variants(long_term_memory, limits=(256, 0)), priority=0),
+            Section('history', self._history_variants(conversation_summary), priority=1),
+            Section('tools', self._tools_variants(tools), priority=2),
+        ]
+        return self._fit_prompt('plan', lambda v: create_planning_prompt(user_input, v['tools'], v['history'], v['memory']), sections)
+
+    def _select_tools(self, query: str) -> List[Tool]:
+        """提示词中包含的工具：按与问题的相关度取前 TOOL_RETRIEVAL_TOP_K 个（无索引或工具较少时为全部）"""
+        return select_tools(self.tools, self.tool_index, query)
+
+    async def _ahistory(self, user_id: int) -> str:
+        """对话历史：请求上下文中只读取一次，无上下文时（如单独调用 parse_user_input）直接读取"""
+        if self._ctx is not None and self._ctx.user_id == user_id:
+            return await self._ctx.ahistory(self._summarize_conversation)
+        return await asyncio.to_thread(self._summarize_conversation, user_id)
+
+    def _history_variants(self, history: str) -> List[str]:
+        if self._ctx is not None:
+            return self._ctx.history_variants(history)
+        return prompt_budget.text_variants(history, keep='tail')
+
+    def _tools_variants(self, tools: List[Tool], brief: bool = True) -> List[str]:
+        """工具schema的候选渲染：各工具的JSON按注册表版本缓存，同一组工具在请求内只拼接一次"""
+        if self._ctx is not None:
+            return self._ctx.tools_variants(tools, brief)
+        return request_context.tools_variants(tools, brief)
+
+    def _gen(self, stage: str) -> Dict[str, Any]:
+        """阶段的生成参数，作为 chat/achat/astream_chat 的关键字参数"""
+        return dict(self.generation[stage])
+
+    def _prompt_budget(self, stage: str) -> int:
+        """当前模型在该阶段的提示词token预算（上下文窗口减去该阶段的 max_tokens）"""
+        return prompt_budget.budget_for(getattr(self.llm, 'model', ''), self.generation[stage]['max_tokens'])
+
+    def _fit_prompt(self, stage: str, render: Callable[[Dict], str], sections: List[Section]) -> str:
+        """按当前模型的预算渲染提示词，超出时按片段优先级裁剪，并记录提示词大小"""
+        return prompt_budget.fit(render, sections, self._prompt_budget(stage), stage)
 
         
     def parse_user_input(self, user_input: str, user_id: int) -> Dict[str, Any]:
+        """使用LLM解析用户输入，选择工具并提取参数（同步包装）"""
+        return run_sync(self.aparse_user_input(user_input, user_id))
+
+    async def aparse_user_input(self, user_input: str, user_id: int) -> Dict[str, Any]:
         """使用LLM解析用户输入，选择工具并提取参数"""
         try:
             debug(f"开始解析用户输入: {user_input[:100]}..." if len(user_input) > 100 else f"开始解析用户输入: {user_input}")
-            prompt = self._create_analysis_prompt(user_input, user_id)
+            history = await self._ahistory(user_id)
+            prompt = self._create_analysis_prompt(user_input, history)
             # LLM问答
             try:
-                response = self.llm.chat(prompt) #获取需要调用的工具和参数
+                response = await self.llm.achat(prompt, **self._gen('parse')) #获取需要调用的工具和参数
                 debug("LLM解析响应获取成功")
+            except LLMUnavailableError:
+                raise
             except ConnectionError as ce:
                 error(f"网络连接错误: {ce}")
                 return {"tool": None, "parameters": {}, "reasoning": "网络连接失败，请检查LLM服务是否可用", "confidence": 0}
@@ -68,25 +144,38 @@ class ReactAgent:
                 debug("解析结果验证失败")
                 return {"tool": None, "parameters": {}, "reasoning": "解析失败", "confidence": 0}
                 
+        except LLMUnavailableError:
+            # 模型端点不可用，交由 aprocess_query 终止剩余计划
+            raise
         except Exception as e:
             error(f"解析错误: {e}")
             exception("用户输入解析异常")
             return {"tool": None, "parameters": {}, "reasoning": f"解析异常: {str(e)}", "confidence": 0}
     
     def create_plan(self, user_input: str, user_id: int) -> List[Dict]:
+        """为用户输入创建执行计划（同步包装）"""
+        return run_sync(self.acreate_plan(user_input, user_id))
+
+    async def acreate_plan(self, user_input: str, user_id: int) -> List[Dict]:
         """为用户输入创建执行计划"""
         try:
             info(f"开始创建执行计划，用户输入: {user_input[:50]}..." if len(user_input) > 50 else f"开始创建执行计划，用户输入: {user_input}")
             # 获取对话摘要
-            conversation_summary = self._summarize_conversation(user_id)
+            conversation_summary = await self._ahistory(user_id)
             debug(f"对话摘要: {conversation_summary}")
+            # 检索相关的更早对话（长期记忆）
+            memories = await asyncio.to_thread(self._recall_long_term_memory, user_id, user_input)
+            if memories and self._ctx is not None:
+                self._ctx.long_term_memory_used = True
             # 创建规划提示词
-            prompt = self._create_planning_prompt(user_input, conversation_summary)
+            prompt = self._create_planning_prompt(user_input, conversation_summary, memories)
             
             # LLM生成计划
             try:
-                response = self.llm.chat(prompt)
+                response = await self.llm.achat(prompt, **self._gen('plan'))
                 debug("LLM计划生成完成")
+            except LLMUnavailableError:
+                raise
             except ConnectionError as ce:
                 error(f"网络连接错误: {ce}")
                 return [{"step": 1, "action": "直接回答", "reason": "网络连接失败，无法生成详细计划"}]
@@ -98,6 +187,8 @@ class ReactAgent:
             plan = self._extract_plan_from_response(response)
             debug(f"执行计划创建成功，包含 {len(plan)} 个步骤")
             return plan
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             error(f"规划错误: {e}")
             exception("执行计划创建异常")
@@ -118,16 +209,37 @@ class ReactAgent:
 
     def _summarize_conversation(self,user_id: int) -> str:
         """总结对话历史"""
-        history = db.get_chat_history(user_id,3) # 获取最近的3条历史对话记录
+        history = db.get_recent_chat_history(user_id,3) # 获取最近的3条历史对话记录（优先读取内存中的短期记忆）
         debug(f"总结对话历史，总记录数: {len(history)}")
         if not history:
             debug("对话历史为空")
-            return "暂无历史对话"
+            return request_context.EMPTY_HISTORY
+        rolling = conversation_summary.get_summary(user_id)
+        if rolling:
+            # 已折叠进滚动摘要的轮次只保留摘要，未折叠的轮次保留原文；全部已折叠时只返回摘要，避免同一轮出现两次
+            history = [record for record in history if record['id'] > rolling['last_record_id']]
         summary = "\n".join([f"[用户问题: {record['user_message']}; AI回应: {record.get('bot_response', '无结果')}]" for record in history])
+        if rolling:
+            summary = f"[对话摘要: {rolling['summary']}]" + (f"\n{summary}" if summary else '')
         # 限制总结的对话数量
         debug(f"对话历史总结完成，摘要长度: {len(summary)} 字符")
         return summary
     
+    def _recall_long_term_memory(self, user_id: int, user_input: str) -> str:
+        """长期记忆：检索与问题最相关的更早对话（跳过短期记忆中已有的轮次），无结果时返回空字符串"""
+        if not long_term_memory.LONG_TERM_MEMORY_ENABLED:
+            return ''
+        try:
+            recent = {record['id'] for record in db.get_recent_chat_history(user_id, chat_memory.CHAT_MEMORY_TURNS)}
+            records = db.search_long_term_memory(user_id, user_input, exclude_ids=recent)
+        except Exception as e:
+            exception(f"检索长期记忆失败 - 用户ID: {user_id}, 错误: {e}")
+            return ''
+        debug(f"长期记忆检索完成 - 用户ID: {user_id}, 命中: {[record['id'] for record in records]}")
+        return "\n".join(
+            f"[{record['timestamp']} 用户问题: {record['user_message']}; AI回应: {prompt_budget.truncate_text(record.get('bot_response') or '', 256)}]"
+            for record in records)
+
     # 解析LLM返回的执行计划列表
     def _extract_plan_from_response(self, response: str) -> List[Dict]:
         """从LLM响应中提取执行计划"""
@@ -221,7 +333,8 @@ class ReactAgent:
         
         try:
             tool = self.tools[tool_name]  #获取json中的tool(类Tool)
-            result = tool.execute(**parameters) # parameters函数参数值
+            # 用户代码注册的工具在沙箱进程池中执行（超时、CPU与内存限制），可信的内置工具在当前进程内执行
+            result = tool_sandbox.execute(tool, parameters) # parameters函数参数值
             info(f"工具执行成功: {tool_name}")
             debug(f"工具执行结果: {str(result)[:200]}..." if len(str(result)) > 200 else f"工具执行结果: {result}")
             return result
@@ -229,140 +342,85 @@ class ReactAgent:
             error(f"工具执行失败: {tool_name}, 错误: {str(e)}")
             exception("工具执行异常")
             raise
+
+    async def aexecute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Any:
+        """在线程池中执行工具，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.execute_tool, tool_name, parameters)
+
+    async def _emit(self, event: str, data: Dict[str, Any]) -> None:
+        """向调用方推送执行进度事件（plan/step/token），回调异常不影响主流程"""
+        if self._on_event is None:
+            return
+        try:
+            res = self._on_event(event, data)
+            if inspect.isawaitable(res):
+                await res
+        except Exception as e:
+            warning(f"推送事件失败: {event}, 错误: {e}")
+
+    async def _achat_final(self, prompt: str, stage: str) -> str:
+        """生成最终回复：有事件回调时使用流式输出并逐段推送token，否则普通调用；
+        模型调用失败时抛出异常（而不是返回错误文本），由调用方标记降级并使用兜底内容"""
+        if self._on_event is None:
+            return await self.llm.achat_or_raise(prompt, **self._gen(stage))
+        parts = []
+        async for delta in self.llm.astream_chat(prompt, raise_errors=True, **self._gen(stage)):
+            parts.append(delta)
+            await self._emit('token', {'delta': delta})
+        return "".join(parts)
     
-    def process_query(self, user_id :int, user_input: str, model_name: str) -> str:
-        """处理用户查询，使用React模式：思考、行动、观察、响应"""
-        info(f"开始处理用户查询: {user_input[:50]}..." if len(user_input) > 50 else f"开始处理用户查询: {user_input}")
-        # 第一步：创建执行计划
-        plan = self.create_plan(user_input,user_id)
-        
-        # 记录执行计划
-        execution_summary = f"执行计划: {json.dumps(plan, ensure_ascii=False)}"
-        debug(execution_summary)
+    def process_query(self, user_id :int, user_input: str, model_name: str) -> Tuple[str, str]:
+        """处理用户查询（同步包装，实际流程在专用事件循环上执行 aprocess_query）"""
+        return run_sync(self.aprocess_query(user_id, user_input, model_name))
+
+    async def aprocess_query(self, user_id :int, user_input: str, model_name: str,
+                             on_event: Optional[Callable] = None) -> Tuple[str, str]:
+        """处理用户查询，使用React模式：思考、行动、观察、响应
         
-        final_response = ""
-        tool_results = []  # 存储所有工具执行结果
-        previous_step_result=""   #记录每个问题的执行计划上一步骤结果，实现一个问题里面，当前步骤实现有时需要依赖上一个步骤结果
-        # 第二步：执行计划中的每个步骤
-        for step in plan:
-            step_number = step.get("step", 1)
-            action = step.get("action", "直接回答")
-            reason = step.get("reason", "")
- 
-            # 根据动作类型执行不同操作
-            if action == "使用工具":
-                # 解析用户输入以获取工具信息
-                # 对于多步骤计划，我们需要根据当前步骤的reason来确定要使用的工具
-                if not previous_step_result:
-                    step_specific_input = f"{user_input} (根据计划开始执行第{step_number}步：{reason})"
-                else :
-                    step_specific_input = f"{user_input} (第{step_number-1}步执行结果：{previous_step_result}；根据计划开始执行第{step_number}步：{reason})"
-                # 根据执行计划步骤，使用LLM去生成对应的工具和参数信息
-                parsed = self.parse_user_input(step_specific_input, user_id)
-                tool_name = parsed.get("tool")
-                parameters = parsed.get("parameters", {})
-                reasoning = parsed.get("reasoning", "")
-                confidence = parsed.get("confidence", 0)
-                
-                # 如果解析失败，尝试从计划的reason中提取工具名
-                if not tool_name and "tool_name" in step:
-                    tool_name = step["tool_name"]
-                debug(f"调用的工具：{tool_name}, 工具置信度：{confidence}")
-                # 获取工具信息以获取tool_id
-                tool_info = db.get_function_tool_name(tool_name)
-                tool_id = tool_info['tool_id'] if tool_info else None
-                if tool_id and confidence >= 0.3:
-                    try:
-                        # 根据执行计划中的工具和参数，执行工具
-                        execution_start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 记录开始时间（年月日时分秒格式）
-                        result = self.execute_tool(tool_name, parameters)
-                        execution_end_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 记录结束时间
-                        previous_step_result=result  #保存当前结果
-                        
-                        # 记录工具执行信息
-                        execution_params_str = json.dumps(parameters, ensure_ascii=False)
-                        execution_result_str = json.dumps(result, ensure_ascii=False) if not isinstance(result, str) else result
-                        execution_steps = json.dumps({
-                            'step': step_number,
-                            'reasoning': reasoning,
-                            'confidence': confidence
-                        }, ensure_ascii=False)
-                        # 记录工具执行信息
-                        db.add_tool_execution(
-                            user_id=user_id,
-                            tool_id=tool_id,
-                            tool_name=tool_name,
-                            question=user_input,
-                            execution_steps=execution_steps,
-                            execution_params=execution_params_str,
-                            execution_result=execution_result_str,
-                            execution_status="success",
-                            start_time=execution_start_time,
-                            end_time=execution_end_time
-                        )
-                        
-                        # 格式化存储工具执行结果
-                        tool_response = self._format_response(tool_name, parameters, result, reasoning, confidence)
-                        tool_results.append(tool_response)
-                        
-                    except Exception as e:
-                        error_msg = f"执行错误: {str(e)}"
-                        tool_results.append(error_msg)
-                        error(f"调用工具执行错误: {error_msg}")
-                        exception("工具调用异常") 
-                else:
-                    # 如果没有合适的工具，生成直接回答
-                    debug(f"没有合适的工具或数据库中无此工具信息{tool_name}，生成直接回答")
-                    fallback_answer = self._generate_direct_answer(step_specific_input,user_id)
-                    tool_results.append(fallback_answer)
-                    debug(f"直接回答生成完成")
-            
-            elif action == "直接回答":
-                # 对于直接回答，使用所有工具执行结果作为上下文
-                try:
-                    # 调用LLM生成总结回答,这里不需要添加历史对话，因为直接回答是基于当前问题的工具执行结果，而不是基于之前的对话
-                    if tool_results:
-                    # 构建包含所有工具结果的提示词文本字符串
-                        context = "\n\n".join(tool_results)
-                        debug(f"工具返回的结果：\n{context}")
-                        direct_answer_prompt = f"""基于以下工具执行结果，总结回答用户问题：
-                                                用户问题: {user_input}
-
-                                                工具执行结果:
-                                                {context}
-
-                                                请提供一个简洁、友好的总结回答。"""
-                        response = self.llm.chat(direct_answer_prompt)
-                        final_response = response.strip()
-                        debug("根据工具执行结果总结回答生成成功")
-                    else:
-                        final_response = self._generate_follow_up_question(user_input)
-                        debug("没有调用工具，直接总结回答生成成功")
-
-                except Exception as e:
-                    error(f"生成总结回答失败: {str(e)}")
-                    # 如果LLM调用失败，使用工具结果的简单拼接
-                    result_lines = []
-                    for r in tool_results:
-                        if "**结果**: " in r:
-                            result_part = r.split("**结果**: ")[-1]
-                            first_line = result_part.split("\n")[0]
-                            result_lines.append(f"- {first_line}")
-                    final_response = "根据工具处理结果：\n" + "\n".join(result_lines)
-
-                break  # 直接回答步骤是最后一步，执行完后可以跳出循环
-            
-            elif action == "追问用户":
-                # 生成追问
-                final_response = self._generate_follow_up_question(user_input)
-                # print(final_response)
-                break  # 追问后需要用户输入，跳出循环
-            
+        Args:
+            on_event: 可选的事件回调 on_event(event, data)，可为协程函数；
+                      依次推送 plan（计划生成后）、step（每个工具步骤完成后）、token（最终回复的增量文本）
+        """
+        info(f"开始处理用户查询: {user_input[:50]}..." if len(user_input) > 50 else f"开始处理用户查询: {user_input}")
+        self._on_event = on_event
+        self._ctx = RequestContext(user_id, user_input)
+        plan = []
+        start = time.perf_counter()
+        cache, cache_scope = None, ()
+        try:
+            # 算术表达式、"/<工具名> <参数>" 等可直接解析的请求不经过LLM，直接调用工具
+            fast = await self._arun_fast_route(user_id, user_input)
+            if fast is None:
+                cache, cache_scope = await self._asemantic_cache_scope(user_id)
+            # 与之前问题近似且只用到可缓存工具的问答，直接返回缓存的计划与回答
+            cached = await self._alookup_semantic_cache(cache, cache_scope, user_input) if fast is None else None
+            # 端点支持工具调用时，规划与参数提取合为一次调用；不支持时回退到提示词规划流程
+            native = await self._arun_tool_calling(user_id, user_input) if fast is None and cached is None else None
+            if fast is not None:
+                plan, final_response = fast
+            elif cached is not None:
+                plan, final_response = cached
+            elif native is not None:
+                plan, final_response = native
             else:
-                # 未知动作类型，默认直接回答
-                final_response = self._generate_direct_answer(user_input, user_id)
-                # print(final_response)
-                break
+                # 第一步：创建执行计划
+                plan = await self.acreate_plan(user_input,user_id)
+                await self._emit('plan', {'plan': plan})
+
+                # 记录执行计划
+                execution_summary = f"执行计划: {json.dumps(plan, ensure_ascii=False)}"
+                debug(execution_summary)
+
+                # 第二步：执行计划中的每个步骤
+                final_response = await self._aexecute_plan(plan, user_id, user_input)
+            if cache is not None and fast is None and cached is None and self._is_semantic_cacheable(plan):
+                cache.set(user_input, cache_scope, plan, final_response, time.perf_counter() - start)
+                debug(f"问答已写入语义缓存 - 工具: {[name for name, _ in self._ctx.tool_calls]}")
+        except LLMUnavailableError as e:
+            # 模型端点熔断或限流排队超时：剩余步骤的LLM调用注定失败，直接终止计划
+            metrics.incr('agent.plan_short_circuited')
+            warning(f"模型服务不可用，终止剩余计划步骤: {e}")
+            final_response = f"抱歉，语言模型服务暂时不可用，已停止执行剩余计划步骤，请稍后再试。（{e}）"
         
         # self.update_memory(user_input, final_response)
         
@@ -380,42 +438,448 @@ class ReactAgent:
             plan_text += "暂无执行计划\n"
         # 存储对话记录到数据库
         debug("存储Agent记忆")
-        db.add_chat_record(
+        await asyncio.to_thread(
+            db.add_chat_record,
             user_message=user_input,
             plan=plan_text,
             bot_response=self._parsed_repose(final_response),
             user_id=user_id,
             model_name=model_name
         )
+        # 后台把本轮对话折叠进滚动摘要，不等待结果
+        conversation_summary.schedule(self.llm, user_id, self._gen('memory'))
 
         info("用户查询处理完成")
         return plan_text ,final_response
     
-    def _generate_direct_answer(self, user_input: str, user_id: int) -> str:
-        """直接生成回答，不使用工具"""
+    async def _arun_tool(self, user_id: int, user_input: str, tool_id: int, tool_name: str, parameters: Dict[str, Any],
+                         step_number: int, reasoning: str, confidence: float) -> Tuple[bool, Any, str]:
+        """执行一次工具调用并记录执行信息，返回 (是否成功, 工具结果, 格式化后的结果文本或错误信息)"""
         try:
+            # 根据执行计划中的工具和参数，执行工具
+            execution_start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 记录开始时间（年月日时分秒格式）
+            result = await self.aexecute_tool(tool_name, parameters)
+            execution_end_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 记录结束时间
+            
+            # 记录工具执行信息
+            execution_params_str = json.dumps(parameters, ensure_ascii=False)
+            execution_result_str = json.dumps(result, ensure_ascii=False) if not isinstance(result, str) else result
+            execution_steps = json.dumps({
+                'step': step_number,
+                'reasoning': reasoning,
+                'confidence': confidence
+            }, ensure_ascii=False)
+            # 记录工具执行信息
+            await asyncio.to_thread(
+                db.add_tool_execution,
+                user_id=user_id,
+                tool_id=tool_id,
+                tool_name=tool_name,
+                question=user_input,
+                execution_steps=execution_steps,
+                execution_params=execution_params_str,
+                execution_result=execution_result_str,
+                execution_status="success",
+                start_time=execution_start_time,
+                end_time=execution_end_time
+            )
+            
+            if self._ctx is not None:
+                self._ctx.record_tool_call(tool_name, True, parameters, result)
+            # 格式化存储工具执行结果
+            return True, result, self._format_response(tool_name, parameters, result, reasoning, confidence)
+        except Exception as e:
+            if self._ctx is not None:
+                self._ctx.record_tool_call(tool_name, False, parameters)
+            error_msg = f"执行错误: {str(e)}"
+            error(f"调用工具执行错误: {error_msg}")
+            exception("工具调用异常") 
+            return False, None, error_msg
+
+    async def _arun_fast_route(self, user_id: int, user_input: str) -> Optional[Tuple[List[Dict], str]]:
+        """快速路由：请求命中 fast_router 的规则时直接调用工具并按模板生成回答，返回 (执行计划, 最终回复)；
+        未命中或第一个工具执行前失败时返回None，由调用方走LLM流程；已有工具执行后失败时返回错误信息，避免重复执行"""
+        hit = fast_router.route(user_input, self.tools)
+        if hit is None:
+            return None
+        start = time.perf_counter()
+        reasoning = f"快速路由（{hit.kind}）"
+        plan: List[Dict] = []
+
+        async def call(tool_name: str, parameters: Dict[str, Any]) -> Tuple[bool, Any, str]:
+            tool_info = await asyncio.to_thread(db.get_function_tool_name, tool_name)
+            if not tool_info:
+                return False, None, f"数据库中无此工具信息{tool_name}"
+            plan.append({"step": len(plan) + 1, "action": "使用工具", "tool_name": tool_name, "parameters": parameters,
+                         "reason": f"{reasoning}：{tool_name} {json.dumps(parameters, ensure_ascii=False)}"})
+            outcome = await self._arun_tool(user_id, user_input, tool_info['tool_id'], tool_name, parameters,
+                                            len(plan), reasoning, 1.0)
+            return outcome
+
+        errors: List[str] = []
+        if hit.kind == fast_router.ARITHMETIC:
+            async def operate(tool_name, parameters):
+                ok, result, text = await call(tool_name, parameters)
+                if not ok:
+                    errors.append(text)
+                return ok, result
+            ok, result = await fast_router.aevaluate(hit.tree, operate)
+        else:
+            ok, _, final_response = await call(hit.tool_name, hit.parameters)
+            if not ok:
+                errors.append(final_response)
+        if not ok and not plan:
+            # 尚未执行任何工具，可安全改走LLM流程
+            metrics.incr('fast_router.fallback')
+            warning(f"快速路由执行失败，改走LLM流程: {hit}")
+            return None
+        if not ok:
+            # 已有工具执行并记录，改走LLM流程会重复执行，直接返回错误信息
+            metrics.incr('fast_router.failed')
+            warning(f"快速路由执行失败，已执行 {len(plan)} 次工具调用，不再改走LLM流程: {hit}")
+            final_response = errors[-1]
+        else:
+            if hit.kind == fast_router.ARITHMETIC:
+                final_response = fast_router.FAST_ROUTER_ARITHMETIC_TEMPLATE.format(
+                    expression=hit.expression, result=fast_router.format_number(result))
+            metrics.incr(f'fast_router.hit.{hit.kind}')
+            info(f"快速路由命中，未调用LLM - 规则: {hit.kind}, 工具调用次数: {len(plan)}")
+        metrics.observe('fast_router.latency_ms', (time.perf_counter() - start) * 1000)
+        # 工具调用在毫秒级完成，计划与回答一次性推送
+        await self._emit('plan', {'plan': plan})
+        await self._emit('token', {'delta': final_response})
+        return plan, final_response
+
+    async def _asemantic_cache_scope(self, user_id: int) -> Tuple[Optional[semantic_cache.SemanticCache], Tuple]:
+        """语义缓存及本次请求的缓存范围 (工具注册表版本, 模型)，所有用户共享；
+        依赖对话历史的问答由 _is_semantic_cacheable 排除，不写入缓存。未开启或未提供注册表版本时缓存为None"""
+        cache = semantic_cache.get_semantic_cache() if self.tools_version else None
+        if cache is None:
+            return None, ()
+        return cache, (self.tools_version, getattr(self.llm, 'model', ''))
+
+    async def _alookup_semantic_cache(self, cache: Optional[semantic_cache.SemanticCache], scope: Tuple,
+                                      user_input: str) -> Optional[Tuple[List[Dict], str]]:
+        """语义缓存命中时返回 (执行计划, 最终回复) 并一次性推送计划与回答，未命中返回None"""
+        hit = cache.get(user_input, scope) if cache is not None else None
+        if hit is None:
+            return None
+        info(f"命中语义缓存，未调用LLM与工具 - 相似度: {hit['similarity']:.2f}")
+        await self._emit('plan', {'plan': hit['plan']})
+        await self._emit('token', {'delta': hit['answer']})
+        return hit['plan'], hit['answer']
+
+    def _is_semantic_cacheable(self, plan: List[Dict]) -> bool:
+        """本次问答能否写入语义缓存：计划中的每个工具步骤都成功调用了可缓存工具，且回答不是降级结果；
+        不调用工具的直接回答与追问可能依赖对话历史，不缓存；规划使用了长期记忆（不在缓存范围内）时也不缓存；
+        有对话历史且工具参数中的数字不是来自问题本身（取自上下文的追问）时也不缓存"""
+        ctx = self._ctx
+        if ctx is None or ctx.degraded or ctx.long_term_memory_used:
+            return False
+        if ctx.arguments_from_context and ctx.has_history:
+            return False
+        tool_steps = [step for step in plan if step.get("action") == "使用工具"]
+        calls = ctx.tool_calls
+        if not tool_steps or len(calls) < len(tool_steps) or any(step.get("action") == "追问用户" for step in plan):
+            return False
+        return all(ok and getattr(self.tools.get(name), 'cacheable', False) for name, ok in calls)
+
+    def _mark_degraded(self) -> None:
+        """回答生成失败、使用了兜底内容时调用，本次问答不写入语义缓存"""
+        if self._ctx is not None:
+            self._ctx.degraded = True
+
+    async def _arun_tool_calling(self, user_id: int, user_input: str) -> Optional[Tuple[List[Dict], str]]:
+        """工具调用模式：一次请求同时得到要调用的工具与参数，返回 (执行计划, 最终回复)；
+        端点不支持任何工具调用模式（或配置为 prompt）时返回None，由调用方走提示词规划流程；
+        只有第一轮请求（尚未执行工具）失败时才换用其他模式"""
+        modes = tool_calling.modes_for(self.llm)
+        if not modes or not self.tools:
+            return None
+        history = await self._ahistory(user_id)
+        tools = self._select_tools(user_input)
+        for mode in modes:
+            try:
+                return await self._atool_rounds(mode, user_id, user_input, history, tools)
+            except tool_calling.ToolCallingUnsupportedError as e:
+                tool_calling.mark_unsupported(self.llm, mode)
+                debug(f"工具调用模式 {mode} 不可用: {e}")
+        return None
+
+    async def _atool_rounds(self, mode: str, user_id: int, user_input: str, history: str,
+                            tools: List[Tool]) -> Tuple[List[Dict], str]:
+        """多轮工具调用：每轮执行模型返回的全部工具调用并回传结果，直到模型给出最终回答或达到轮数上限"""
+        native = mode == tool_calling.NATIVE
+        sections = [Section('history', self._history_variants(history), priority=1)]
+        if not native:
+            sections.append(Section('tools', self._tools_variants(tools, brief=False), priority=2))
+        prompt = self._fit_prompt('tool_call', lambda v: create_tool_calling_prompt(
+            user_input, v['history'], None if native else v['tools']), sections)
+        openai_tools = tool_calling.to_openai_tools([t.get_schema() for t in tools]) if native else []
+        messages = [{"role": "user", "content": prompt}]
+        result_limit = self._prompt_budget('tool_call') // 4
+
+        plan = []
+        tool_results = []
+        final_response = ""
+        for round_index in range(tool_calling.AGENT_MAX_TOOL_ROUNDS):
+            try:
+                reply = await self.llm.achat_tools(messages, openai_tools, mode=mode, **self._gen('tool_call'))
+            except tool_calling.ToolCallingUnsupportedError as e:
+                if round_index == 0:
+                    raise  # 尚未执行任何工具，由调用方换用其他模式或回退到提示词规划流程
+                # 工具已经执行过，不能回退重跑（会重复执行工具与写入执行记录），基于已有的工具结果回答
+                warning(f"工具调用模式({mode})第{round_index + 1}轮请求失败，基于已有的工具结果回答: {e}")
+                self._mark_degraded()
+                break
+            calls = reply['tool_calls']
+            if not calls:
+                final_response = reply['content'].strip()
+                break
+            steps = [{"step": len(plan) + i + 1, "action": "使用工具", "reason": f"调用工具 {c['name']}", "tool_name": c['name']}
+                     for i, c in enumerate(calls)]
+            plan.extend(steps)
+            await self._emit('plan', {'plan': plan})
+
+            observations = []
+            for step, call in zip(steps, calls):
+                tool_name, parameters = call['name'], call['arguments']
+                tool_info = await asyncio.to_thread(db.get_function_tool_name, tool_name) if tool_name in self.tools else None
+                if tool_info:
+                    ok, result, tool_response = await self._arun_tool(
+                        user_id, user_input, tool_info['tool_id'], tool_name, parameters, step['step'],
+                        f"工具调用模式({mode})", 1.0)
+                    observation = str(result) if ok else tool_response
+                else:
+                    tool_response = observation = f"未知工具: {tool_name}"
+                    self._mark_degraded()
+                    warning(f"模型返回了不存在的工具: {tool_name}")
+                tool_results.append(tool_response)
+                observations.append(prompt_budget.truncate_text(observation, result_limit))
+                await self._emit('step', {'step': step['step'], 'tool': tool_name, 'result': tool_response})
+
+            # 回传工具结果，由模型决定继续调用工具还是给出最终回答
+            if native:
+                messages.append({"role": "assistant", "content": reply['content'] or None, "tool_calls": [
+                    {"id": c['id'], "type": "function",
+                     "function": {"name": c['name'], "arguments": json.dumps(c['arguments'], ensure_ascii=False)}}
+                    for c in calls]})
+                messages.extend({"role": "tool", "tool_call_id": c['id'], "content": o} for c, o in zip(calls, observations))
+            else:
+                messages.append({"role": "assistant", "content": json.dumps(
+                    {"tool_calls": [{"name": c['name'], "arguments": c['arguments']} for c in calls], "answer": ""},
+                    ensure_ascii=False)})
+                results_text = "\n".join(f"{c['name']}: {o}" for c, o in zip(calls, observations))
+                messages.append({"role": "user", "content": f"工具执行结果：\n{results_text}\n请继续：需要时继续调用工具，否则给出最终回答。"})
+
+        if final_response:
+            await self._emit('token', {'delta': final_response})
+        elif tool_results:
+            # 达到轮数上限仍未给出回答，基于已有的工具结果总结
+            final_response = await self._asummarize_tool_results(user_input, tool_results)
+        else:
+            final_response = await self._generate_direct_answer(user_input, user_id, final=True)
+        plan.append({"step": len(plan) + 1, "action": "直接回答",
+                     "reason": "根据工具执行结果回答用户" if tool_results else "无需调用工具，直接回答"})
+        info(f"工具调用模式({mode})完成，工具调用次数: {len(tool_results)}")
+        return plan, final_response
+
+    async def _aexecute_plan(self, plan: List[Dict], user_id: int, user_input: str) -> str:
+        """执行计划并返回最终回复：回答步骤之前的工具步骤按依赖关系（depends_on）并发执行，
+        结果按计划顺序合并后进入回答步骤；模型端点不可用时抛出 LLMUnavailableError"""
+        final_response = ""
+        tool_steps = []
+        terminal = None
+        for step in plan:
+            if step.get("action", "直接回答") == "使用工具":
+                tool_steps.append(step)
+            else:
+                terminal = step  # 直接回答/追问用户/未知动作 是最后一步，其后的步骤不再执行
+                break
+        # 按计划顺序合并的工具执行结果（或无合适工具时的直接回答）
+        tool_results = [response for _, _, response in await self._aexecute_tool_steps(tool_steps, user_id, user_input)]
+
+        action = terminal.get("action", "直接回答") if terminal else None
+        if terminal is None:
+            pass
+        elif action == "直接回答":
+            # 对于直接回答，使用所有工具执行结果作为上下文
+            if tool_results:
+                final_response = await self._asummarize_tool_results(user_input, tool_results)
+            else:
+                final_response = await self._generate_follow_up_question(user_input)
+                debug("没有调用工具，直接总结回答生成成功")
+        elif action == "追问用户":
+            # 生成追问，追问后需要用户输入
+            final_response = await self._generate_follow_up_question(user_input)
+        else:
+            # 未知动作类型，默认直接回答
+            final_response = await self._generate_direct_answer(user_input, user_id, final=True)
+        return final_response
+
+    async def _aexecute_tool_steps(self, steps: List[Dict], user_id: int, user_input: str) -> List[Tuple[bool, Any, str]]:
+        """按依赖关系调度工具步骤：无依赖关系的步骤（参数解析+工具执行）并发运行，并发数受 PLAN_MAX_PARALLEL_STEPS 限制；
+        计划中没有 depends_on 字段时保持旧语义，逐步执行并把最近一次成功的结果传给下一步；
+        参数中的 $stepN.result 引用同样视为依赖。返回与 steps 顺序一致的 [(是否成功, 工具结果, 结果文本)]"""
+        if not steps:
+            return []
+        explicit = any("depends_on" in step for step in steps)
+        number_to_index = {}
+        deps: List[List[int]] = []
+        for i, step in enumerate(steps):
+            if explicit:
+                raw = step.get("depends_on") or []
+                raw = raw if isinstance(raw, list) else [raw]
+                raw = list(raw) + sorted(step_bindings.references(step.get("parameters")))
+                # 只允许依赖排在前面的步骤，保证无环
+                deps.append(sorted({number_to_index[n] for n in raw if n in number_to_index}))
+            else:
+                deps.append(list(range(i)))
+            number_to_index[step.get("step", i + 1)] = i
+
+        semaphore = asyncio.Semaphore(PLAN_MAX_PARALLEL_STEPS)
+        tasks: List[asyncio.Future] = []
+
+        async def run(i: int):
+            outcomes = [(steps[j].get("step", j + 1), await tasks[j]) for j in deps[i]]
+            results = {n: (ok, result) for n, (ok, result, _) in outcomes}
+            inputs = [(n, result) for n, (ok, result, _) in outcomes if ok]
+            if not explicit:
+                inputs = inputs[-1:]
+            async with semaphore:
+                return await self._aexecute_tool_step(steps[i], i, user_id, user_input, inputs, results)
+
+        for i in range(len(steps)):
+            tasks.append(asyncio.ensure_future(run(i)))
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+
+    async def _aexecute_tool_step(self, step: Dict, index: int, user_id: int, user_input: str,
+                                  inputs: List[Tuple[Any, Any]],
+                                  results: Optional[Dict[Any, Tuple[bool, Any]]] = None) -> Tuple[bool, Any, str]:
+        """执行单个工具步骤：计划已给出完整参数时在本地解析 $stepN.result 引用后直接执行，
+        否则由模型解析参数；inputs 为所依赖步骤的 [(步骤序号, 结果)]，results 为 {步骤序号: (是否成功, 结果)}"""
+        step_number = step.get("step", index + 1)
+        reason = step.get("reason", "")
+        tool_name = step.get("tool_name")
+        if "parameters" in step:
+            parameters = step_bindings.bind_parameters(self.tools.get(tool_name), step["parameters"], results or {})
+            tool_info = await asyncio.to_thread(db.get_function_tool_name, tool_name) if parameters is not None else None
+            if tool_info:
+                metrics.incr('agent.step_parse_skipped')
+                debug(f"第{step_number}步使用计划中的参数，跳过参数解析 - 工具: {tool_name}, 参数: {parameters}")
+                outcome = await self._arun_tool(
+                    user_id, user_input, tool_info['tool_id'], tool_name, parameters, step_number, reason, 1.0)
+                await self._emit('step', {'step': step_number, 'tool': tool_name, 'result': outcome[2]})
+                return outcome
+            metrics.incr('agent.step_binding_fallback')
+            debug(f"第{step_number}步计划参数缺失或引用无法解析，改由模型解析参数 - 工具: {tool_name}")
+        # 解析用户输入以获取工具信息
+        # 对于多步骤计划，我们需要根据当前步骤的reason来确定要使用的工具
+        if not inputs:
+            step_specific_input = f"{user_input} (根据计划开始执行第{step_number}步：{reason})"
+        else :
+            # 依赖步骤的结果可能很长（如搜索结果），合计限制在预算的1/4以内
+            limit = self._prompt_budget('parse') // 4 // len(inputs)
+            previous_text = "；".join(f"第{n}步执行结果：{prompt_budget.truncate_text(str(r), limit)}" for n, r in inputs)
+            step_specific_input = f"{user_input} ({previous_text}；根据计划开始执行第{step_number}步：{reason})"
+        # 根据执行计划步骤，使用LLM去生成对应的工具和参数信息
+        parsed = await self.aparse_user_input(step_specific_input, user_id)
+        tool_name = parsed.get("tool")
+        parameters = parsed.get("parameters", {})
+        reasoning = parsed.get("reasoning", "")
+        confidence = parsed.get("confidence", 0)
+        
+        # 如果解析失败，尝试从计划的reason中提取工具名
+        if not tool_name and "tool_name" in step:
+            tool_name = step["tool_name"]
+        debug(f"调用的工具：{tool_name}, 工具置信度：{confidence}")
+        # 获取工具信息以获取tool_id
+        tool_info = await asyncio.to_thread(db.get_function_tool_name, tool_name)
+        tool_id = tool_info['tool_id'] if tool_info else None
+        if tool_id and confidence >= 0.3:
+            outcome = await self._arun_tool(
+                user_id, user_input, tool_id, tool_name, parameters, step_number, reasoning, confidence)
+        else:
+            # 如果没有合适的工具，生成直接回答
+            debug(f"没有合适的工具或数据库中无此工具信息{tool_name}，生成直接回答")
+            fallback_answer = await self._generate_direct_answer(step_specific_input,user_id)
+            debug(f"直接回答生成完成")
+            outcome = (False, None, fallback_answer)
+        await self._emit('step', {'step': step_number, 'tool': tool_name, 'result': outcome[2]})
+        return outcome
+    
+    async def _asummarize_tool_results(self, user_input: str, tool_results: List[str]) -> str:
+        """基于工具执行结果总结回答；LLM调用失败时退化为工具结果的简单拼接"""
+        try:
+            # 调用LLM生成总结回答,这里不需要添加历史对话，因为直接回答是基于当前问题的工具执行结果，而不是基于之前的对话
+            # 构建包含所有工具结果的提示词文本字符串
+            context = "\n\n".join(tool_results)
+            debug(f"工具返回的结果：\n{context}")
+            budget = self._prompt_budget('summary')
+            sections = [Section('context', prompt_budget.text_variants(context, limits=(budget // 2, budget // 4)), priority=1)]
+            direct_answer_prompt = self._fit_prompt('summary', lambda v: f"""基于以下工具执行结果，总结回答用户问题：
+                                    用户问题: {user_input}
+
+                                    工具执行结果:
+                                    {v['context']}
+
+                                    请提供一个简洁、友好的总结回答。""", sections)
+            response = await self._achat_final(direct_answer_prompt, 'summary')
+            debug("根据工具执行结果总结回答生成成功")
+            return response.strip()
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            error(f"生成总结回答失败: {str(e)}")
+            self._mark_degraded()
+            # 如果LLM调用失败，使用工具结果的简单拼接
+            result_lines = []
+            for r in tool_results:
+                if "**结果**: " in r:
+                    result_part = r.split("**结果**: ")[-1]
+                    first_line = result_part.split("\n")[0]
+                    result_lines.append(f"- {first_line}")
+            return "根据工具处理结果：\n" + "\n".join(result_lines)
+
+    async def _generate_direct_answer(self, user_input: str, user_id: int, final: bool = False) -> str:
+        """直接生成回答，不使用工具；final=True 表示该回答即最终回复（可流式推送）"""
+        try:
+            history = await self._ahistory(user_id)
             # 构建直接回答的提示词
-            prompt = f"""
+            sections = [Section('history', self._history_variants(history), priority=1)]
+            prompt = self._fit_prompt('answer', lambda v: f"""
             请直接回答用户的问题，不需要调用工具：
             用户问题：{user_input}
             
             历史对话：
-            {self._summarize_conversation(user_id)}
+            {v['history']}
             
             请提供一个自然、友好的回答。
-            """
+            """, sections)
             
             try:
-                response = self.llm.chat(prompt)
+                response = await (self._achat_final(prompt, 'answer') if final else self.llm.achat_or_raise(prompt, **self._gen('answer')))
                 return response.strip()
+            except LLMUnavailableError:
+                raise
             except ConnectionError:
+                self._mark_degraded()
                 return "抱歉，我暂时无法连接到语言模型服务。请稍后再试。"
             except Exception as e:
+                self._mark_degraded()
                 return f"抱歉，生成回答时出错: {str(e)}"
+        except LLMUnavailableError:
+            raise
         except Exception as e:
+            self._mark_degraded()
             return f"生成回答时出错: {str(e)}"
     
-    def _generate_follow_up_question(self, user_input: str) -> str:
+    async def _generate_follow_up_question(self, user_input: str) -> str:
         """生成追问用户的问题"""
         try:
             # 构建追问提示词
@@ -427,12 +891,16 @@ class ReactAgent:
             """
             
             try:
-                response = self.llm.chat(prompt)
+                response = await self._achat_final(prompt, 'follow_up')
                 return response.strip()
+            except LLMUnavailableError:
+                raise
             except ConnectionError:
                 return "为了更好地帮助您，我需要一些额外信息。您能提供更多细节吗？"
             except Exception as e:
                 return "为了更好地帮助您，我需要一些额外信息。您能提供更多细节吗？"
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             return "为了更好地帮助您，我需要一些额外信息。您能提供更多细节吗？"
     
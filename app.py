@@ -10,6 +10,7 @@ from routes.auth import auth_bp
 from routes.chat import chat_bp
 from routes.models import models_bp
 from routes.tools import tools_bp
+from routes.metrics import metrics_bp
 
 # 启动初始化逻辑
 from startup import initialize_add_tool_and_admin
@@ -30,6 +31,7 @@ def create_app():
     app.register_blueprint(chat_bp)
     app.register_blueprint(models_bp)
     app.register_blueprint(tools_bp)
+    app.register_blueprint(metrics_bp)
 
     return app
 
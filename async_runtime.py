@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Coroutine, Optional
+
+from config import Config
+from log import info
+
+# 专用事件循环的阻塞IO线程数（工具执行、数据库读写通过 asyncio.to_thread 落在该线程池）
+ASYNC_IO_WORKERS = getattr(Config, 'ASYNC_IO_WORKERS', 32)
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_THREAD: Optional[threading.Thread] = None
+_LOCK = threading.Lock()
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop, ready: threading.Event) -> None:
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """获取进程内专用的事件循环（首次调用时在后台线程中启动）。
+    所有异步LLM调用都运行在这一个循环上，AsyncOpenAI的连接池因此可以安全共享。
+    """
+    global _LOOP, _THREAD
+    if _LOOP is not None:
+        return _LOOP
+    with _LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix='agent-io'))
+            ready = threading.Event()
+            thread = threading.Thread(target=_run_loop, args=(loop, ready), name='agent-event-loop', daemon=True)
+            thread.start()
+            ready.wait()
+            _THREAD = thread
+            _LOOP = loop
+            info(f"专用事件循环已启动，IO线程数: {ASYNC_IO_WORKERS}")
+    return _LOOP
+
+
+def in_loop_thread() -> bool:
+    """当前是否运行在专用事件循环线程中"""
+    return _THREAD is not None and threading.current_thread() is _THREAD
+
+
+def submit(coro: Coroutine) -> Future:
+    """将协程提交到专用事件循环，返回 concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_sync(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """在专用事件循环上运行协程并阻塞等待结果，供同步代码（Flask视图）调用"""
+    if in_loop_thread():
+        coro.close()
+        raise RuntimeError("不能在专用事件循环线程内同步等待协程，请直接 await")
+    return submit(coro).result(timeout)
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from config import Config
+from log import debug
+
+# 短期记忆：每个用户在内存中保留的最近对话轮数（Agent 提示词使用最近3轮）
+CHAT_MEMORY_TURNS = getattr(Config, 'CHAT_MEMORY_TURNS', 3)
+# 内存中最多保留的用户数，超出时淘汰最久未访问的用户
+CHAT_MEMORY_MAX_USERS = getattr(Config, 'CHAT_MEMORY_MAX_USERS', 1000)
+
+# user_id -> 最近的对话记录（旧 -> 新），按访问顺序排列用于LRU淘汰
+_BUFFERS: "OrderedDict[int, deque]" = OrderedDict()
+# user_id -> 写入/失效次数；从数据库回填期间有新写入或失效时放弃回填，避免覆盖较新的数据
+_VERSIONS: Dict[int, int] = {}
+_EPOCH = 0  # 全部失效的次数
+_CLEARS: Dict[int, int] = {}  # user_id -> 失效次数
+# user_id -> 对话滚动摘要（见 conversation_summary.py，无摘要时为None），与对话缓冲一同淘汰和失效
+_SUMMARIES: "OrderedDict[int, Optional[dict]]" = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _bump(user_id: int) -> None:
+    _VERSIONS[user_id] = _VERSIONS.get(user_id, 0) + 1
+
+
+def record(user_id: int, entry: dict) -> None:
+    """写穿：对话记录写入数据库后追加到该用户的缓冲；用户不在内存中时不创建（下次读取时从数据库回填）"""
+    with _LOCK:
+        _bump(user_id)
+        buf = _BUFFERS.get(user_id)
+        if buf is not None:
+            buf.append(entry)
+            _BUFFERS.move_to_end(user_id)
+
+
+def recent(user_id: int, limit: int, loader: Callable[[int], List[dict]]) -> List[dict]:
+    """最近 limit 条对话记录（旧 -> 新）：命中内存直接返回；未命中（首次访问、被淘汰或进程重启后）
+    调用 loader(CHAT_MEMORY_TURNS) 从数据库读取并回填；limit 超过缓冲容量时直接查询数据库"""
+    if limit > CHAT_MEMORY_TURNS:
+        return loader(limit)
+    with _LOCK:
+        buf = _BUFFERS.get(user_id)
+        if buf is not None:
+            _BUFFERS.move_to_end(user_id)
+            metrics.incr('chat_memory.hit')
+            return list(buf)[-limit:] if limit > 0 else []
+        version = (_EPOCH, _VERSIONS.get(user_id, 0))
+    metrics.incr('chat_memory.miss')
+    records = loader(CHAT_MEMORY_TURNS)
+    with _LOCK:
+        if (_EPOCH, _VERSIONS.get(user_id, 0)) == version and user_id not in _BUFFERS:
+            _BUFFERS[user_id] = deque(records, maxlen=CHAT_MEMORY_TURNS)
+            while len(_BUFFERS) > CHAT_MEMORY_MAX_USERS:
+                evicted, _ = _BUFFERS.popitem(last=False)
+                _SUMMARIES.pop(evicted, None)
+                debug(f"短期记忆淘汰用户 - 用户ID: {evicted}")
+        metrics.set_gauge('chat_memory.users', len(_BUFFERS))
+    return records[-limit:] if limit > 0 else []
+
+
+def summary(user_id: int, loader: Callable[[], Optional[dict]]) -> Optional[dict]:
+    """用户的对话滚动摘要：命中内存直接返回，未命中时调用 loader() 从数据库读取并缓存"""
+    with _LOCK:
+        if user_id in _SUMMARIES:
+            _SUMMARIES.move_to_end(user_id)
+            return _SUMMARIES[user_id]
+        version = (_EPOCH, _CLEARS.get(user_id, 0))
+    value = loader()
+    with _LOCK:
+        if (_EPOCH, _CLEARS.get(user_id, 0)) == version and user_id not in _SUMMARIES:
+            _SUMMARIES[user_id] = value
+            while len(_SUMMARIES) > CHAT_MEMORY_MAX_USERS:
+                _SUMMARIES.popitem(last=False)
+    return value
+
+
+def set_summary(user_id: int, value: Optional[dict]) -> None:
+    """写穿：滚动摘要保存到数据库后更新内存"""
+    with _LOCK:
+        _SUMMARIES[user_id] = value
+        _SUMMARIES.move_to_end(user_id)
+        while len(_SUMMARIES) > CHAT_MEMORY_MAX_USERS:
+            _SUMMARIES.popitem(last=False)
+
+
+def clear_version(user_id: int) -> tuple:
+    """用户记忆的失效版本号，用于判断后台任务执行期间记忆是否被清除"""
+    with _LOCK:
+        return _EPOCH, _CLEARS.get(user_id, 0)
+
+
+def invalidate(user_id: Optional[int] = None) -> None:
+    """清除用户（user_id 为None时为全部用户）的内存缓冲，如对话记录被删除后"""
+    global _EPOCH
+    with _LOCK:
+        if user_id is None:
+            _EPOCH += 1
+            _BUFFERS.clear()
+            _SUMMARIES.clear()
+        else:
+            _bump(user_id)
+            _CLEARS[user_id] = _CLEARS.get(user_id, 0) + 1
+            _BUFFERS.pop(user_id, None)
+            _SUMMARIES.pop(user_id, None)
+        metrics.set_gauge('chat_memory.users', len(_BUFFERS))
+    debug(f"短期记忆已失效 - 用户ID: {user_id if user_id is not None else '全部'}")
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import metrics
+from config import Config
+from llm_errors import LLMUnavailableError
+from log import info, warning
+
+# 熔断配置（按模型地址）
+LLM_CIRCUIT_ENABLED = getattr(Config, 'LLM_CIRCUIT_ENABLED', True)
+LLM_CIRCUIT_FAILURE_THRESHOLD = getattr(Config, 'LLM_CIRCUIT_FAILURE_THRESHOLD', 5)
+LLM_CIRCUIT_ERROR_RATE_THRESHOLD = getattr(Config, 'LLM_CIRCUIT_ERROR_RATE_THRESHOLD', 0.5)
+LLM_CIRCUIT_WINDOW = getattr(Config, 'LLM_CIRCUIT_WINDOW', 20)
+LLM_CIRCUIT_MIN_CALLS = getattr(Config, 'LLM_CIRCUIT_MIN_CALLS', 10)
+LLM_CIRCUIT_COOLDOWN_SECONDS = getattr(Config, 'LLM_CIRCUIT_COOLDOWN_SECONDS', 30)
+LLM_CIRCUIT_HALF_OPEN_MAX_CALLS = getattr(Config, 'LLM_CIRCUIT_HALF_OPEN_MAX_CALLS', 1)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """端点熔断已打开，请求被立即拒绝（不会发往上游）"""
+
+    def __init__(self, url: str, retry_in: float):
+        self.url = url
+        self.retry_in = retry_in
+        super().__init__(f"模型端点熔断中 - URL: {url}, {retry_in:.0f}秒后重试")
+
+
+def is_endpoint_failure(e: Exception) -> bool:
+    """是否计入熔断的失败：连接错误、超时（无HTTP状态码）、5xx 与 429；
+    4xx 请求错误（如参数错误、模型不存在）说明端点本身可用，不计入；
+    本地限流/熔断拒绝、任务取消（CancelledError/GeneratorExit）与端点无关，也不计入"""
+    if not isinstance(e, Exception) or isinstance(e, LLMUnavailableError):
+        return False
+    status = getattr(e, 'status_code', None)
+    return status is None or status >= 500 or status == 429
+
+
+class CircuitBreaker:
+    """单个模型地址的熔断器：
+    closed：正常放行，连续失败次数或窗口内错误率超过阈值时打开；
+    open：立即拒绝，冷却时间过后进入半开；
+    half_open：只放行少量试探请求，成功则关闭，失败则重新打开"""
+
+    def __init__(self, url: str, failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD,
+                 error_rate_threshold: float = LLM_CIRCUIT_ERROR_RATE_THRESHOLD, window: int = LLM_CIRCUIT_WINDOW,
+                 min_calls: int = LLM_CIRCUIT_MIN_CALLS, cooldown: float = LLM_CIRCUIT_COOLDOWN_SECONDS,
+                 half_open_max_calls: int = LLM_CIRCUIT_HALF_OPEN_MAX_CALLS):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._half_open_calls = 0
+        self._outcomes = deque(maxlen=window)  # 最近调用结果，True为成功
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        """切换状态（需持有锁）"""
+        if state == self.state:
+            return
+        old, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            metrics.incr('llm_circuit.opened')
+            warning(f"模型端点熔断打开 - URL: {self.url}, 连续失败: {self.consecutive_failures}, 冷却: {self.cooldown}秒")
+        elif state == CLOSED:
+            self.consecutive_failures = 0
+            self._outcomes.clear()
+            info(f"模型端点熔断关闭，恢复正常 - URL: {self.url}")
+        if state == HALF_OPEN or old == HALF_OPEN:
+            self._half_open_calls = 0
+
+    def before_call(self) -> None:
+        """调用上游前检查，熔断打开时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    metrics.incr('llm_circuit.rejected')
+                    raise CircuitOpenError(self.url, remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    metrics.incr('llm_circuit.rejected')
+                    raise CircuitOpenError(self.url, self.cooldown)
+                self._half_open_calls += 1
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._outcomes.append(True)
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+
+    def on_failure(self, e: Optional[BaseException] = None) -> None:
+        if e is not None and not is_endpoint_failure(e):
+            # 不计入熔断，但半开状态下需要归还试探名额
+            with self._lock:
+                if self.state == HALF_OPEN and self._half_open_calls > 0:
+                    self._half_open_calls -= 1
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            self._outcomes.append(False)
+            if self.state == HALF_OPEN:
+                self._transition(OPEN)
+            elif self.state == CLOSED and self._should_open():
+                self._transition(OPEN)
+
+    def _should_open(self) -> bool:
+        if self.consecutive_failures >= self.failure_threshold:
+            return True
+        if len(self._outcomes) < self.min_calls:
+            return False
+        errors = sum(1 for ok in self._outcomes if not ok)
+        return errors / len(self._outcomes) >= self.error_rate_threshold
+
+    @property
+    def allows_requests(self) -> bool:
+        """当前是否可能放行请求（不占用半开试探名额），供路由排序使用"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() >= self.opened_at + self.cooldown
+            if self.state == HALF_OPEN:
+                return self._half_open_calls < self.half_open_max_calls
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'url': self.url,
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'window_errors': sum(1 for ok in self._outcomes if not ok),
+                'window_calls': len(self._outcomes),
+            }
+
+
+# 进程级熔断器表：model_url -> CircuitBreaker
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_LOCK = threading.Lock()
+
+
+def get_breaker(url: str) -> Optional[CircuitBreaker]:
+    """获取模型地址对应的熔断器；未开启 LLM_CIRCUIT_ENABLED 时返回None"""
+    if not LLM_CIRCUIT_ENABLED:
+        return None
+    key = (url or '').rstrip('/')
+    breaker = _BREAKERS.get(key)
+    if breaker is None:
+        with _LOCK:
+            breaker = _BREAKERS.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key)
+                _BREAKERS[key] = breaker
+    return breaker
+
+
+def snapshot() -> list:
+    with _LOCK:
+        items = list(_BREAKERS.values())
+    return [b.stats() for b in items]
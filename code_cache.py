@@ -0,0 +1,65 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import metrics
+from config import Config
+from log import debug
+
+# 编译缓存配置，默认从配置读取
+CODE_CACHE_MAX_ENTRIES = getattr(Config, 'CODE_CACHE_MAX_ENTRIES', 4096)
+
+# (sha256(code_content), tool_name) -> (编译后的代码对象, 提取出的函数)，按访问顺序排列用于LRU淘汰；
+# 进程内所有用户共享，相同代码的工具（如共享的 tool_flag=0 工具）只编译执行一次
+_ENTRIES: "OrderedDict[Tuple[str, Optional[str]], tuple]" = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def code_digest(code_content: str) -> str:
+    return hashlib.sha256(code_content.encode('utf-8')).hexdigest()
+
+
+def get_function(code_content: str, tool_name: Optional[str], loader: Callable) -> Callable:
+    """按代码内容获取工具函数：命中缓存直接返回；未命中时编译代码并调用 loader(代码对象, tool_name) 提取函数后缓存。
+    编译或提取失败时异常原样抛出，不缓存"""
+    key = (code_digest(code_content), tool_name)
+    with _LOCK:
+        entry = _ENTRIES.get(key)
+        if entry is not None:
+            _ENTRIES.move_to_end(key)
+    if entry is not None:
+        metrics.incr('code_cache.hit')
+        return entry[1]
+    metrics.incr('code_cache.miss')
+    code = compile(code_content, f'<tool:{tool_name or key[0][:12]}>', 'exec')
+    function = loader(code, tool_name)
+    with _LOCK:
+        _ENTRIES[key] = (code, function)
+        while len(_ENTRIES) > CODE_CACHE_MAX_ENTRIES:
+            _ENTRIES.popitem(last=False)
+            metrics.incr('code_cache.evicted')
+        size = len(_ENTRIES)
+    metrics.set_gauge('code_cache.entries', size)
+    debug(f"编译工具代码 - 工具: {tool_name}, 摘要: {key[0][:12]}")
+    return function
+
+
+def clear() -> None:
+    with _LOCK:
+        _ENTRIES.clear()
+    metrics.set_gauge('code_cache.entries', 0)
+
+
+def stats() -> dict:
+    counters = metrics.snapshot()['counters']
+    hits = counters.get('code_cache.hit', 0)
+    misses = counters.get('code_cache.miss', 0)
+    with _LOCK:
+        size = len(_ENTRIES)
+    return {
+        'entries': size,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0,
+    }
@@ -44,6 +44,131 @@ class Config:
     TOOLS_CACHE_TTL_SECONDS = 300  # 工具缓存TTL默认5分钟
     MODELS_CACHE_TTL_SECONDS = 300  # 模型缓存TTL默认5分钟
 
+    # LLM客户端连接池配置（llm_pool.py，按 模型地址+API Key指纹+超时 共享客户端）
+    LLM_TIMEOUT_SECONDS = 30  # LLM请求默认超时（秒）
+    LLM_POOL_MAX_CONNECTIONS = 100  # 单个端点最大连接数
+    LLM_POOL_MAX_KEEPALIVE_CONNECTIONS = 20  # 单个端点保持的keep-alive连接数
+    LLM_POOL_KEEPALIVE_EXPIRY_SECONDS = 60  # keep-alive连接空闲过期时间（秒）
+    LLM_CLIENT_IDLE_SECONDS = 600  # 共享客户端空闲多久后回收（秒）
+
+    # LLM响应缓存配置（llm_cache.py，默认关闭，按需开启）
+    LLM_CACHE_ENABLED = False  # 是否启用LLM响应缓存
+    LLM_CACHE_MAX_ENTRIES = 1000  # 内存LRU最大条目数
+    LLM_CACHE_TTL_SECONDS = 3600  # 默认缓存有效期（秒）
+    LLM_CACHE_MODEL_TTLS = {}  # 按模型名覆盖TTL，例如 {'qwen2:7b': 600}；值<=0表示该模型不缓存
+    LLM_CACHE_ALLOW_NONZERO_TEMPERATURE = False  # 温度>0的请求默认不缓存，True表示允许
+    LLM_CACHE_SQLITE_ENABLED = False  # 是否启用SQLite持久层
+    LLM_CACHE_DB_PATH = os.path.join(BASE_DIR, 'db', 'llm_cache.sqlite3')  # 持久层文件路径（与DB_PATH同目录）
+    LLM_SINGLEFLIGHT_ENABLED = True  # 合并并发的相同LLM请求，只向上游发起一次调用
+
+    # 多端点路由配置（llm_router.py，model_info.model_group 相同的模型组成端点池）
+    LLM_ROUTER_EWMA_ALPHA = 0.3  # 端点延迟/错误率EWMA平滑系数
+    LLM_ROUTER_UNHEALTHY_ERROR_RATE = 0.5  # 错误率EWMA超过该值视为不健康端点
+    LLM_HEDGE_ENABLED = False  # 是否启用对冲请求
+    LLM_HEDGE_DEFAULT_DELAY_MS = 2000  # 样本不足时的对冲延迟（毫秒），样本充足时使用主端点p95
+    LLM_HEDGE_MIN_DELAY_MS = 200  # 对冲延迟下限（毫秒）
+    LLM_HEDGE_WORKERS = 16  # 同步对冲请求线程数
+    LLM_PROBE_ENABLED = True  # 是否后台探测端点池中的端点
+    LLM_PROBE_INTERVAL_SECONDS = 30  # 探测间隔（秒）
+
+    # 模型端点限流配置（rate_limiter.py，按模型地址分别限流）：只限流 LLM_RATE_LIMITS 中列出的地址，
+    # 未列出的地址不限速，仅在上游返回429后按 Retry-After 暂停发放许可
+    LLM_RATE_LIMIT_ENABLED = True  # 是否启用限流（关闭后429暂停也不生效）
+    LLM_RATE_LIMIT_DEFAULT = {  # LLM_RATE_LIMITS 中各地址未给出的字段取此默认值
+        'rps': 10,  # 每秒请求数（令牌桶速率），<=0 表示不限
+        'burst': 20,  # 令牌桶容量（允许的突发请求数）
+        'max_concurrency': 8,  # 最大并发在途请求数，<=0 表示不限
+        'max_queue': 100,  # 等待队列上限，队列已满时直接拒绝
+        'queue_timeout': 30,  # 排队超时（秒）
+    }
+    LLM_RATE_LIMITS = {}  # 需要限流的模型地址，如 {'http://localhost:11434/v1': {'rps': 2, 'max_concurrency': 1}}
+    LLM_RATE_LIMIT_BACKOFF_SECONDS = 1.0  # 上游返回429且无 Retry-After 时暂停发放许可的时长（秒）
+
+    # 模型端点熔断配置（circuit_breaker.py，按模型地址，熔断打开时请求立即失败并终止剩余计划）
+    LLM_CIRCUIT_ENABLED = True  # 是否启用熔断
+    LLM_CIRCUIT_FAILURE_THRESHOLD = 5  # 连续失败次数达到该值时打开熔断
+    LLM_CIRCUIT_ERROR_RATE_THRESHOLD = 0.5  # 最近窗口内错误率达到该值时打开熔断
+    LLM_CIRCUIT_WINDOW = 20  # 错误率统计窗口（最近调用次数）
+    LLM_CIRCUIT_MIN_CALLS = 10  # 窗口内调用次数不少于该值才按错误率判断
+    LLM_CIRCUIT_COOLDOWN_SECONDS = 30  # 熔断打开后的冷却时间（秒），之后进入半开状态
+    LLM_CIRCUIT_HALF_OPEN_MAX_CALLS = 1  # 半开状态允许的试探请求数
+
+    # Agent各阶段生成参数（generation_settings.py）：默认取模型记录的 temperature/max_tokens，以下配置覆盖对应字段
+    # 阶段：plan 规划、parse 工具参数解析、answer 直接回答、follow_up 追问、summary 基于工具结果总结、tool_call 工具调用模式
+    # disable_thinking：关闭推理模型的思考过程（请求体附加 LLM_DISABLE_THINKING_EXTRA_BODY）。默认关闭：严格兼容 OpenAI 的接口
+    # 会以 400 拒绝未知的请求体字段，Ollama 则忽略该字段；只对支持 chat_template_kwargs 的部署（vLLM/SGLang）按模型开启。
+    # 默认不限制各阶段的 max_tokens：推理模型先输出 <think> 思考过程，过小的上限会在思考中途截断
+    STAGE_GENERATION_DEFAULTS = {
+        'plan': {'temperature': 0},
+        'parse': {'temperature': 0},
+        'tool_call': {'temperature': 0},
+        'memory': {'temperature': 0},
+    }
+    # 按模型名覆盖，如关闭思考过程后缩短规划与参数解析的输出：
+    # {'qwen3-8b': {'plan': {'disable_thinking': True, 'max_tokens': 512}, 'parse': {'disable_thinking': True, 'max_tokens': 256}}}
+    STAGE_GENERATION_MODEL_OVERRIDES = {}
+    LLM_DISABLE_THINKING_EXTRA_BODY = {'chat_template_kwargs': {'enable_thinking': False}}  # 关闭思考过程的请求体参数（vLLM/SGLang）
+
+    # 工具调用模式（tool_calling.py）：auto 依次尝试原生 tools/tool_calls 与JSON模式，端点都不支持时回退到提示词规划流程；
+    # native / json 只尝试指定模式；prompt 始终使用提示词规划流程（create_plan + parse_user_input）
+    AGENT_TOOL_CALLING_MODE = 'auto'
+    AGENT_MAX_TOOL_ROUNDS = 4  # 单次查询中工具调用的最大轮数
+    PLAN_MAX_PARALLEL_STEPS = 4  # 提示词规划流程中可并发执行的工具步骤数（按计划的 depends_on 调度）
+
+    # 快速路由（fast_router.py）：算术表达式、"/<工具名> <参数>" 命令与工具路由正则命中时不调用LLM，直接执行工具
+    FAST_ROUTER_ENABLED = True
+    FAST_ROUTER_MAX_OPERATIONS = 16  # 算术表达式的最多运算次数，超出时交给LLM处理
+    FAST_ROUTER_ARITHMETIC_TEMPLATE = '计算结果：{expression} = {result}'
+
+    # 工具检索（tool_index.py）：按工具名、描述、标签与参数描述建立 BM25 索引，提示词中只包含与问题最相关的k个工具
+    TOOL_RETRIEVAL_TOP_K = 8  # 0 表示不筛选，发送全部工具
+
+    # 短期记忆（chat_memory.py）：每个用户最近的对话轮次缓存在内存中（写入对话记录时同步追加），未命中时从数据库回填
+    CHAT_MEMORY_TURNS = 3  # 每个用户保留的轮数（Agent 提示词使用最近3轮）
+    CHAT_MEMORY_MAX_USERS = 1000  # 内存中最多保留的用户数，超出时淘汰最久未访问的用户
+
+    # 对话滚动摘要（conversation_summary.py）：每轮对话后由后台任务把新的对话折叠进每个用户的摘要，提示词使用 摘要 + 最近一轮
+    ROLLING_SUMMARY_ENABLED = True
+    ROLLING_SUMMARY_BATCH_TURNS = 5  # 每次最多折叠的对话轮数
+    ROLLING_SUMMARY_TURN_TOKENS = 512  # 折叠时每轮对话回复截断到的token数
+
+    # 长期记忆（long_term_memory.py）：每轮对话向量化后写入按用户划分的向量索引（持久化在数据库同目录），规划时检索最相关的历史对话
+    LONG_TERM_MEMORY_ENABLED = True
+    LONG_TERM_MEMORY_DIR = os.path.join(BASE_DIR, 'db', 'memory_index')  # 索引文件目录
+    LONG_TERM_MEMORY_DIM = 128  # 默认哈希向量化的维度（每用户10万轮对话约占50MB内存）
+    LONG_TERM_MEMORY_TOP_K = 3  # 规划提示词中最多包含的历史对话条数
+    LONG_TERM_MEMORY_MIN_SCORE = 0.3  # 余弦相似度低于该值的历史对话不使用
+    LONG_TERM_MEMORY_MAX_USERS = 100  # 内存中最多保留的用户索引数，超出时淘汰最久未访问的用户
+    LONG_TERM_MEMORY_BUILD_BATCH = 500  # 索引在后台线程中构建，每批读取并向量化的对话数（构建完成前检索返回空）
+
+    # 语义缓存（semantic_cache.py）：近似问题（MinHash/LSH + Jaccard 确认）直接返回缓存的计划与回答，
+    # 按 (用户, 工具注册表版本, 模型, 对话历史摘要) 区分，只缓存全部工具步骤都成功调用了可缓存工具（is_cacheable）的问答
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_THRESHOLD = 0.7  # 规范化后问题特征的 Jaccard 相似度阈值
+    SEMANTIC_CACHE_TTL_SECONDS = 600  # 缓存有效期（秒）
+    SEMANTIC_CACHE_MAX_ENTRIES = 2000  # 最大条目数，超出时淘汰最久未命中的条目
+
+    # 工具沙箱（tool_sandbox.py）：用户代码注册的工具在常驻的沙箱进程池中执行，可信的内置工具仍在当前进程内执行
+    TOOL_SANDBOX_ENABLED = True
+    TOOL_SANDBOX_WORKERS = 4  # 沙箱进程数
+    TOOL_SANDBOX_TIMEOUT_SECONDS = 30  # 单次调用的墙钟时间上限（不含排队），超时终止并替换进程
+    TOOL_SANDBOX_QUEUE_TIMEOUT_SECONDS = 30  # 所有进程都在执行时等待空闲进程的时间上限，超时返回沙箱繁忙
+    TOOL_SANDBOX_CPU_SECONDS = 10  # 单次调用的CPU时间上限（RLIMIT_CPU）
+    TOOL_SANDBOX_MEMORY_MB = 512  # 沙箱进程的内存上限（RLIMIT_AS），0 表示不限制
+    TOOL_SANDBOX_MAX_CALLS = 200  # 进程执行该次数后替换为新进程
+
+    # 工具代码编译缓存（code_cache.py）：按 sha256(代码内容) 在进程内共享编译后的代码对象与函数，重建工具注册表时未变化的代码不再重新执行
+    CODE_CACHE_MAX_ENTRIES = 4096  # 最大条目数，超出时淘汰最久未使用的条目
+
+    # 提示词预算配置（prompt_budget.py，超出预算时按优先级裁剪历史对话、工具schema与步骤结果）
+    PROMPT_CONTEXT_TOKENS = 8192  # 默认模型上下文窗口（token）
+    PROMPT_MODEL_CONTEXT_TOKENS = {}  # 按模型名覆盖上下文窗口，如 {'qwen2.5:7b': 32768}
+    PROMPT_RESERVED_OUTPUT_TOKENS = 2048  # 为模型输出预留的token数
+    PROMPT_TOKENIZER = 'heuristic'  # token计数方式：heuristic（启发式估算）或 tiktoken（需安装tiktoken）
+
+    # 异步执行配置（async_runtime.py，Agent流程运行在进程内专用事件循环上）
+    ASYNC_IO_WORKERS = 32  # 事件循环中阻塞操作（工具执行、数据库读写）使用的线程数
+
     # 应用运行配置（按需使用）
     DEBUG = True  # Flask调试模式
     HOST = '0.0.0.0'  # 服务监听地址
@@ -0,0 +1,93 @@
+import asyncio
+from typing import Dict, Optional, Set
+
+import chat_memory
+import metrics
+import prompt_budget
+from config import Config
+from database import db
+from llm_errors import LLMUnavailableError
+from log import debug, info, warning, exception
+from prompt import create_rolling_summary_prompt
+
+# 对话滚动摘要：每轮对话结束后由后台任务把新的对话轮次折叠进每个用户的摘要（chat_summaries 表），
+# Agent 提示词使用 摘要 + 最近一轮 代替多轮完整回复，提示词大小不随对话变长而增长
+ROLLING_SUMMARY_ENABLED = getattr(Config, 'ROLLING_SUMMARY_ENABLED', True)
+ROLLING_SUMMARY_BATCH_TURNS = getattr(Config, 'ROLLING_SUMMARY_BATCH_TURNS', 5)
+ROLLING_SUMMARY_TURN_TOKENS = getattr(Config, 'ROLLING_SUMMARY_TURN_TOKENS', 512)
+
+# user_id -> 正在执行的折叠任务；任务执行期间又有新对话时记入 _PENDING，任务结束前再折叠一次
+_TASKS: Dict[int, asyncio.Task] = {}
+_PENDING: Set[int] = set()
+
+
+def get_summary(user_id: int) -> Optional[dict]:
+    """用户当前的滚动摘要 {'summary', 'last_record_id', 'turns'}（优先读取内存），未开启或尚无摘要时返回None"""
+    if not ROLLING_SUMMARY_ENABLED:
+        return None
+    return chat_memory.summary(user_id, lambda: db.get_chat_summary(user_id))
+
+
+def schedule(llm, user_id: int, settings: Optional[dict] = None) -> None:
+    """在后台折叠该用户新的对话轮次，不阻塞当前请求；需在专用事件循环中调用（如 aprocess_query 内）"""
+    if not ROLLING_SUMMARY_ENABLED:
+        return
+    if user_id in _TASKS:
+        _PENDING.add(user_id)
+        return
+    task = asyncio.get_running_loop().create_task(_arun(llm, user_id, dict(settings or {})))
+    _TASKS[user_id] = task
+
+
+async def _arun(llm, user_id: int, settings: dict) -> None:
+    try:
+        while True:
+            _PENDING.discard(user_id)
+            await _afold(llm, user_id, settings)
+            if user_id not in _PENDING:
+                break
+    except asyncio.CancelledError:
+        raise
+    except LLMUnavailableError as e:
+        metrics.incr('conversation_summary.failed')
+        warning(f"模型服务不可用，对话摘要推迟到下一轮对话后更新 - 用户ID: {user_id}, 错误: {e}")
+    except RuntimeError as e:
+        # 进程退出时线程池已关闭，未完成的折叠留到下次启动后的对话再做
+        metrics.incr('conversation_summary.failed')
+        warning(f"对话摘要未能更新 - 用户ID: {user_id}, 错误: {e}")
+    except Exception as e:
+        metrics.incr('conversation_summary.failed')
+        exception(f"更新对话摘要失败 - 用户ID: {user_id}, 错误: {e}")
+    finally:
+        _TASKS.pop(user_id, None)
+
+
+async def _afold(llm, user_id: int, settings: dict) -> None:
+    """把摘要之后的新对话（最多 ROLLING_SUMMARY_BATCH_TURNS 轮）折叠进摘要；失败的轮次留到下次一起折叠"""
+    cleared = chat_memory.clear_version(user_id)
+    current = await asyncio.to_thread(get_summary, user_id)
+    after = current['last_record_id'] if current else 0
+    records = await asyncio.to_thread(db.get_chat_history_after, user_id, after, ROLLING_SUMMARY_BATCH_TURNS)
+    if not records:
+        return
+    turns = "\n".join(
+        f"[用户问题: {r['user_message']}; AI回应: {prompt_budget.truncate_text(r.get('bot_response') or '', ROLLING_SUMMARY_TURN_TOKENS)}]"
+        for r in records)
+    prompt = create_rolling_summary_prompt(current['summary'] if current else '', turns)
+    chat = getattr(llm, 'achat_or_raise', None) or llm.achat
+    text = await chat(prompt, allow_cache=False, **settings)
+    text = (text or '').split('</think>')[-1].strip()
+    if not text:
+        warning(f"对话摘要生成结果为空，跳过 - 用户ID: {user_id}")
+        return
+    if chat_memory.clear_version(user_id) != cleared:
+        debug(f"对话记录已被清除，丢弃本次摘要 - 用户ID: {user_id}")
+        return
+    value = {'summary': text, 'last_record_id': records[-1]['id'], 'turns': (current['turns'] if current else 0) + len(records)}
+    if await asyncio.to_thread(db.save_chat_summary, user_id, value['summary'], value['last_record_id'], value['turns']):
+        chat_memory.set_summary(user_id, value)
+        metrics.incr('conversation_summary.folded_turns', len(records))
+        info(f"对话摘要已更新 - 用户ID: {user_id}, 新折叠轮数: {len(records)}, 摘要长度: {len(text)}")
+    if len(records) == ROLLING_SUMMARY_BATCH_TURNS:
+        # 还有未折叠的对话，继续下一批
+        _PENDING.add(user_id)
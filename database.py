@@ -1,6 +1,7 @@
 # 导入系统模块
 import sys
 import os
+from datetime import datetime
 
 # 将当前目录添加到Python路径中，确保模块可以被正确导入
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -13,6 +14,8 @@ from db.chat_manager import ChatManager
 from db.model_manager import ModelManager
 from db.function_tool_manager import FunctionToolManager
 from config import Config
+import chat_memory
+import long_term_memory
 
 
 # 修改设计模式，使用单一继承方式，避免多次初始化数据库连接，SQLite不允许在同一个连接中递归创建游标，所以避免页面初始化刷新创建游标，使用如下方式。
@@ -40,15 +43,51 @@ class ChatDatabase(DatabaseConnection):
         
     def add_chat_record(self, user_message, plan, bot_response, user_id, model_name):
         manager = ChatManager(self.db_path)
-        return manager.add_chat_record(user_message, plan, bot_response, user_id, model_name)
+        record_id = manager.add_chat_record(user_message, plan, bot_response, user_id, model_name)
+        if record_id > 0:
+            # 写穿到短期记忆缓冲与长期记忆索引
+            entry = {
+                'id': record_id, 'user_id': user_id, 'plan': plan, 'user_message': user_message,
+                'bot_response': bot_response, 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'model_name': model_name,
+            }
+            chat_memory.record(user_id, entry)
+            long_term_memory.record(user_id, entry)
+        return record_id
         
     def get_chat_history(self, user_id=None, limit=None):
         manager = ChatManager(self.db_path)
         return manager.get_chat_history(user_id, limit)
         
-    def add_model(self, user_id, model_name, model_url, api_key=None, temperature=0.7, max_tokens=2048, desc=None, model_flag=1):
+    def get_chat_history_after(self, user_id, after_id, limit=None):
+        manager = ChatManager(self.db_path)
+        return manager.get_chat_history_after(user_id, after_id, limit)
+        
+    def get_chat_records(self, user_id, record_ids):
+        manager = ChatManager(self.db_path)
+        return manager.get_chat_records(user_id, record_ids)
+        
+    def search_long_term_memory(self, user_id, query, k=long_term_memory.LONG_TERM_MEMORY_TOP_K, exclude_ids=()):
+        """长期记忆：与问题语义最相关的历史对话记录（按相关度降序），跳过 exclude_ids 中的记录"""
+        hits = long_term_memory.search(user_id, query, lambda after, limit: self.get_chat_history_after(user_id, after, limit),
+                                       k, exclude_ids)
+        return self.get_chat_records(user_id, [record_id for record_id, _ in hits])
+        
+    def get_chat_summary(self, user_id):
+        manager = ChatManager(self.db_path)
+        return manager.get_chat_summary(user_id)
+        
+    def save_chat_summary(self, user_id, summary, last_record_id, turns):
+        manager = ChatManager(self.db_path)
+        return manager.save_chat_summary(user_id, summary, last_record_id, turns)
+        
+    def get_recent_chat_history(self, user_id, limit=chat_memory.CHAT_MEMORY_TURNS):
+        """最近的对话记录（短期记忆）：优先从内存缓冲读取，未命中时查询数据库并回填"""
+        return chat_memory.recent(user_id, limit, lambda n: self.get_chat_history(user_id, n))
+        
+    def add_model(self, user_id, model_name, model_url, api_key=None, temperature=0.7, max_tokens=2048, desc=None, model_flag=1, model_group=None):
         manager = ModelManager(self.db_path)
-        return manager.add_model(user_id, model_name, model_url, api_key, temperature, max_tokens, desc, model_flag)
+        return manager.add_model(user_id, model_name, model_url, api_key, temperature, max_tokens, desc, model_flag, model_group)
         
     def get_all_models(self):
         manager = ModelManager(self.db_path)
@@ -62,9 +101,29 @@ class ChatDatabase(DatabaseConnection):
         manager = FunctionToolManager(self.db_path)
         return manager.get_all_function_tools(user_id)
         
-    def add_function_tool(self, user_id, tool_name, description, parameters, is_active=True, tool_flag=0, label='通用', code_content=None):
+    def get_public_function_tools(self):
+        manager = FunctionToolManager(self.db_path)
+        return manager.get_public_function_tools()
+        
+    def get_private_function_tools(self, user_id):
+        manager = FunctionToolManager(self.db_path)
+        return manager.get_private_function_tools(user_id)
+        
+    def get_public_function_tools_fingerprint(self):
+        manager = FunctionToolManager(self.db_path)
+        return manager.get_public_function_tools_fingerprint()
+        
+    def get_private_function_tools_fingerprint(self, user_id):
+        manager = FunctionToolManager(self.db_path)
+        return manager.get_private_function_tools_fingerprint(user_id)
+        
+    def add_function_tool(self, user_id, tool_name, description, parameters, is_active=True, tool_flag=0, label='通用', code_content=None, route_hint=None, is_cacheable=False):
+        manager = FunctionToolManager(self.db_path)
+        return manager.add_function_tool(user_id=user_id, tool_name=tool_name, description=description, parameters=parameters, is_active=is_active, tool_flag=tool_flag, label=label, code_content=code_content, route_hint=route_hint, is_cacheable=is_cacheable)
+        
+    def backfill_builtin_tool(self, user_id, tool_name, code_content, route_hint=None, is_cacheable=False):
         manager = FunctionToolManager(self.db_path)
-        return manager.add_function_tool(user_id=user_id, tool_name=tool_name, description=description, parameters=parameters, is_active=is_active, tool_flag=tool_flag, label=label, code_content=code_content)
+        return manager.backfill_builtin_tool(user_id=user_id, tool_name=tool_name, code_content=code_content, route_hint=route_hint, is_cacheable=is_cacheable)
         
     def get_user_info(self, user_id):
         manager = UserManager(self.db_path)
@@ -92,7 +151,12 @@ class ChatDatabase(DatabaseConnection):
         
     def delete_chat_history(self, user_id=None):
         manager = ChatManager(self.db_path)
-        return manager.delete_chat_history(user_id)
+        deleted = manager.delete_chat_history(user_id)
+        # 对话记录删除后，短期记忆、滚动摘要与长期记忆索引一并清除
+        manager.delete_chat_summary(user_id)
+        chat_memory.invalidate(user_id)
+        long_term_memory.invalidate(user_id)
+        return deleted
         
     def get_model_by_id(self, user_id, model_id):
         manager = ModelManager(self.db_path)
@@ -102,9 +166,9 @@ class ChatDatabase(DatabaseConnection):
         manager = ModelManager(self.db_path)
         return manager.get_user_model_by_id(user_id)
         
-    def update_model(self, user_id, model_id, model_name=None, model_url=None, api_key=None, temperature=None, max_tokens=None, is_active=None, desc=None, model_flag=None):
+    def update_model(self, user_id, model_id, model_name=None, model_url=None, api_key=None, temperature=None, max_tokens=None, is_active=None, desc=None, model_flag=None, model_group=None):
         manager = ModelManager(self.db_path)
-        return manager.update_model(user_id, model_id, model_name, model_url, api_key, temperature, max_tokens, is_active, desc, model_flag)
+        return manager.update_model(user_id, model_id, model_name, model_url, api_key, temperature, max_tokens, is_active, desc, model_flag, model_group)
         
     def get_function_tool_by_id(self, user_id, tool_id):
         manager = FunctionToolManager(self.db_path)
@@ -118,9 +182,9 @@ class ChatDatabase(DatabaseConnection):
         manager = FunctionToolManager(self.db_path)
         return manager.get_function_tool_name(tool_name)
         
-    def update_function_tool(self, user_id, tool_id, tool_name=None, description=None, parameters=None, is_active=None, tool_flag=None, label=None, code_content=None):
+    def update_function_tool(self, user_id, tool_id, tool_name=None, description=None, parameters=None, is_active=None, tool_flag=None, label=None, code_content=None, route_hint=None, is_cacheable=None):
         manager = FunctionToolManager(self.db_path)
-        return manager.update_function_tool(user_id, tool_id, tool_name, description, parameters, is_active, tool_flag, label, code_content)
+        return manager.update_function_tool(user_id, tool_id, tool_name, description, parameters, is_active, tool_flag, label, code_content, route_hint, is_cacheable)
         
     def delete_function_tool(self, user_id, tool_id):
         manager = FunctionToolManager(self.db_path)
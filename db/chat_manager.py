@@ -63,7 +63,7 @@ class ChatManager(DatabaseConnection):
                 params.append(user_id)
             
             # 按时间排序
-            query += " ORDER BY timestamp DESC"
+            query += " ORDER BY timestamp DESC, id DESC"
             
             # 如果指定了限制，添加LIMIT子句
             if limit is not None:
@@ -172,4 +172,163 @@ class ChatManager(DatabaseConnection):
             return deleted_count
         except Exception as e:
             exception(f"删除对话历史时出错 (user_id={user_id}): {e}")
-            return 0
\ No newline at end of file
+            return 0
+    
+    def get_chat_history_after(self, user_id, after_id, limit=None):
+        """
+        获取指定记录之后的对话记录（用于把新的对话轮次折叠进滚动摘要）
+        
+        Args:
+            user_id: 用户ID
+            after_id: 只返回 id 大于该值的记录
+            limit: 返回记录数量限制（可选）
+            
+        Returns:
+            list: 对话记录列表，按时间先后排列
+        """
+        try:
+            self._ensure_connection()
+            
+            query = ("SELECT id, user_id, plan, user_message, bot_response, timestamp, model_name FROM chat_history "
+                     "WHERE user_id = ? AND id > ? ORDER BY id")
+            params = [user_id, after_id]
+            if limit is not None:
+                query += " LIMIT ?"
+                params.append(limit)
+            
+            self.cursor.execute(query, params)
+            records = []
+            for record in self.cursor.fetchall():
+                records.append({
+                    'id': record[0],
+                    'user_id': record[1],
+                    'plan': record[2],
+                    'user_message': record[3],
+                    'bot_response': record[4],
+                    'timestamp': record[5],
+                    'model_name': record[6]
+                })
+            return records
+        except Exception as e:
+            exception(f"获取对话记录时出错 (user_id={user_id}, after_id={after_id}): {e}")
+            return []
+    
+    def get_chat_records(self, user_id, record_ids):
+        """
+        按记录ID获取对话记录（用于长期记忆检索结果）
+        
+        Args:
+            user_id: 用户ID
+            record_ids: 记录ID列表
+            
+        Returns:
+            list: 对话记录列表，顺序与 record_ids 一致，已不存在的记录被跳过
+        """
+        if not record_ids:
+            return []
+        try:
+            self._ensure_connection()
+            
+            placeholders = ','.join('?' * len(record_ids))
+            self.cursor.execute(
+                "SELECT id, user_id, plan, user_message, bot_response, timestamp, model_name FROM chat_history "
+                f"WHERE user_id = ? AND id IN ({placeholders})",
+                [user_id, *record_ids]
+            )
+            records = {}
+            for record in self.cursor.fetchall():
+                records[record[0]] = {
+                    'id': record[0],
+                    'user_id': record[1],
+                    'plan': record[2],
+                    'user_message': record[3],
+                    'bot_response': record[4],
+                    'timestamp': record[5],
+                    'model_name': record[6]
+                }
+            return [records[i] for i in record_ids if i in records]
+        except Exception as e:
+            exception(f"获取对话记录时出错 (user_id={user_id}, record_ids={record_ids}): {e}")
+            return []
+    
+    def get_chat_summary(self, user_id):
+        """
+        获取用户的对话滚动摘要
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            dict: 摘要信息（summary、last_record_id、turns、update_time），不存在时返回None
+        """
+        try:
+            self._ensure_connection()
+            
+            self.cursor.execute(
+                "SELECT summary, last_record_id, turns, update_time FROM chat_summaries WHERE user_id = ?",
+                (user_id,)
+            )
+            row = self.cursor.fetchone()
+            if not row:
+                return None
+            return {'summary': row[0], 'last_record_id': row[1], 'turns': row[2], 'update_time': row[3]}
+        except Exception as e:
+            exception(f"获取对话摘要时出错 (user_id={user_id}): {e}")
+            return None
+    
+    def save_chat_summary(self, user_id, summary, last_record_id, turns):
+        """
+        保存（新增或覆盖）用户的对话滚动摘要
+        
+        Args:
+            user_id: 用户ID
+            summary: 摘要文本
+            last_record_id: 已折叠进摘要的最后一条对话记录ID
+            turns: 已折叠的对话轮数
+            
+        Returns:
+            bool: 操作是否成功
+        """
+        try:
+            self._ensure_connection()
+            
+            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.cursor.execute(
+                "INSERT INTO chat_summaries (user_id, summary, last_record_id, turns, update_time) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary, last_record_id = excluded.last_record_id, "
+                "turns = excluded.turns, update_time = excluded.update_time",
+                (user_id, summary, last_record_id, turns, current_time)
+            )
+            self.conn.commit()
+            debug(f"保存对话摘要成功 - 用户ID: {user_id}, 已折叠轮数: {turns}")
+            return True
+        except Exception as e:
+            exception(f"保存对话摘要时出错 (user_id={user_id}): {e}")
+            return False
+    
+    def delete_chat_summary(self, user_id=None):
+        """
+        删除对话滚动摘要
+        
+        Args:
+            user_id: 用户ID（可选，如果不指定则删除全部）
+            
+        Returns:
+            int: 删除的记录数
+        """
+        try:
+            self._ensure_connection()
+            
+            query = "DELETE FROM chat_summaries"
+            params = []
+            if user_id is not None:
+                query += " WHERE user_id = ?"
+                params.append(user_id)
+            
+            self.cursor.execute(query, params)
+            deleted_count = self.cursor.rowcount
+            self.conn.commit()
+            return deleted_count
+        except Exception as e:
+            exception(f"删除对话摘要时出错 (user_id={user_id}): {e}")
+            return 0
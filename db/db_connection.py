@@ -99,6 +99,7 @@ class DatabaseConnection:
                     is_active INTEGER NOT NULL DEFAULT 1,
                     desc TEXT,
                     model_flag INTEGER NOT NULL DEFAULT 1,
+                    model_group TEXT,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
@@ -131,6 +132,9 @@ class DatabaseConnection:
                     tool_flag INTEGER DEFAULT 0,
                     label TEXT DEFAULT '通用',
                     code_content TEXT,
+                    route_hint TEXT,
+                    is_cacheable INTEGER DEFAULT 0,
+                    revision INTEGER DEFAULT 0,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
@@ -154,11 +158,36 @@ class DatabaseConnection:
                 )
             ''')
             
+            # 创建对话滚动摘要表（每个用户一行，由后台任务把新的对话轮次折叠进摘要）
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_summaries (
+                    user_id INTEGER PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    last_record_id INTEGER NOT NULL DEFAULT 0,
+                    turns INTEGER NOT NULL DEFAULT 0,
+                    update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # 增量字段迁移（旧库补齐新增列）
+            self._ensure_column('model_info', 'model_group', 'TEXT')
+            self._ensure_column('function_tools', 'route_hint', 'TEXT')
+            self._ensure_column('function_tools', 'is_cacheable', 'INTEGER DEFAULT 0')
+            self._ensure_column('function_tools', 'revision', 'INTEGER DEFAULT 0')
+            
             self.conn.commit()
             debug("数据库表初始化完成")
         except Exception as e:
             exception(f"初始化数据库表时出错: {e}")
     
+    def _ensure_column(self, table, column, ddl):
+        """表中缺少指定列时通过 ALTER TABLE 补齐（用于旧数据库的增量迁移）"""
+        self.cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            info(f"数据库迁移：{table} 表新增列 {column}")
+    
     def close(self):
         """关闭数据库连接"""
         try:
@@ -7,7 +7,7 @@ from datetime import datetime
 class FunctionToolManager(DatabaseConnection):
     """函数工具管理模块，处理函数工具相关的所有操作"""
     
-    def add_function_tool(self, user_id, tool_name, description, parameters, is_active=True, tool_flag=0, label='通用', code_content=None):
+    def add_function_tool(self, user_id, tool_name, description, parameters, is_active=True, tool_flag=0, label='通用', code_content=None, route_hint=None, is_cacheable=False):
         """
         添加新的函数工具
         
@@ -18,6 +18,8 @@ class FunctionToolManager(DatabaseConnection):
             parameters: 参数定义（JSON字符串）
             is_active: 是否启用，默认为True
             code_content: 代码内容，用于保存用户自定义函数工具的代码内容
+            route_hint: 快速路由正则（可选），命名分组对应工具参数，匹配的请求不经过LLM直接调用该工具
+            is_cacheable: 工具结果是否只取决于参数（可选），只使用此类工具的问答可进入语义缓存
             
         Returns:
             tuple: (success, tool_id/error_message)
@@ -38,8 +40,8 @@ class FunctionToolManager(DatabaseConnection):
             
             # 插入新工具
             self.cursor.execute(
-                "INSERT INTO function_tools (user_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (user_id, tool_name, description, parameters, 1 if is_active else 0, current_time, current_time, tool_flag, label, code_content)
+                "INSERT INTO function_tools (user_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content, route_hint, is_cacheable) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, tool_name, description, parameters, 1 if is_active else 0, current_time, current_time, tool_flag, label, code_content, route_hint, 1 if is_cacheable else 0)
             )
             self.conn.commit()
             tool_id = self.cursor.lastrowid
@@ -50,6 +52,40 @@ class FunctionToolManager(DatabaseConnection):
             exception(f"添加函数工具 {tool_name} 时出错: {e}")
             return False, str(e)
     
+    def backfill_builtin_tool(self, user_id, tool_name, code_content, route_hint=None, is_cacheable=False):
+        """
+        为旧数据库中已存在的内部工具补齐 route_hint / is_cacheable（迁移新增列时旧记录为空值）
+        
+        仅更新代码未被修改、且两列均为迁移默认值的记录，不覆盖管理员的修改
+        
+        Args:
+            user_id: 用户ID
+            tool_name: 工具名称
+            code_content: 内部工具的代码内容
+            route_hint: 快速路由正则（可选）
+            is_cacheable: 工具结果是否只取决于参数（可选）
+            
+        Returns:
+            bool: 是否更新了记录
+        """
+        if not route_hint and not is_cacheable:
+            return False
+        try:
+            self._ensure_connection()
+            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.cursor.execute(
+                "UPDATE function_tools SET route_hint = ?, is_cacheable = ?, update_time = ?, revision = COALESCE(revision, 0) + 1 WHERE user_id = ? AND tool_name = ? AND code_content = ? AND route_hint IS NULL AND COALESCE(is_cacheable, 0) = 0",
+                (route_hint, 1 if is_cacheable else 0, current_time, user_id, tool_name, code_content)
+            )
+            self.conn.commit()
+            if self.cursor.rowcount:
+                info(f"补齐内部工具路由信息 - 工具名称: {tool_name}, 用户ID: {user_id}")
+                return True
+            return False
+        except Exception as e:
+            exception(f"补齐内部工具 {tool_name} 路由信息时出错: {e}")
+            return False
+    
     def get_all_function_tools(self, user_id):  
         """
         获取所有函数工具
@@ -62,7 +98,7 @@ class FunctionToolManager(DatabaseConnection):
 
             debug("获取所有函数工具")
             self.cursor.execute(
-                "SELECT distinct tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content FROM function_tools WHERE user_id = ? or tool_flag = 0 ORDER BY tool_id",
+                "SELECT distinct tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content, route_hint, is_cacheable FROM function_tools WHERE user_id = ? or tool_flag = 0 ORDER BY tool_id",
                 (user_id,)
             )
             
@@ -78,7 +114,9 @@ class FunctionToolManager(DatabaseConnection):
                     'update_time': tool[6],
                     'tool_flag': tool[7],
                     'label': tool[8],
-                    'code_content': tool[9]
+                    'code_content': tool[9],
+                    'route_hint': tool[10],
+                    'is_cacheable': bool(tool[11])
                 })
             
             info(f"成功获取函数工具列表 - 工具数: {len(tools)}")
@@ -87,6 +125,81 @@ class FunctionToolManager(DatabaseConnection):
             exception(f"获取函数工具列表时出错: {e}")
             return []
     
+    def get_public_function_tools(self):
+        """
+        获取所有共享函数工具（tool_flag = 0，所有用户可见）
+        
+        Returns:
+            list: 函数工具列表
+        """
+        return self._query_function_tools("tool_flag = 0", ())
+
+    def get_private_function_tools(self, user_id):
+        """
+        获取用户的私有函数工具（tool_flag != 0）
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            list: 函数工具列表
+        """
+        return self._query_function_tools("user_id = ? AND (tool_flag IS NULL OR tool_flag != 0)", (user_id,))
+
+    def get_public_function_tools_fingerprint(self):
+        """共享函数工具的指纹，见 _function_tools_fingerprint"""
+        return self._function_tools_fingerprint("tool_flag = 0", ())
+
+    def get_private_function_tools_fingerprint(self, user_id):
+        """用户私有函数工具的指纹，见 _function_tools_fingerprint"""
+        return self._function_tools_fingerprint("user_id = ? AND (tool_flag IS NULL OR tool_flag != 0)", (user_id,))
+
+    def _function_tools_fingerprint(self, where, params):
+        """
+        按条件统计函数工具的指纹：(工具数, 最大更新时间, 工具ID之和, 修订号之和)，用于判断工具集合是否有变化；
+        update_time 只精确到秒，修订号在每次修改时递增，同一秒内的修改也会改变指纹
+        
+        Returns:
+            tuple: 指纹，出错时返回None
+        """
+        try:
+            self._ensure_connection()
+            self.cursor.execute(f"SELECT COUNT(*), MAX(update_time), TOTAL(tool_id), TOTAL(revision) FROM function_tools WHERE {where}", params)
+            return tuple(self.cursor.fetchone())
+        except Exception as e:
+            exception(f"获取函数工具指纹时出错 (条件: {where}): {e}")
+            return None
+
+    def _query_function_tools(self, where, params):
+        """按条件查询函数工具（按 tool_id 排序），出错时返回空列表"""
+        try:
+            self._ensure_connection()
+            self.cursor.execute(
+                f"SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content, route_hint, is_cacheable FROM function_tools WHERE {where} ORDER BY tool_id",
+                params
+            )
+            tools = []
+            for tool in self.cursor.fetchall():
+                tools.append({
+                    'tool_id': tool[0],
+                    'tool_name': tool[1],
+                    'description': tool[2],
+                    'parameters': tool[3],
+                    'is_active': bool(tool[4]),
+                    'create_time': tool[5],
+                    'update_time': tool[6],
+                    'tool_flag': tool[7],
+                    'label': tool[8],
+                    'code_content': tool[9],
+                    'route_hint': tool[10],
+                    'is_cacheable': bool(tool[11])
+                })
+            debug(f"获取函数工具列表 - 条件: {where}, 工具数: {len(tools)}")
+            return tools
+        except Exception as e:
+            exception(f"获取函数工具列表时出错 (条件: {where}): {e}")
+            return []
+    
     def get_function_tool_by_id(self, user_id, tool_id):
         """
         根据ID获取函数工具
@@ -103,7 +216,7 @@ class FunctionToolManager(DatabaseConnection):
             
             debug(f"获取函数工具 - 工具ID: {tool_id}, 用户ID: {user_id}")
             self.cursor.execute(
-                "SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content FROM function_tools WHERE user_id = ? AND tool_id = ?",
+                "SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content, route_hint, is_cacheable FROM function_tools WHERE user_id = ? AND tool_id = ?",
                 (user_id, tool_id,)
             )
             tool = self.cursor.fetchone()
@@ -121,7 +234,9 @@ class FunctionToolManager(DatabaseConnection):
                 'update_time': tool[6],
                 'tool_flag': tool[7],
                 'label': tool[8],
-                'code_content': tool[9]
+                'code_content': tool[9],
+                'route_hint': tool[10],
+                'is_cacheable': bool(tool[11])
             }
             
             return tool_info
@@ -144,7 +259,7 @@ class FunctionToolManager(DatabaseConnection):
             
             debug(f"获取函数工具 - 工具名: {tool_name}")
             self.cursor.execute(
-                "SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content FROM function_tools WHERE tool_name = ?",
+                "SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content, route_hint, is_cacheable FROM function_tools WHERE tool_name = ?",
                 (tool_name,)
             )
             tool = self.cursor.fetchone()
@@ -162,7 +277,9 @@ class FunctionToolManager(DatabaseConnection):
                 'update_time': tool[6],
                 'tool_flag': tool[7],
                 'label': tool[8],
-                'code_content': tool[9]
+                'code_content': tool[9],
+                'route_hint': tool[10],
+                'is_cacheable': bool(tool[11])
             }
             
             return tool_info
@@ -186,7 +303,7 @@ class FunctionToolManager(DatabaseConnection):
             
             debug(f"获取函数工具 - 工具名: {tool_name}, 用户ID: {user_id}")
             self.cursor.execute(
-                "SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content FROM function_tools WHERE user_id = ? AND tool_name = ?",
+                "SELECT tool_id, tool_name, description, parameters, is_active, create_time, update_time, tool_flag, label, code_content, route_hint, is_cacheable FROM function_tools WHERE user_id = ? AND tool_name = ?",
                 (user_id, tool_name,)
             )
             tool = self.cursor.fetchone()
@@ -204,7 +321,9 @@ class FunctionToolManager(DatabaseConnection):
                 'update_time': tool[6],
                 'tool_flag': tool[7],
                 'label': tool[8],
-                'code_content': tool[9]
+                'code_content': tool[9],
+                'route_hint': tool[10],
+                'is_cacheable': bool(tool[11])
             }
             
             return tool_info
@@ -212,7 +331,7 @@ class FunctionToolManager(DatabaseConnection):
             exception(f"获取函数工具时出错 (tool_name={tool_name}): {e}")
             return None
     
-    def update_function_tool(self, user_id, tool_id, tool_name=None, description=None, parameters=None, is_active=None, tool_flag=None, label=None, code_content=None):
+    def update_function_tool(self, user_id, tool_id, tool_name=None, description=None, parameters=None, is_active=None, tool_flag=None, label=None, code_content=None, route_hint=None, is_cacheable=None):
         """
         更新函数工具
         
@@ -226,6 +345,8 @@ class FunctionToolManager(DatabaseConnection):
             tool_flag: 工具类型（可选）
             label: 标签（可选）
             code_content: 代码内容（可选）
+            route_hint: 快速路由正则（可选，传空字符串表示清除）
+            is_cacheable: 是否可进入语义缓存（可选）
             
         Returns:
             bool: 操作是否成功
@@ -275,9 +396,18 @@ class FunctionToolManager(DatabaseConnection):
                 update_fields.append("code_content = ?")
                 update_values.append(code_content)
             
-            # 更新时间戳
+            if route_hint is not None:
+                update_fields.append("route_hint = ?")
+                update_values.append(route_hint or None)
+            
+            if is_cacheable is not None:
+                update_fields.append("is_cacheable = ?")
+                update_values.append(1 if is_cacheable else 0)
+            
+            # 更新时间戳；修订号每次写入递增（update_time 只精确到秒，同一秒内的修改靠修订号区分）
             update_fields.append("update_time = ?")
             update_values.append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            update_fields.append("revision = COALESCE(revision, 0) + 1")
             
             if not update_fields:
                 debug("未提供更新字段")
@@ -7,7 +7,7 @@ import sqlite3
 class ModelManager(DatabaseConnection):
     """模型管理模块，处理模型相关的所有操作"""
     
-    def add_model(self, user_id, model_name, model_url, api_key=None, temperature=0.7, max_tokens=2048, desc=None, model_flag=1):
+    def add_model(self, user_id, model_name, model_url, api_key=None, temperature=0.7, max_tokens=2048, desc=None, model_flag=1, model_group=None):
         """添加新模型
         
         Args:
@@ -19,6 +19,7 @@ class ModelManager(DatabaseConnection):
             max_tokens: 最大生成 tokens 数，默认为2048
             desc : 模型描述
             model_flag: 模型共享标识，0共享，1私有，默认1
+            model_group: 模型端点池名称（可选），同名的多个模型端点组成一个路由池
             
         Returns:
             tuple: (success, model_id/error_message)
@@ -45,8 +46,8 @@ class ModelManager(DatabaseConnection):
             
             # 插入新模型（包含共享标识）
             self.cursor.execute(
-                "INSERT INTO model_info (user_id, model_name, model_url, api_key, temperature, max_tokens, add_time, desc, model_flag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (user_id, model_name, model_url, api_key, temperature, max_tokens, add_time, desc, model_flag)
+                "INSERT INTO model_info (user_id, model_name, model_url, api_key, temperature, max_tokens, add_time, desc, model_flag, model_group) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, model_name, model_url, api_key, temperature, max_tokens, add_time, desc, model_flag, model_group or None)
             )
             self.conn.commit()
             model_id = self.cursor.lastrowid
@@ -78,7 +79,7 @@ class ModelManager(DatabaseConnection):
             self._ensure_connection()
             
             debug("获取所有模型信息")
-            self.cursor.execute("SELECT model_id, model_name, model_url, api_key, temperature, max_tokens, add_time, is_active, user_id, desc, model_flag FROM model_info ORDER BY model_id")
+            self.cursor.execute("SELECT model_id, model_name, model_url, api_key, temperature, max_tokens, add_time, is_active, user_id, desc, model_flag, model_group FROM model_info ORDER BY model_id")
             
             models = []
             for model in self.cursor.fetchall():
@@ -93,7 +94,8 @@ class ModelManager(DatabaseConnection):
                     'is_active': bool(model[7]),
                     'user_id': model[8],
                     'desc': model[9],
-                    'model_flag': int(model[10])
+                    'model_flag': int(model[10]),
+                    'model_group': model[11]
                 })
             
             info(f"成功获取模型列表 - 模型数: {len(models)}")
@@ -118,7 +120,7 @@ class ModelManager(DatabaseConnection):
             
             debug(f"获取模型信息 - 模型ID: {model_id}")
             self.cursor.execute(
-                "SELECT model_id, model_name, model_url, api_key, temperature, max_tokens, add_time, is_active, user_id, desc, model_flag FROM model_info WHERE model_id = ? and user_id = ?",
+                "SELECT model_id, model_name, model_url, api_key, temperature, max_tokens, add_time, is_active, user_id, desc, model_flag, model_group FROM model_info WHERE model_id = ? and user_id = ?",
                 (model_id,user_id,)
             )
             model = self.cursor.fetchone()
@@ -137,7 +139,8 @@ class ModelManager(DatabaseConnection):
                 'is_active': bool(model[7]),
                 'user_id': model[8],
                 'desc': model[9],
-                'model_flag': int(model[10])
+                'model_flag': int(model[10]),
+                'model_group': model[11]
             }
             
             return model_info
@@ -161,7 +164,7 @@ class ModelManager(DatabaseConnection):
             
             debug(f"获取模型信息 - 用户ID: {user_id}")
             self.cursor.execute(
-                "SELECT distinct model_id, model_name, model_url, api_key, temperature, max_tokens, add_time, is_active, desc, model_flag FROM model_info WHERE user_id = ? or model_flag = 0",
+                "SELECT distinct model_id, model_name, model_url, api_key, temperature, max_tokens, add_time, is_active, desc, model_flag, model_group FROM model_info WHERE user_id = ? or model_flag = 0",
                 (user_id,)
             )
             models = self.cursor.fetchall()
@@ -181,7 +184,8 @@ class ModelManager(DatabaseConnection):
                     'add_time': model[6],
                     'is_active': bool(model[7]),
                     'desc': model[8],
-                    'model_flag': int(model[9])
+                    'model_flag': int(model[9]),
+                    'model_group': model[10]
                 }
                 model_list.append(model_info)
             
@@ -190,7 +194,7 @@ class ModelManager(DatabaseConnection):
             exception(f"获取模型信息时出错 (user_id={user_id}): {e}")
             return []
     
-    def update_model(self, user_id, model_id, model_name=None, model_url=None, api_key=None, temperature=None, max_tokens=None, is_active=None, desc=None, model_flag=None):
+    def update_model(self, user_id, model_id, model_name=None, model_url=None, api_key=None, temperature=None, max_tokens=None, is_active=None, desc=None, model_flag=None, model_group=None):
         """更新模型信息
         
         Args:
@@ -204,6 +208,7 @@ class ModelManager(DatabaseConnection):
             is_active: 是否启用（可选）
             desc: 模型描述
             model_flag: 共享标识（0共享，1私有）
+            model_group: 模型端点池名称（可选，传空字符串表示移出端点池）
             
         Returns:
             bool: 操作是否成功
@@ -262,6 +267,10 @@ class ModelManager(DatabaseConnection):
                 model_flag = 0 if model_flag == 0 else 1
                 update_fields.append("model_flag = ?")
                 update_values.append(model_flag)
+
+            if model_group is not None:
+                update_fields.append("model_group = ?")
+                update_values.append(model_group or None)
             
             if not update_fields:
                 debug("未提供更新字段")
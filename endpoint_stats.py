@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from config import Config
+
+# EWMA平滑系数：越大越偏向最近的观测
+EWMA_ALPHA = getattr(Config, 'LLM_ROUTER_EWMA_ALPHA', 0.3)
+# 错误率超过该阈值的端点视为不健康
+UNHEALTHY_ERROR_RATE = getattr(Config, 'LLM_ROUTER_UNHEALTHY_ERROR_RATE', 0.5)
+# 用于计算p95的最近样本数
+LATENCY_WINDOW = 100
+
+
+class EndpointStats:
+    """单个模型端点的延迟与错误统计（EWMA），由 LLMClient 的上游调用与后台探测共同更新"""
+
+    def __init__(self, url: str, model: str):
+        self.url = url
+        self.model = model
+        self.ewma_latency: Optional[float] = None  # 请求延迟EWMA（秒）
+        self.probe_latency: Optional[float] = None  # 探测延迟EWMA（秒），没有请求样本时用于排序
+        self.error_rate = 0.0  # 错误率EWMA（0~1）
+        self.requests = 0
+        self.errors = 0
+        self.last_used = 0.0
+        self._samples = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ewma(old: Optional[float], value: float) -> float:
+        return value if old is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * old
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.last_used = time.time()
+            self.error_rate = self._ewma(self.error_rate, 0.0 if ok else 1.0)
+            if ok:
+                self.ewma_latency = self._ewma(self.ewma_latency, latency)
+                self._samples.append(latency)
+            else:
+                self.errors += 1
+
+    def record_probe(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.error_rate = self._ewma(self.error_rate, 0.0 if ok else 1.0)
+            if ok:
+                self.probe_latency = self._ewma(self.probe_latency, latency)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < 10:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    @property
+    def healthy(self) -> bool:
+        return self.error_rate < UNHEALTHY_ERROR_RATE
+
+    def score(self) -> float:
+        """路由评分（越小越好）：延迟按错误率加权；尚无样本的端点评分为0，优先试探"""
+        latency = self.ewma_latency if self.ewma_latency is not None else self.probe_latency
+        if latency is None:
+            return 0.0
+        return latency * (1 + 4 * self.error_rate)
+
+    def to_dict(self) -> dict:
+        return {
+            'url': self.url,
+            'model': self.model,
+            'ewma_latency_ms': round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            'probe_latency_ms': round(self.probe_latency * 1000, 1) if self.probe_latency is not None else None,
+            'p95_ms': round(self.p95() * 1000, 1) if self.p95() is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'errors': self.errors,
+            'healthy': self.healthy,
+        }
+
+
+# 进程级端点统计表：(model_url, model) -> EndpointStats
+_STATS: Dict[Tuple[str, str], EndpointStats] = {}
+_LOCK = threading.Lock()
+
+
+def get_stats(url: str, model: str) -> EndpointStats:
+    key = ((url or '').rstrip('/'), model)
+    stats = _STATS.get(key)
+    if stats is None:
+        with _LOCK:
+            stats = _STATS.get(key)
+            if stats is None:
+                stats = EndpointStats(key[0], model)
+                _STATS[key] = stats
+    return stats
+
+
+def record(url: str, model: str, latency: float, ok: bool) -> None:
+    """记录一次上游调用结果"""
+    get_stats(url, model).record(latency, ok)
+
+
+def snapshot() -> list:
+    with _LOCK:
+        items = list(_STATS.values())
+    return [s.to_dict() for s in items]
@@ -0,0 +1,300 @@
+import re
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from log import debug, warning
+
+# 快速路由：在 ReactAgent 规划之前匹配可直接解析的请求（算术表达式、"/<工具名> <参数>" 命令、工具自带的路由正则），
+# 命中时不经过LLM直接调用工具，并用模板生成回答
+FAST_ROUTER_ENABLED = getattr(Config, 'FAST_ROUTER_ENABLED', True)
+# 算术表达式中允许的最多运算次数，超出时交给LLM处理
+FAST_ROUTER_MAX_OPERATIONS = getattr(Config, 'FAST_ROUTER_MAX_OPERATIONS', 16)
+# 回答模板
+FAST_ROUTER_ARITHMETIC_TEMPLATE = getattr(Config, 'FAST_ROUTER_ARITHMETIC_TEMPLATE', '计算结果：{expression} = {result}')
+
+ARITHMETIC = 'arithmetic'
+COMMAND = 'command'
+HINT = 'hint'
+
+# 运算符 -> 内置工具名
+OPERATOR_TOOLS = {'+': 'add', '-': 'subtract', '*': 'multiply', '/': 'divide'}
+
+_NORMALIZE = str.maketrans({
+    '＋': '+', '－': '-', '×': '*', '＊': '*', '÷': '/', '／': '/', '（': '(', '）': ')',
+    '０': '0', '１': '1', '２': '2', '３': '3', '４': '4', '５': '5', '６': '6', '７': '7', '８': '8', '９': '9', '．': '.',
+})
+# 算术请求中可以去掉的前后缀，如 "计算 3*7"、"3*7=?"、"3*7等于多少"；cue 为明确要求计算的提示词
+_ARITH_PREFIX_RE = re.compile(r'^(?:请|请帮我|帮我)?(?P<cue>计算|算一下|算算|求)?\s*[:：]?\s*')
+_ARITH_SUFFIX_RE = re.compile(r'\s*(?P<cue>=|等于|是)?\s*(?P<ask>多少|几)?\s*[?？。!！]?\s*$')
+# 形似日期、电话号码的数字串（如 2024-10-18、1/2/2025、138-1234-5678、010-12345678、2024/10），没有计算提示词时不按算术处理
+_DATE_OR_PHONE_RE = re.compile(r'\d+([-/.])\d+(?:\1\d+)+|\d{4}[-/]\d{1,2}|\d{3,4}-\d{7,8}')
+_TOKEN_RE = re.compile(r'\s*(?:(\d+(?:\.\d*)?|\.\d+)|(.))')
+# 命令：以 "/" 开头的 "/<工具名> <参数>"；不带 "/" 时参数必须全部是 key=value，避免把以工具名开头的自然语言当作命令
+_COMMAND_RE = re.compile(r'^(/)?([^\s/]\S*)\s+(\S.*)$', re.DOTALL)
+
+
+class FastRoute:
+    """一次快速路由命中
+    kind: arithmetic（tree 为表达式树）/ command / hint（tool_name + parameters）"""
+
+    def __init__(self, kind: str, expression: str = '', tree: Any = None,
+                 tool_name: Optional[str] = None, parameters: Optional[Dict[str, Any]] = None):
+        self.kind = kind
+        self.expression = expression
+        self.tree = tree
+        self.tool_name = tool_name
+        self.parameters = parameters or {}
+
+    def __repr__(self) -> str:
+        if self.kind == ARITHMETIC:
+            return f"FastRoute(arithmetic, {self.expression!r})"
+        return f"FastRoute({self.kind}, {self.tool_name}, {self.parameters})"
+
+
+class _Parser:
+    """算术表达式的递归下降解析：expr := term (('+'|'-') term)*，term := factor (('*'|'/') factor)*，
+    factor := ['-'] number | '(' expr ')'；表达式树节点为数字或 (运算符, 左, 右)"""
+
+    def __init__(self, text: str):
+        self.tokens = []
+        for number, op in _TOKEN_RE.findall(text):
+            self.tokens.append(_number(number) if number else op)
+        self.pos = 0
+        self.operations = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        tree = self.expr()
+        if self.pos != len(self.tokens):
+            raise ValueError('表达式未完整解析')
+        return tree
+
+    def expr(self):
+        node = self.term()
+        while self.peek() in ('+', '-'):
+            node = (self.take(), node, self.term())
+            self.operations += 1
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in ('*', '/'):
+            node = (self.take(), node, self.factor())
+            self.operations += 1
+        return node
+
+    def factor(self):
+        tok = self.take()
+        if tok == '-' and isinstance(self.peek(), (int, float)):
+            return -self.take()
+        if tok == '(':
+            node = self.expr()
+            if self.take() != ')':
+                raise ValueError('括号不匹配')
+            return node
+        if isinstance(tok, (int, float)):
+            return tok
+        raise ValueError(f'无法识别的符号: {tok}')
+
+
+def _number(text: str):
+    return float(text) if '.' in text else int(text)
+
+
+def format_number(value: Any) -> str:
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return str(round(value, 10))
+    return str(value)
+
+
+def match_arithmetic(user_input: str, tools: Dict[str, Any]) -> Optional[FastRoute]:
+    """纯算术表达式（至少包含一次运算），所用运算对应的内置工具都已注册时命中；
+    形似日期或电话号码且没有 "计算"、"="、"等于多少" 等提示词时不命中"""
+    text = user_input.strip().translate(_NORMALIZE)
+    prefix = _ARITH_PREFIX_RE.match(text)
+    text = text[prefix.end():]
+    suffix = _ARITH_SUFFIX_RE.search(text)
+    text = text[:suffix.start()]
+    if not text or not re.fullmatch(r'[\d\s.+\-*/()]+', text):
+        return None
+    cue = prefix.group('cue') or (suffix.group('cue') or '') in ('=', '等于') or suffix.group('ask')
+    if not cue and _DATE_OR_PHONE_RE.fullmatch(text):
+        return None
+    try:
+        parser = _Parser(text)
+        tree = parser.parse()
+    except (ValueError, TypeError):
+        return None
+    if not 0 < parser.operations <= FAST_ROUTER_MAX_OPERATIONS:
+        return None
+    if any(OPERATOR_TOOLS[op] not in tools for op in _operators(tree)):
+        return None
+    return FastRoute(ARITHMETIC, expression=re.sub(r'\s+', '', text), tree=tree)
+
+
+def _operators(tree) -> set:
+    if isinstance(tree, tuple):
+        return {tree[0]} | _operators(tree[1]) | _operators(tree[2])
+    return set()
+
+
+def _coerce(value: str, type_name: Any):
+    """按参数声明的类型转换字符串参数，失败时抛出 ValueError"""
+    type_name = str(type_name or '').lower()
+    value = value.strip()
+    if type_name in ('int', 'integer'):
+        return int(value)
+    if type_name in ('float', 'number'):
+        return _number(value) if re.fullmatch(r'-?\d+(?:\.\d*)?', value) else float(value)
+    if type_name in ('bool', 'boolean'):
+        if value.lower() in ('true', '1', 'yes', '是'):
+            return True
+        if value.lower() in ('false', '0', 'no', '否'):
+            return False
+        raise ValueError(f'无法转换为布尔值: {value}')
+    return value
+
+
+def _bind(tool, values: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """按工具参数定义转换类型并检查必需参数，不满足时返回None"""
+    declared = {p['name']: p for p in tool.parameters}
+    if not values.keys() <= declared.keys():
+        return None
+    try:
+        parameters = {name: _coerce(v, declared[name].get('type')) for name, v in values.items()}
+    except (ValueError, TypeError):
+        return None
+    if any(p.get('required') and p['name'] not in parameters for p in tool.parameters):
+        return None
+    return parameters
+
+
+def match_command(user_input: str, tools: Dict[str, Any]) -> Optional[FastRoute]:
+    """"/<工具名> <参数>" 形式的命令：单参数工具取其余全部文本；多参数工具按 key=value 或按顺序以空白/逗号分隔。
+    不带 "/" 的 "<工具名> key=value ..." 也按命令处理，其他以工具名开头的句子交给LLM"""
+    m = _COMMAND_RE.match(user_input.strip())
+    if not m or m.group(2) not in tools:
+        return None
+    explicit = m.group(1) is not None
+    tool = tools[m.group(2)]
+    args = m.group(3).strip()
+    names = [p['name'] for p in tool.parameters]
+    parts = [p for p in re.split(r'[\s,，]+', args) if p]
+    if parts and all('=' in p for p in parts):
+        values = dict(p.split('=', 1) for p in parts)
+    elif not explicit:
+        return None
+    elif len(names) == 1:
+        values = {names[0]: args}
+    elif 0 < len(parts) <= len(names):
+        values = dict(zip(names, parts))
+    else:
+        return None
+    parameters = _bind(tool, values)
+    if parameters is None:
+        return None
+    return FastRoute(COMMAND, tool_name=tool.name, parameters=parameters)
+
+
+def match_route_hints(user_input: str, tools: Dict[str, Any]) -> Optional[FastRoute]:
+    """工具自带的路由正则（function_tools.route_hint），整句匹配，命名分组作为参数"""
+    text = user_input.strip()
+    for tool in tools.values():
+        pattern = _compiled(getattr(tool, 'route_hint', None))
+        if pattern is None:
+            continue
+        m = pattern.fullmatch(text)
+        if not m:
+            continue
+        parameters = _bind(tool, {k: v for k, v in m.groupdict().items() if v is not None})
+        if parameters is not None:
+            return FastRoute(HINT, tool_name=tool.name, parameters=parameters)
+    return None
+
+
+_PATTERNS: Dict[str, Optional[re.Pattern]] = {}
+_PATTERNS_LOCK = threading.Lock()
+
+
+def _compiled(hint: Optional[str]) -> Optional[re.Pattern]:
+    if not hint:
+        return None
+    with _PATTERNS_LOCK:
+        if hint not in _PATTERNS:
+            try:
+                _PATTERNS[hint] = re.compile(hint)
+            except re.error as e:
+                warning(f"工具路由正则无效，已忽略: {hint}, 错误: {e}")
+                _PATTERNS[hint] = None
+        return _PATTERNS[hint]
+
+
+def validate_route_hint(hint: str, parameters: Any = None) -> Tuple[bool, Optional[str]]:
+    """校验工具的路由正则：可编译，且命名分组都是工具参数（提供了参数列表时）"""
+    try:
+        pattern = re.compile(hint)
+    except re.error as e:
+        return False, f"路由正则无效：{e}"
+    if isinstance(parameters, list):
+        names = {p.get('name') for p in parameters if isinstance(p, dict)}
+        unknown = [g for g in pattern.groupindex if g not in names]
+        if unknown:
+            return False, '路由正则的命名分组与工具参数不匹配: ' + ', '.join(unknown)
+    return True, None
+
+
+# 匹配器按顺序尝试，第一个命中的生效；可通过 register_matcher 追加自定义匹配器
+_MATCHERS: List[Callable[[str, Dict[str, Any]], Optional[FastRoute]]] = [
+    match_arithmetic, match_route_hints, match_command,
+]
+
+
+def register_matcher(matcher: Callable[[str, Dict[str, Any]], Optional[FastRoute]], first: bool = False) -> None:
+    """注册自定义匹配器 matcher(user_input, tools) -> FastRoute | None"""
+    if first:
+        _MATCHERS.insert(0, matcher)
+    else:
+        _MATCHERS.append(matcher)
+
+
+def route(user_input: str, tools: Dict[str, Any]) -> Optional[FastRoute]:
+    """依次尝试各匹配器，返回第一个命中的快速路由；未开启或都未命中时返回None"""
+    if not FAST_ROUTER_ENABLED or not user_input or not tools:
+        return None
+    for matcher in list(_MATCHERS):
+        try:
+            hit = matcher(user_input, tools)
+        except Exception as e:
+            warning(f"快速路由匹配器异常，已跳过: {getattr(matcher, '__name__', matcher)}, 错误: {e}")
+            continue
+        if hit is not None:
+            debug(f"快速路由命中: {hit}")
+            return hit
+    return None
+
+
+async def aevaluate(tree: Any, call: Callable[[str, Dict[str, Any]], Awaitable[Tuple[bool, Any]]]) -> Tuple[bool, Any]:
+    """按表达式树依次调用运算工具 call(tool_name, {'a', 'b'}) -> (是否成功, 结果)，返回 (是否成功, 最终结果)；
+    工具返回非数值结果（如除数为零时的错误文本）时停止计算并将其作为最终结果"""
+    if not isinstance(tree, tuple):
+        return True, tree
+    op, left, right = tree
+    for operand in (left, right):
+        ok, value = await aevaluate(operand, call)
+        if not ok or not isinstance(value, (int, float)):
+            return ok, value
+        if operand is left:
+            a = value
+        else:
+            b = value
+    return await call(OPERATOR_TOOLS[op], {'a': a, 'b': b})
@@ -0,0 +1,32 @@
+from typing import Dict, Optional
+
+from config import Config
+
+# Agent 各阶段：plan 规划、parse 工具参数解析、answer 直接回答、follow_up 追问、summary 基于工具结果总结、
+# tool_call 工具调用模式（规划与参数提取合为一次调用，见 tool_calling.py）、memory 后台折叠对话滚动摘要
+STAGES = ('plan', 'parse', 'answer', 'follow_up', 'summary', 'tool_call', 'memory')
+
+STAGE_GENERATION_DEFAULTS = getattr(Config, 'STAGE_GENERATION_DEFAULTS', {})
+STAGE_GENERATION_MODEL_OVERRIDES = getattr(Config, 'STAGE_GENERATION_MODEL_OVERRIDES', {})
+
+# 模型记录未设置时的兜底值（与 LLMClient.chat 的默认参数一致）
+_FALLBACK = {'temperature': 0.7, 'max_tokens': 2048, 'disable_thinking': False}
+
+
+def resolve_stage_settings(model_info: Optional[dict] = None) -> Dict[str, dict]:
+    """计算各阶段的生成参数 {stage: {'temperature', 'max_tokens', 'disable_thinking'}}
+    优先级（低 -> 高）：兜底值 < 模型记录的 temperature/max_tokens < STAGE_GENERATION_DEFAULTS[stage]
+    < STAGE_GENERATION_MODEL_OVERRIDES[模型名][stage]"""
+    model_info = model_info or {}
+    base = dict(_FALLBACK)
+    for key in ('temperature', 'max_tokens'):
+        if model_info.get(key) is not None:
+            base[key] = model_info[key]
+    model_overrides = STAGE_GENERATION_MODEL_OVERRIDES.get(model_info.get('model_name'), {})
+    settings = {}
+    for stage in STAGES:
+        s = dict(base)
+        s.update(STAGE_GENERATION_DEFAULTS.get(stage, {}))
+        s.update(model_overrides.get(stage, {}))
+        settings[stage] = s
+    return settings
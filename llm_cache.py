@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+from config import Config
+from log import debug, info, warning, exception
+
+# 缓存配置，默认从配置读取
+LLM_CACHE_ENABLED = getattr(Config, 'LLM_CACHE_ENABLED', False)
+LLM_CACHE_MAX_ENTRIES = getattr(Config, 'LLM_CACHE_MAX_ENTRIES', 1000)
+LLM_CACHE_TTL_SECONDS = getattr(Config, 'LLM_CACHE_TTL_SECONDS', 3600)
+LLM_CACHE_MODEL_TTLS = getattr(Config, 'LLM_CACHE_MODEL_TTLS', {})
+LLM_CACHE_ALLOW_NONZERO_TEMPERATURE = getattr(Config, 'LLM_CACHE_ALLOW_NONZERO_TEMPERATURE', False)
+LLM_CACHE_SQLITE_ENABLED = getattr(Config, 'LLM_CACHE_SQLITE_ENABLED', False)
+LLM_CACHE_DB_PATH = getattr(Config, 'LLM_CACHE_DB_PATH',
+                            os.path.join(os.path.dirname(Config.DB_PATH), 'llm_cache.sqlite3'))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """规范化提示词：合并空白字符，消除模板缩进差异"""
+    return ' '.join((prompt or '').split())
+
+
+def make_cache_key(model: str, prompt: str, temperature: float, max_tokens: int, **extra) -> str:
+    """缓存键：(模型, 规范化提示词哈希, 温度, 最大token数[, 其他影响输出的参数])"""
+    prompt_hash = hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+    payload = {'model': model, 'prompt': prompt_hash, 'temperature': temperature, 'max_tokens': max_tokens}
+    extra = {k: v for k, v in extra.items() if v is not None}
+    if extra:
+        payload['extra'] = extra
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LLM响应缓存：内存LRU + 可选SQLite持久层，按模型设置TTL"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, default_ttl: float = LLM_CACHE_TTL_SECONDS,
+                 model_ttls: Optional[dict] = None, db_path: Optional[str] = None,
+                 allow_nonzero_temperature: bool = LLM_CACHE_ALLOW_NONZERO_TEMPERATURE):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.model_ttls = dict(model_ttls or {})
+        self.allow_nonzero_temperature = allow_nonzero_temperature
+        # key -> {'response', 'expires_at', 'latency', 'tokens'}
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.db_path = db_path
+        self._conn = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._init_db()
+
+    # ---------- SQLite 持久层 ----------
+    def _init_db(self) -> None:
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    latency REAL DEFAULT 0,
+                    tokens INTEGER DEFAULT 0,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._conn.commit()
+            info(f"LLM响应缓存持久层已启用: {self.db_path}")
+        except Exception as e:
+            exception(f"LLM响应缓存持久层初始化失败，仅使用内存缓存: {e}")
+            self._conn = None
+
+    @property
+    def has_disk_tier(self) -> bool:
+        return self._conn is not None
+
+    def _db_get(self, key: str) -> Optional[dict]:
+        if self._conn is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._conn.execute(
+                    "SELECT response, latency, tokens, expires_at FROM llm_response_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row and row[3] <= time.time():
+                    self._conn.execute("DELETE FROM llm_response_cache WHERE cache_key = ?", (key,))
+                    self._conn.commit()
+                    return None
+            if not row:
+                return None
+            return {'response': row[0], 'latency': row[1] or 0, 'tokens': row[2] or 0, 'expires_at': row[3]}
+        except Exception as e:
+            warning(f"读取LLM响应缓存持久层失败: {e}")
+            return None
+
+    def _db_set(self, key: str, model: str, entry: dict) -> None:
+        if self._conn is None:
+            return
+        try:
+            with self._db_lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_response_cache (cache_key, model, response, latency, tokens, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, entry['response'], entry['latency'], entry['tokens'], entry['expires_at'])
+                )
+                self._conn.commit()
+        except Exception as e:
+            warning(f"写入LLM响应缓存持久层失败: {e}")
+
+    # ---------- 对外接口 ----------
+    def ttl_for(self, model: str) -> float:
+        return self.model_ttls.get(model, self.default_ttl)
+
+    def is_cacheable(self, model: str, temperature: float, allow_nonzero: Optional[bool] = None) -> bool:
+        """温度大于0的请求默认不走缓存（输出本应随机），除非显式允许；TTL<=0的模型不缓存"""
+        if self.ttl_for(model) <= 0:
+            return False
+        allow = self.allow_nonzero_temperature if allow_nonzero is None else allow_nonzero
+        return allow or not temperature
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['expires_at'] > now:
+                    self._entries.move_to_end(key)
+                else:
+                    self._entries.pop(key, None)
+                    entry = None
+        tier = 'memory'
+        if entry is None:
+            entry = self._db_get(key)
+            tier = 'sqlite'
+            if entry is not None:
+                self._put_memory(key, entry)
+        if entry is None:
+            metrics.incr('llm_cache.miss')
+            return None
+        metrics.incr('llm_cache.hit')
+        metrics.incr(f'llm_cache.hit.{tier}')
+        # 命中即节省了一次上游调用的耗时与token
+        metrics.incr('llm_cache.saved_latency_ms', entry.get('latency', 0) * 1000)
+        metrics.incr('llm_cache.saved_tokens', entry.get('tokens', 0))
+        debug(f"命中LLM响应缓存 - 层级: {tier}")
+        return entry['response']
+
+    def _put_memory(self, key: str, entry: dict) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.incr('llm_cache.evicted')
+
+    def set(self, key: str, model: str, response: str, latency: float = 0, tokens: int = 0) -> None:
+        entry = {
+            'response': response,
+            'latency': latency,
+            'tokens': tokens,
+            'expires_at': time.time() + self.ttl_for(model),
+        }
+        self._put_memory(key, entry)
+        self._db_set(key, model, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._conn is not None:
+            try:
+                with self._db_lock:
+                    self._conn.execute("DELETE FROM llm_response_cache")
+                    self._conn.commit()
+            except Exception as e:
+                warning(f"清空LLM响应缓存持久层失败: {e}")
+
+    def stats(self) -> dict:
+        counters = metrics.snapshot()['counters']
+        hits = counters.get('llm_cache.hit', 0)
+        misses = counters.get('llm_cache.miss', 0)
+        with self._lock:
+            size = len(self._entries)
+        return {
+            'entries': size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0,
+            'saved_latency_ms': counters.get('llm_cache.saved_latency_ms', 0),
+            'saved_tokens': counters.get('llm_cache.saved_tokens', 0),
+            'sqlite': self.has_disk_tier,
+        }
+
+
+# 进程级默认缓存（按配置开启）
+_DEFAULT_CACHE: Optional[ResponseCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    """获取默认响应缓存；未开启 LLM_CACHE_ENABLED 时返回None"""
+    global _DEFAULT_CACHE
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _DEFAULT_CACHE is None:
+        with _DEFAULT_LOCK:
+            if _DEFAULT_CACHE is None:
+                _DEFAULT_CACHE = ResponseCache(
+                    model_ttls=LLM_CACHE_MODEL_TTLS,
+                    db_path=LLM_CACHE_DB_PATH if LLM_CACHE_SQLITE_ENABLED else None,
+                )
+    return _DEFAULT_CACHE
@@ -0,0 +1,3 @@
+class LLMUnavailableError(Exception):
+    """模型端点当前不可用（熔断打开、限流排队超时等），继续发起调用注定失败；
+    LLMClient.chat/achat 不会把此类异常转换为错误文本，ReactAgent 捕获后直接终止剩余计划"""
@@ -0,0 +1,224 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from openai import OpenAI, AsyncOpenAI
+from config import Config
+from log import debug, info, warning
+from llmclient import LLMClient
+
+try:
+    import httpx  # openai SDK 的底层HTTP库，用于定制连接池大小
+except ImportError:
+    httpx = None
+
+# 连接池参数，默认从配置读取
+POOL_MAX_CONNECTIONS = getattr(Config, 'LLM_POOL_MAX_CONNECTIONS', 100)
+POOL_MAX_KEEPALIVE_CONNECTIONS = getattr(Config, 'LLM_POOL_MAX_KEEPALIVE_CONNECTIONS', 20)
+POOL_KEEPALIVE_EXPIRY_SECONDS = getattr(Config, 'LLM_POOL_KEEPALIVE_EXPIRY_SECONDS', 60)
+# 客户端空闲多久后被回收（秒）
+CLIENT_IDLE_SECONDS = getattr(Config, 'LLM_CLIENT_IDLE_SECONDS', 600)
+
+# 进程级客户端注册表：(model_url, api_key指纹, timeout) -> {'client': OpenAI, 'async_client': AsyncOpenAI,
+# 'last_used': 时间戳, 'inflight': 在途请求数, 'retired': 已移出注册表, 'closed': 已关闭}
+_CLIENTS: Dict[Tuple[str, str, float], dict] = {}
+_LOCK = threading.Lock()
+# 上次执行空闲回收的时间，避免每次获取都全表扫描
+_LAST_SWEEP = 0.0
+
+
+def _fingerprint(api_key: Optional[str]) -> str:
+    """API Key 指纹，注册表中不保存明文密钥"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _make_key(model_url: str, api_key: Optional[str], timeout: float) -> Tuple[str, str, float]:
+    return ((model_url or '').rstrip('/'), _fingerprint(api_key), float(timeout))
+
+
+def _build_http_client():
+    """构建带keep-alive连接池的HTTP客户端；httpx不可用时返回None，使用SDK默认连接池"""
+    if httpx is None:
+        return None
+    limits = httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    try:
+        from openai import DefaultHttpxClient
+        return DefaultHttpxClient(limits=limits)
+    except ImportError:
+        return httpx.Client(limits=limits)
+
+
+def _build_async_http_client():
+    """异步版本的连接池HTTP客户端"""
+    if httpx is None:
+        return None
+    limits = httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    try:
+        from openai import DefaultAsyncHttpxClient
+        return DefaultAsyncHttpxClient(limits=limits)
+    except ImportError:
+        return httpx.AsyncClient(limits=limits)
+
+
+def _close_quietly(entry: dict) -> None:
+    try:
+        entry['client'].close()
+    except Exception as e:
+        warning(f"关闭LLM客户端失败: {e}")
+    async_client = entry.get('async_client')
+    if async_client is not None:
+        # 异步客户端绑定在专用事件循环上，需在该循环中关闭
+        try:
+            import async_runtime
+            async_runtime.submit(async_client.close())
+        except Exception as e:
+            warning(f"关闭异步LLM客户端失败: {e}")
+
+
+def _retire(entry: dict) -> bool:
+    """将条目标记为已移出注册表（调用方需持有 _LOCK）；没有在途请求时返回True，由调用方在锁外立即关闭，
+    否则等最后一个在途请求结束后再关闭（见 _Lease）"""
+    entry['retired'] = True
+    if entry['inflight'] or entry['closed']:
+        return False
+    entry['closed'] = True
+    return True
+
+
+class _Lease:
+    """共享客户端的在途请求计数：LLMClient 每次请求上游期间持有（同步与异步上下文均可用），
+    客户端被失效或回收后，最后一个在途请求结束时关闭其连接池"""
+
+    def __init__(self, entry: dict):
+        self._entry = entry
+
+    def __enter__(self):
+        with _LOCK:
+            self._entry['inflight'] += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        entry = self._entry
+        with _LOCK:
+            entry['inflight'] -= 1
+            close = entry['retired'] and not entry['inflight'] and not entry['closed']
+            if close:
+                entry['closed'] = True
+        if close:
+            _close_quietly(entry)
+            debug("在途请求结束，关闭已失效的LLM客户端")
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def _sweep_idle(now: float) -> None:
+    """回收空闲超时的客户端（调用方需持有 _LOCK）"""
+    global _LAST_SWEEP
+    if now - _LAST_SWEEP < 60:
+        return
+    _LAST_SWEEP = now
+    expired = [k for k, entry in _CLIENTS.items() if now - entry['last_used'] > CLIENT_IDLE_SECONDS]
+    for k in expired:
+        entry = _CLIENTS.pop(k)
+        if _retire(entry):
+            _close_quietly(entry)
+        debug(f"回收空闲LLM客户端 - URL: {k[0]}")
+
+
+def _get_entry(model_url: str, api_key: Optional[str], timeout: float) -> dict:
+    """获取（必要时创建）注册表条目，同步与异步客户端共用同一条目"""
+    key = _make_key(model_url, api_key, timeout)
+    with _LOCK:
+        now = time.time()
+        _sweep_idle(now)
+        entry = _CLIENTS.get(key)
+        if entry is None:
+            client = OpenAI(
+                base_url=model_url,
+                api_key=api_key or "",
+                timeout=timeout,
+                http_client=_build_http_client(),
+            )
+            # AsyncOpenAI 构造时不建立连接，首次请求时才在专用事件循环上建连
+            async_client = AsyncOpenAI(
+                base_url=model_url,
+                api_key=api_key or "",
+                timeout=timeout,
+                http_client=_build_async_http_client(),
+            )
+            entry = {'client': client, 'async_client': async_client, 'last_used': now,
+                     'inflight': 0, 'retired': False, 'closed': False}
+            _CLIENTS[key] = entry
+            info(f"创建共享LLM客户端 - URL: {model_url}, 超时: {timeout}秒, 当前客户端数: {len(_CLIENTS)}")
+        else:
+            entry['last_used'] = now
+        return entry
+
+
+def get_openai_client(model_url: str, api_key: Optional[str], timeout: float) -> OpenAI:
+    """获取共享的 OpenAI 客户端（同一端点复用连接池）"""
+    return _get_entry(model_url, api_key, timeout)['client']
+
+
+def get_async_openai_client(model_url: str, api_key: Optional[str], timeout: float) -> AsyncOpenAI:
+    """获取共享的 AsyncOpenAI 客户端，仅可在 async_runtime 的专用事件循环中使用"""
+    return _get_entry(model_url, api_key, timeout)['async_client']
+
+
+def get_llm_client(model_url: str, model: str, api_key: Optional[str], timeout: float = None) -> LLMClient:
+    """按模型信息获取 LLMClient，底层连接池在进程内共享"""
+    if timeout is None:
+        timeout = getattr(Config, 'LLM_TIMEOUT_SECONDS', 30)
+    entry = _get_entry(model_url, api_key, timeout)
+    return LLMClient(url=model_url, model=model, api_key=api_key or "", timeout=timeout,
+                     client=entry['client'], async_client=entry['async_client'], lease=_Lease(entry))
+
+
+def invalidate_llm_clients(model_url: str, api_key: Optional[str] = None) -> int:
+    """失效指定端点的共享客户端；提供api_key时只失效该密钥对应的客户端。
+    被移出注册表的客户端没有在途请求时立即关闭，否则在最后一个在途请求结束后关闭，不中断正在进行的请求。
+    """
+    url = (model_url or '').rstrip('/')
+    fp = _fingerprint(api_key) if api_key is not None else None
+    with _LOCK:
+        keys = [k for k in _CLIENTS if k[0] == url and (fp is None or k[1] == fp)]
+        idle = [entry for entry in (_CLIENTS.pop(k) for k in keys) if _retire(entry)]
+    for entry in idle:
+        _close_quietly(entry)
+    if keys:
+        debug(f"失效共享LLM客户端 - URL: {url}, 数量: {len(keys)}")
+    return len(keys)
+
+
+def clear_llm_clients() -> None:
+    """关闭并清空所有共享客户端"""
+    with _LOCK:
+        entries = list(_CLIENTS.values())
+        _CLIENTS.clear()
+        for entry in entries:
+            entry['retired'] = entry['closed'] = True
+    for entry in entries:
+        _close_quietly(entry)
+
+
+def get_pool_stats() -> dict:
+    """注册表统计信息"""
+    with _LOCK:
+        return {
+            'clients': len(_CLIENTS),
+            'endpoints': sorted({k[0] for k in _CLIENTS}),
+        }
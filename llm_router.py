@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+import circuit_breaker
+import endpoint_stats
+import metrics
+import tool_calling
+from config import Config
+from llm_errors import LLMUnavailableError
+from llm_pool import get_llm_client
+from log import debug, info, warning, error, exception
+
+# 对冲请求：主端点在延迟阈值内未返回时，向次优端点发出一份重复请求，先返回者胜出
+LLM_HEDGE_ENABLED = getattr(Config, 'LLM_HEDGE_ENABLED', False)
+LLM_HEDGE_DEFAULT_DELAY_MS = getattr(Config, 'LLM_HEDGE_DEFAULT_DELAY_MS', 2000)
+LLM_HEDGE_MIN_DELAY_MS = getattr(Config, 'LLM_HEDGE_MIN_DELAY_MS', 200)
+LLM_HEDGE_WORKERS = getattr(Config, 'LLM_HEDGE_WORKERS', 16)
+# 后台探测：定期探测端点池中的端点，保持延迟估计与健康状态
+LLM_PROBE_ENABLED = getattr(Config, 'LLM_PROBE_ENABLED', True)
+LLM_PROBE_INTERVAL_SECONDS = getattr(Config, 'LLM_PROBE_INTERVAL_SECONDS', 30)
+LLM_PROBE_IDLE_SECONDS = getattr(Config, 'LLM_CLIENT_IDLE_SECONDS', 600)
+
+# 同步对冲请求使用的线程池
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+
+
+class RoutedLLMClient:
+    """多端点路由客户端：接口与 LLMClient 一致（chat/achat/stream_chat/astream_chat），
+    每次调用按端点延迟EWMA与错误率选择最优的健康端点，失败时依次故障转移，可选对冲请求。"""
+
+    def __init__(self, group: str, clients: list, hedge: bool = LLM_HEDGE_ENABLED):
+        if not clients:
+            raise ValueError("端点池为空")
+        self.group = group
+        self.clients = list(clients)
+        self.hedge = hedge and len(self.clients) > 1
+        # 兼容 LLMClient 的属性（日志、缓存键等使用首个端点的信息）
+        self.model = self.clients[0].model
+        self.url = self.clients[0].url
+        self.timeout = self.clients[0].timeout
+
+    def _ranked(self) -> list:
+        """按 熔断未打开优先、健康优先、评分升序 排列端点"""
+        def sort_key(c):
+            stats = endpoint_stats.get_stats(c.url, c.model)
+            breaker = circuit_breaker.get_breaker(c.url)
+            circuit_open = breaker is not None and not breaker.allows_requests
+            return (circuit_open, not stats.healthy, stats.score())
+        ranked = sorted(self.clients, key=sort_key)
+        debug(f"端点池 {self.group} 路由顺序: {[c.url for c in ranked]}")
+        return ranked
+
+    def _hedge_delay(self, client) -> float:
+        """对冲延迟（秒）：主端点请求延迟的p95，样本不足时使用默认值"""
+        p95 = endpoint_stats.get_stats(client.url, client.model).p95()
+        delay_ms = p95 * 1000 if p95 is not None else LLM_HEDGE_DEFAULT_DELAY_MS
+        return max(LLM_HEDGE_MIN_DELAY_MS, delay_ms) / 1000
+
+    # ---------- 同步调用 ----------
+    def chat_or_raise(self, message, *args, **kwargs):
+        ranked = self._ranked()
+        last_error = None
+        start = 0
+        if self.hedge:
+            try:
+                return self._hedged(ranked[0], ranked[1], lambda c: c.chat_or_raise(message, *args, **kwargs))
+            except Exception as e:
+                last_error = e
+                start = 2
+        for client in ranked[start:]:
+            try:
+                return client.chat_or_raise(message, *args, **kwargs)
+            except Exception as e:
+                last_error = e
+                metrics.incr('llm_router.failover')
+                warning(f"端点调用失败，故障转移 - 端点池: {self.group}, URL: {client.url}, 错误: {e}")
+        raise last_error
+
+    def _hedged(self, primary, backup, call):
+        first = _HEDGE_EXECUTOR.submit(call, primary)
+        done, _ = wait([first], timeout=self._hedge_delay(primary))
+        if first in done and first.exception() is None:
+            return first.result()
+        pending = set() if first in done else {first}
+        last_error = first.exception() if first in done else None
+        metrics.incr('llm_router.hedged')
+        debug(f"发起对冲请求 - 端点池: {self.group}, 备用URL: {backup.url}")
+        pending.add(_HEDGE_EXECUTOR.submit(call, backup))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    return f.result()
+                last_error = f.exception()
+        raise last_error
+
+    def chat(self, message, *args, **kwargs):
+        try:
+            return self.chat_or_raise(message, *args, **kwargs)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            error_info = f"调用 Ollama API 时出错: {str(e)}"
+            error(f"端点池 {self.group} 所有端点均调用失败: {e}")
+            return error_info
+
+    def stream_chat(self, message, *args, **kwargs):
+        # 流式输出不做对冲，直接使用当前最优端点
+        yield from self._ranked()[0].stream_chat(message, *args, **kwargs)
+
+    # ---------- 异步调用 ----------
+    async def achat_or_raise(self, message, *args, **kwargs):
+        ranked = self._ranked()
+        last_error = None
+        start = 0
+        if self.hedge:
+            try:
+                return await self._ahedged(ranked[0], ranked[1], lambda c: c.achat_or_raise(message, *args, **kwargs))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                start = 2
+        for client in ranked[start:]:
+            try:
+                return await client.achat_or_raise(message, *args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                metrics.incr('llm_router.failover')
+                warning(f"端点调用失败，故障转移 - 端点池: {self.group}, URL: {client.url}, 错误: {e}")
+        raise last_error
+
+    async def _ahedged(self, primary, backup, call):
+        first = asyncio.ensure_future(call(primary))
+        done, _ = await asyncio.wait({first}, timeout=self._hedge_delay(primary))
+        if first in done and first.exception() is None:
+            return first.result()
+        pending = set() if first in done else {first}
+        last_error = first.exception() if first in done else None
+        metrics.incr('llm_router.hedged')
+        debug(f"发起对冲请求 - 端点池: {self.group}, 备用URL: {backup.url}")
+        pending.add(asyncio.ensure_future(call(backup)))
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    last_error = t.exception()
+            raise last_error
+        finally:
+            # 胜出后取消另一份请求
+            for t in pending:
+                t.cancel()
+
+    async def achat(self, message, *args, **kwargs):
+        try:
+            return await self.achat_or_raise(message, *args, **kwargs)
+        except (asyncio.CancelledError, LLMUnavailableError):
+            raise
+        except Exception as e:
+            error_info = f"调用 Ollama API 时出错: {str(e)}"
+            error(f"端点池 {self.group} 所有端点均调用失败: {e}")
+            return error_info
+
+    async def achat_tools(self, messages, *args, **kwargs):
+        """工具调用请求按路由顺序故障转移（不对冲：工具调用结果不应重复采用）；
+        不支持工具调用模式的错误直接抛出，由调用方回退"""
+        last_error = None
+        for client in self._ranked():
+            try:
+                return await client.achat_tools(messages, *args, **kwargs)
+            except (asyncio.CancelledError, tool_calling.ToolCallingUnsupportedError):
+                raise
+            except Exception as e:
+                last_error = e
+                metrics.incr('llm_router.failover')
+                warning(f"端点调用失败，故障转移 - 端点池: {self.group}, URL: {client.url}, 错误: {e}")
+        raise last_error
+
+    async def astream_chat(self, message, *args, **kwargs):
+        async for delta in self._ranked()[0].astream_chat(message, *args, **kwargs):
+            yield delta
+
+
+# ---------- 后台探测 ----------
+# 探测目标：(model_url, model) -> {'client': LLMClient, 'last_used': 时间戳}
+_PROBE_TARGETS: Dict[Tuple[str, str], dict] = {}
+_PROBE_LOCK = threading.Lock()
+_PROBE_THREAD = None
+
+
+def _probe_once() -> None:
+    now = time.time()
+    with _PROBE_LOCK:
+        # 长时间未被使用的端点池不再探测
+        for key in [k for k, t in _PROBE_TARGETS.items() if now - t['last_used'] > LLM_PROBE_IDLE_SECONDS]:
+            _PROBE_TARGETS.pop(key, None)
+        targets = list(_PROBE_TARGETS.values())
+    for target in targets:
+        client = target['client']
+        stats = endpoint_stats.get_stats(client.url, client.model)
+        start = time.time()
+        try:
+            # 模型列表接口开销小，用于测量端点往返延迟与可用性
+            with client._use():
+                client.client.models.list(timeout=client.timeout)
+            stats.record_probe(time.time() - start, ok=True)
+        except Exception as e:
+            stats.record_probe(time.time() - start, ok=False)
+            debug(f"端点探测失败 - URL: {client.url}, 错误: {e}")
+
+
+def _probe_loop() -> None:
+    while True:
+        time.sleep(LLM_PROBE_INTERVAL_SECONDS)
+        try:
+            _probe_once()
+        except Exception:
+            exception("端点探测异常")
+
+
+def _register_probe_targets(clients: list) -> None:
+    global _PROBE_THREAD
+    if not LLM_PROBE_ENABLED:
+        return
+    now = time.time()
+    with _PROBE_LOCK:
+        for c in clients:
+            _PROBE_TARGETS[((c.url or '').rstrip('/'), c.model)] = {'client': c, 'last_used': now}
+        if _PROBE_THREAD is None:
+            _PROBE_THREAD = threading.Thread(target=_probe_loop, name='llm-endpoint-prober', daemon=True)
+            _PROBE_THREAD.start()
+            info(f"端点后台探测已启动，间隔: {LLM_PROBE_INTERVAL_SECONDS}秒")
+
+
+def get_routed_llm_client(group: str, model_rows: List[dict]) -> RoutedLLMClient:
+    """根据同一端点池（model_group）的多条模型记录构建路由客户端"""
+    clients = [get_llm_client(m['model_url'], m['model_name'], m.get('api_key') or "") for m in model_rows]
+    _register_probe_targets(clients)
+    return RoutedLLMClient(group, clients)
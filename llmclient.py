@@ -1,98 +1,429 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
+import json
 import os
+import time
+from contextlib import nullcontext
 from log import logger, debug, info, warning, error, critical, exception
+from llm_cache import ResponseCache, get_default_cache, make_cache_key
+from singleflight import SingleFlight
+from llm_errors import LLMUnavailableError
+import circuit_breaker
+import endpoint_stats
+import rate_limiter
+import tool_calling
+from config import Config
+import metrics
 # 从环境变量读取 API Key
 api_key = os.getenv("API_KEY")
 #cmd进入设置终端 export API_KEY="你的新API密钥"
 # 使用SDK调用时需配置的base_url：https://dashscope.aliyuncs.com/compatible-mode/v1
 # 使用HTTP方式调用时需配置的endpoint：POST https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions
 
+# 是否合并并发的相同LLM请求（同一模型地址+模型+提示词+参数）
+LLM_SINGLEFLIGHT_ENABLED = getattr(Config, 'LLM_SINGLEFLIGHT_ENABLED', True)
+# 进程级在途请求表，所有 LLMClient 实例共享
+_SINGLE_FLIGHT = SingleFlight('llm_singleflight')
+# 关闭推理模型思考过程时附加到请求体的参数（默认适配 vLLM/SGLang 部署的 Qwen3 等模型）
+LLM_DISABLE_THINKING_EXTRA_BODY = getattr(Config, 'LLM_DISABLE_THINKING_EXTRA_BODY',
+                                          {'chat_template_kwargs': {'enable_thinking': False}})
+
 # 支持openai和llama 两种模型
 class LLMClient:
-    def __init__(self, url :str, model:str, api_key :str, timeout=30):  # 默认超时30秒
+    def __init__(self, url :str, model:str, api_key :str, timeout=30, client: OpenAI = None, async_client: AsyncOpenAI = None,
+                 cache: ResponseCache = None, lease=None):  # 默认超时30秒
         # 连接到本地 Ollama 服务
-        info(f"初始化LLM客户端，模型: {model}, URL: {url}, 超时设置: {timeout}秒")
         self.url = url
         self.model= model
+        self.timeout = timeout
+        self._api_key = api_key
+        # 响应缓存（可选），未传入时使用按配置开启的默认缓存（见 llm_cache.LLM_CACHE_ENABLED）
+        self.cache = cache if cache is not None else get_default_cache()
+        # 最近一次流式请求的首token耗时（毫秒）
+        self.last_ttft_ms = None
+        # 共享客户端的在途请求计数（见 llm_pool._Lease），请求上游期间持有，客户端失效后待请求结束再关闭
+        self._lease = lease
+        # 异步客户端，未传入时在首次异步调用时创建（见 _get_async_client）
+        self.async_client = async_client
+        if client is not None:
+            # 复用共享客户端（见 llm_pool.get_llm_client），不再重复建立连接池
+            debug(f"复用共享LLM客户端，模型: {model}, URL: {url}")
+            self.client = client
+            return
+        info(f"初始化LLM客户端，模型: {model}, URL: {url}, 超时设置: {timeout}秒")
         try:
             self.client = OpenAI(
                 base_url=self.url,  # Ollama 的 API 地址
                 api_key=api_key,  # Ollama 不需要真实的 API key，但参数不能为空
                 timeout=timeout  # 添加超时参数
             )
-            self.timeout = timeout
             info(f"LLM客户端初始化成功")
         except Exception as e:
             exception(f"LLM客户端初始化失败: {e}")
             raise
+
+    def _get_async_client(self) -> AsyncOpenAI:
+        """获取异步客户端（AsyncOpenAI），需在同一个事件循环中使用"""
+        if self.async_client is None:
+            self.async_client = AsyncOpenAI(
+                base_url=self.url,
+                api_key=self._api_key,
+                timeout=self.timeout
+            )
+        return self.async_client
+
+    def _warn_common_errors(self, e: Exception) -> None:
+        """检查常见错误类型并给出提示"""
+        if "Connection refused" in str(e):
+            warning("可能的原因: Ollama服务可能未启动或端口11434未开放")
+            warning("请确保Ollama服务已安装并正在运行: ollama serve")
+        elif "timeout" in str(e).lower():
+            warning("请求超时: Ollama服务可能运行缓慢或模型加载失败")
+            warning("建议: 尝试较小的模型如llama3:8b或设置更长的超时时间")
+        elif "model not found" in str(e).lower():
+            warning("模型未找到: 请确保模型已通过'ollama pull deepseek-r1:**'下载")
     
+    def _use_cache(self, temperature, allow_cache=None) -> bool:
+        """判断本次请求是否使用响应缓存"""
+        if self.cache is None or allow_cache is False:
+            return False
+        if not self.cache.is_cacheable(self.model, temperature, allow_cache):
+            metrics.incr('llm_cache.bypass')
+            return False
+        return True
+
+    def _flight_key(self, key: str) -> str:
+        """在途合并键：请求键再加上模型地址，不同端点的同名模型不合并"""
+        return f"{self.url}|{key}"
+
+    def _use(self):
+        """持有共享客户端（在途请求计数），非共享客户端为空上下文"""
+        return self._lease if self._lease is not None else nullcontext()
+
+    def _slot(self):
+        """限流许可（按模型地址的令牌桶+并发上限，见 rate_limiter），未开启限流时为空上下文"""
+        limiter = rate_limiter.get_limiter(self.url)
+        return limiter.slot() if limiter is not None else nullcontext()
+
+    def _aslot(self):
+        limiter = rate_limiter.get_limiter(self.url)
+        return limiter.aslot() if limiter is not None else nullcontext()
+
+    def _guard(self):
+        """熔断检查：端点熔断打开时立即抛出 circuit_breaker.CircuitOpenError，不再排队和请求上游"""
+        breaker = circuit_breaker.get_breaker(self.url)
+        if breaker is not None:
+            breaker.before_call()
+        return breaker
+
+    def _on_upstream_error(self, e: Exception, latency: float) -> None:
+        """记录上游调用失败；上游返回429时通知限流器暂停发放许可"""
+        endpoint_stats.record(self.url, self.model, latency, ok=False)
+        retry_after = rate_limiter.retry_after_seconds(e)
+        if retry_after is None:
+            return
+        limiter = rate_limiter.get_limiter(self.url, create=True)
+        if limiter is not None:
+            limiter.penalize(retry_after)
+
+    @staticmethod
+    def _extra_body(disable_thinking: bool):
+        """disable_thinking=True 时返回关闭思考过程的请求体参数"""
+        return LLM_DISABLE_THINKING_EXTRA_BODY if disable_thinking else None
+
+    @staticmethod
+    def _usage_tokens(response) -> int:
+        usage = getattr(response, 'usage', None)
+        return getattr(usage, 'total_tokens', 0) or 0
+
+    def _complete(self, message, temperature, max_tokens, extra_body=None):
+        """向上游发起一次非流式请求，返回 (内容, 耗时秒, token数)，异常直接抛出；
+        每次上游调用的耗时与成败记录到端点统计（endpoint_stats），供多端点路由使用；
+        调用前先经过熔断检查，再取得限流许可（排队超时抛出 rate_limiter.RateLimitError）"""
+        breaker = self._guard()
+        try:
+            with self._use(), self._slot():
+                start = time.time()
+                try:
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[{"role": "user", "content": message}], # 输入消息
+                        temperature=temperature, # 控制生成文本的随机性，数值越高越随机
+                        stream=False,  # 设置为 True 可以流式输出
+                        max_tokens=max_tokens,  # 添加最大令牌数参数
+                        timeout=self.timeout,  # 确保请求也有超时设置
+                        extra_body=extra_body
+                    )
+                except Exception as e:
+                    self._on_upstream_error(e, time.time() - start)
+                    raise
+        except BaseException as e:
+            if breaker is not None:
+                breaker.on_failure(e)
+            raise
+        if breaker is not None:
+            breaker.on_success()
+        latency = time.time() - start
+        endpoint_stats.record(self.url, self.model, latency, ok=True)
+        return response.choices[0].message.content, latency, self._usage_tokens(response)
+
+    async def _acomplete(self, message, temperature, max_tokens, extra_body=None):
+        """_complete 的异步版本"""
+        response, latency = await self._acreate([{"role": "user", "content": message}], temperature, max_tokens, extra_body)
+        return response.choices[0].message.content, latency, self._usage_tokens(response)
+
+    async def _acreate(self, messages, temperature, max_tokens, extra_body=None, **kwargs):
+        """异步非流式请求（经过熔断与限流），返回 (原始响应, 耗时秒)；kwargs 透传给接口（如 tools、response_format）"""
+        breaker = self._guard()
+        try:
+            async with self._use(), self._aslot():
+                start = time.time()
+                try:
+                    response = await self._get_async_client().chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        stream=False,
+                        max_tokens=max_tokens,
+                        timeout=self.timeout,
+                        extra_body=extra_body,
+                        **kwargs
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._on_upstream_error(e, time.time() - start)
+                    raise
+        except BaseException as e:
+            if breaker is not None:
+                breaker.on_failure(e)
+            raise
+        if breaker is not None:
+            breaker.on_success()
+        latency = time.time() - start
+        endpoint_stats.record(self.url, self.model, latency, ok=True)
+        return response, latency
+
+    async def achat_tools(self, messages, tools, mode=tool_calling.NATIVE, temperature=0.7, max_tokens=2048,
+                          disable_thinking=False):
+        """工具调用请求：一次返回模型给出的全部工具调用及参数（不走响应缓存）
+        mode: native 使用 tools/tool_calls 接口；json 使用JSON模式结构化输出（工具定义已在消息中给出）
+        返回 {'content': 文本回答, 'tool_calls': [{'id', 'name', 'arguments'}]}；
+        端点不支持该模式时抛出 tool_calling.ToolCallingUnsupportedError"""
+        debug(f"发送工具调用请求，模型: {self.model}, 模式: {mode}, 工具数: {len(tools)}")
+        kwargs = {'tools': tools} if mode == tool_calling.NATIVE else {'response_format': {'type': 'json_object'}}
+        try:
+            response, _ = await self._acreate(messages, temperature, max_tokens, self._extra_body(disable_thinking), **kwargs)
+        except Exception as e:
+            # 只有可识别的"不支持该参数"错误才视为端点不支持该模式（见 tool_calling.is_unsupported_error）
+            if tool_calling.is_unsupported_error(e, mode):
+                raise tool_calling.ToolCallingUnsupportedError(str(e)) from e
+            raise
+        message = response.choices[0].message
+        if mode == tool_calling.JSON:
+            content, calls = tool_calling.parse_json_reply(message.content)
+            return {'content': content, 'tool_calls': calls}
+        calls = []
+        for call in message.tool_calls or []:
+            try:
+                arguments = json.loads(call.function.arguments or '{}')
+            except json.JSONDecodeError:
+                warning(f"工具调用参数不是合法JSON: {call.function.arguments}")
+                arguments = {}
+            calls.append({'id': call.id, 'name': call.function.name,
+                          'arguments': arguments if isinstance(arguments, dict) else {}})
+        return {'content': message.content or '', 'tool_calls': calls}
+
+    def _fetch(self, key, message, temperature, max_tokens, use_cache, extra_body=None):
+        """请求上游并写入缓存（在途合并时只由发起者执行）"""
+        result, latency, tokens = self._complete(message, temperature, max_tokens, extra_body)
+        if use_cache:
+            self.cache.set(key, self.model, result, latency, tokens)
+        return result
+
+    async def _afetch(self, key, message, temperature, max_tokens, use_cache, extra_body=None):
+        result, latency, tokens = await self._acomplete(message, temperature, max_tokens, extra_body)
+        if use_cache:
+            # 启用SQLite持久层时缓存写入涉及磁盘IO，放到线程池中执行
+            if self.cache.has_disk_tier:
+                await asyncio.to_thread(self.cache.set, key, self.model, result, latency, tokens)
+            else:
+                self.cache.set(key, self.model, result, latency, tokens)
+        return result
+
+    def chat_or_raise(self, message, temperature=0.7, max_tokens=2048, allow_cache=None, disable_thinking=False):
+        """与 chat 相同，但出错时抛出异常而不是返回错误文本（供路由、故障转移等上层使用）
+        allow_cache: None按缓存配置；True允许温度>0的请求也走缓存；False跳过缓存
+        disable_thinking: 关闭推理模型的思考过程（见 LLM_DISABLE_THINKING_EXTRA_BODY）"""
+        debug(f"发送聊天请求，模型: {self.model}, 温度: {temperature}, 最大令牌数: {max_tokens}")
+        extra_body = self._extra_body(disable_thinking)
+        key = make_cache_key(self.model, message, temperature, max_tokens, extra_body=extra_body)
+        use_cache = self._use_cache(temperature, allow_cache)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        if LLM_SINGLEFLIGHT_ENABLED:
+            # 相同请求在途时只发起一次上游调用，其余调用共享结果（异常同样共享）
+            result = _SINGLE_FLIGHT.do(self._flight_key(key),
+                                       lambda: self._fetch(key, message, temperature, max_tokens, use_cache, extra_body))
+        else:
+            result = self._fetch(key, message, temperature, max_tokens, use_cache, extra_body)
+        info(f"聊天请求成功完成，响应长度: {len(result)} 字符")
+        return result
+
+    async def achat_or_raise(self, message, temperature=0.7, max_tokens=2048, allow_cache=None, disable_thinking=False):
+        """chat_or_raise 的异步版本"""
+        debug(f"发送异步聊天请求，模型: {self.model}, 温度: {temperature}, 最大令牌数: {max_tokens}")
+        extra_body = self._extra_body(disable_thinking)
+        key = make_cache_key(self.model, message, temperature, max_tokens, extra_body=extra_body)
+        use_cache = self._use_cache(temperature, allow_cache)
+        if use_cache:
+            # 启用SQLite持久层时缓存读取涉及磁盘IO，放到线程池中执行
+            if self.cache.has_disk_tier:
+                cached = await asyncio.to_thread(self.cache.get, key)
+            else:
+                cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        if LLM_SINGLEFLIGHT_ENABLED:
+            result = await _SINGLE_FLIGHT.ado(self._flight_key(key),
+                                              lambda: self._afetch(key, message, temperature, max_tokens, use_cache, extra_body))
+        else:
+            result = await self._afetch(key, message, temperature, max_tokens, use_cache, extra_body)
+        info(f"异步聊天请求成功完成，响应长度: {len(result)} 字符")
+        return result
+
     # 普通输出
-    def chat(self, message, temperature=0.7, max_tokens=2048):
+    def chat(self, message, temperature=0.7, max_tokens=2048, allow_cache=None, disable_thinking=False):
+        """allow_cache: None按缓存配置；True允许温度>0的请求也走缓存；False跳过缓存
+        disable_thinking: 关闭推理模型的思考过程"""
         try:
-            debug(f"发送聊天请求，模型: {self.model}, 温度: {temperature}, 最大令牌数: {max_tokens}")
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": message}], # 输入消息
-                temperature=temperature, # 控制生成文本的随机性，数值越高越随机
-                stream=False,  # 设置为 True 可以流式输出
-                max_tokens=max_tokens,  # 添加最大令牌数参数
-                timeout=self.timeout  # 确保请求也有超时设置
-            )
-            
-            result = response.choices[0].message.content
-            info(f"聊天请求成功完成，响应长度: {len(result)} 字符")
-            return result
+            return self.chat_or_raise(message, temperature, max_tokens, allow_cache, disable_thinking)
+        except LLMUnavailableError:
+            # 端点不可用（熔断/限流）时抛出类型化异常，由 ReactAgent 终止剩余计划
+            raise
         except Exception as e:
             error_info = f"调用 Ollama API 时出错: {str(e)}"
             error(error_info)
-            
-            # 检查常见错误类型
-            if "Connection refused" in str(e):
-                warning("可能的原因: Ollama服务可能未启动或端口11434未开放")
-                warning("请确保Ollama服务已安装并正在运行: ollama serve")
-            elif "timeout" in str(e).lower():
-                warning("请求超时: Ollama服务可能运行缓慢或模型加载失败")
-                warning("建议: 尝试较小的模型如llama3:8b或设置更长的超时时间")
-            elif "model not found" in str(e).lower():
-                warning("模型未找到: 请确保模型已通过'ollama pull deepseek-r1:**'下载")
-            
+            self._warn_common_errors(e)
             exception("LLM聊天请求异常")
             return error_info
+
+    # 异步普通输出，与 chat 行为一致，但不阻塞线程
+    async def achat(self, message, temperature=0.7, max_tokens=2048, allow_cache=None, disable_thinking=False):
+        try:
+            return await self.achat_or_raise(message, temperature, max_tokens, allow_cache, disable_thinking)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            error_info = f"调用 Ollama API 时出错: {str(e)}"
+            error(error_info)
+            self._warn_common_errors(e)
+            exception("LLM异步聊天请求异常")
+            return error_info
     
-    # 流式输出
-    def stream_chat(self, message, temperature=0.7, max_tokens=2048):
-        
+    # 流式输出：生成器，逐个产出增量文本
+    def stream_chat(self, message, temperature=0.7, max_tokens=2048, disable_thinking=False):
+        start = time.time()
+        ttft = None
+        breaker = None
         try:
             debug(f"发送流式聊天请求，模型: {self.model}, 温度: {temperature}, 最大令牌数: {max_tokens}")
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": message}],
-                temperature=temperature, # 控制生成文本的随机性，数值越高越随机
-                stream=True,  # 设置为 True 可以流式输出
-                max_tokens=max_tokens,  # 添加最大令牌数参数
-                timeout=self.timeout  # 确保请求也有超时设置
-            )
+            breaker = self._guard()
+            with self._use(), self._slot():
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": message}],
+                    temperature=temperature, # 控制生成文本的随机性，数值越高越随机
+                    stream=True,  # 设置为 True 可以流式输出
+                    max_tokens=max_tokens,  # 添加最大令牌数参数
+                    timeout=self.timeout,  # 确保请求也有超时设置
+                    extra_body=self._extra_body(disable_thinking)
+                )
             
-            full_response = ""
-            chunk_count = 0
-            debug("开始接收流式响应")
-            for chunk in response:
-                chunk_count += 1
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    print(content, end="", flush=True)  # 保留打印以便终端显示
-                    full_response += content
+                total_length = 0
+                chunk_count = 0
+                debug("开始接收流式响应")
+                for chunk in response:
+                    chunk_count += 1
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        if ttft is None:
+                            ttft = self._record_ttft(start)
+                        total_length += len(content)
+                        yield content
             
-            debug(f"流式响应接收完成，共 {chunk_count} 个块")
-            info(f"流式聊天请求成功完成，响应长度: {len(full_response)} 字符")
-            return full_response
-        except Exception as e:
+                debug(f"流式响应接收完成，共 {chunk_count} 个块")
+                info(f"流式聊天请求成功完成，响应长度: {total_length} 字符，首token耗时: {ttft}ms，总耗时: {(time.time() - start) * 1000:.0f}ms")
+            if breaker is not None:
+                breaker.on_success()
+        except BaseException as e:
+            if breaker is not None:
+                breaker.on_failure(e)
+            # 端点不可用（熔断/限流）与生成器关闭、任务取消直接抛出，其余错误以文本形式输出
+            if isinstance(e, LLMUnavailableError) or not isinstance(e, Exception):
+                raise
             error_msg = f"错误: {str(e)}"
             error(error_msg)
             exception("LLM流式聊天请求异常")
-            return error_msg
+            yield error_msg
+
+    # 异步流式输出：异步生成器
+    async def astream_chat(self, message, temperature=0.7, max_tokens=2048, disable_thinking=False, raise_errors=False):
+        start = time.time()
+        ttft = None
+        breaker = None
+        try:
+            debug(f"发送异步流式聊天请求，模型: {self.model}, 温度: {temperature}, 最大令牌数: {max_tokens}")
+
+            breaker = self._guard()
+            async with self._use(), self._aslot():
+                response = await self._get_async_client().chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": message}],
+                    temperature=temperature,
+                    stream=True,
+                    max_tokens=max_tokens,
+                    timeout=self.timeout,
+                    extra_body=self._extra_body(disable_thinking)
+                )
+
+                total_length = 0
+                chunk_count = 0
+                async for chunk in response:
+                    chunk_count += 1
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        if ttft is None:
+                            ttft = self._record_ttft(start)
+                        total_length += len(content)
+                        yield content
+
+                debug(f"异步流式响应接收完成，共 {chunk_count} 个块")
+                info(f"异步流式聊天请求成功完成，响应长度: {total_length} 字符，首token耗时: {ttft}ms，总耗时: {(time.time() - start) * 1000:.0f}ms")
+            if breaker is not None:
+                breaker.on_success()
+        except BaseException as e:
+            if breaker is not None:
+                breaker.on_failure(e)
+            # 端点不可用（熔断/限流）与生成器关闭、任务取消直接抛出，其余错误以文本形式输出（raise_errors=True 时抛出）
+            if isinstance(e, LLMUnavailableError) or not isinstance(e, Exception) or raise_errors:
+                raise
+            error_msg = f"错误: {str(e)}"
+            error(error_msg)
+            exception("LLM异步流式聊天请求异常")
+            yield error_msg
+
+    def _record_ttft(self, start: float) -> int:
+        """记录首token耗时（毫秒）"""
+        ttft = int((time.time() - start) * 1000)
+        self.last_ttft_ms = ttft
+        metrics.observe('llm.ttft_ms', ttft)
+        return ttft
 
 # 使用示例
 # print("=== LLM客户端测试 ===")
@@ -105,4 +436,4 @@ class LLMClient:
 # except KeyboardInterrupt:
 #     print("\n用户中断了程序")
 # except Exception as e:
-#     print(f"\n未捕获的异常: {str(e)}")
\ No newline at end of file
+#     print(f"\n未捕获的异常: {str(e)}")
@@ -0,0 +1,348 @@
+import hashlib
+import math
+import os
+import queue
+import struct
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from config import Config
+from log import debug, info, warning, exception
+from tool_index import tokenize
+
+try:
+    import numpy as np  # 见 requirements.txt：矩阵乘法检索，10万轮对话只需几毫秒
+except ImportError:
+    np = None  # 缺少 numpy 时退化为纯Python逐条计算，只适合对话量较小的部署
+
+# 长期记忆：每轮对话的向量写入按用户划分的向量索引（持久化在数据库同目录），规划时检索与问题最相关的历史对话
+LONG_TERM_MEMORY_ENABLED = getattr(Config, 'LONG_TERM_MEMORY_ENABLED', True)
+LONG_TERM_MEMORY_DIR = getattr(Config, 'LONG_TERM_MEMORY_DIR',
+                               os.path.join(os.path.dirname(Config.DB_PATH), 'memory_index'))
+LONG_TERM_MEMORY_DIM = getattr(Config, 'LONG_TERM_MEMORY_DIM', 128)
+LONG_TERM_MEMORY_TOP_K = getattr(Config, 'LONG_TERM_MEMORY_TOP_K', 3)
+LONG_TERM_MEMORY_MIN_SCORE = getattr(Config, 'LONG_TERM_MEMORY_MIN_SCORE', 0.3)
+LONG_TERM_MEMORY_MAX_USERS = getattr(Config, 'LONG_TERM_MEMORY_MAX_USERS', 100)
+# 后台构建索引时每批从数据库读取并向量化的对话数
+LONG_TERM_MEMORY_BUILD_BATCH = getattr(Config, 'LONG_TERM_MEMORY_BUILD_BATCH', 500)
+# 参与向量化的回复长度（字符），问题本身全部参与
+_EMBED_RESPONSE_CHARS = 512
+
+# 索引文件：文件头（魔数、维度、向量化方式名称）+ 追加写入的记录（int64 记录ID + dim 个 float32）
+_MAGIC = b'LTMV1\x00'
+_HEADER = struct.Struct('<6sI54s')
+
+
+class HashingEmbedder:
+    """哈希向量化：词（中文单字与相邻两字、英文单词）经哈希映射到固定维度并带符号累加，无需下载模型"""
+
+    def __init__(self, dim: int = LONG_TERM_MEMORY_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for token, tf in Counter(tokenize(text)).items():
+            h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector[h % self.dim] += (1 + math.log(tf)) * (1 if h >> 63 else -1)
+        return vector
+
+
+_EMBEDDER = HashingEmbedder()
+
+
+def set_embedder(embedder) -> None:
+    """替换向量化方式（需提供 name、dim 属性与 embed(text) 方法，如本地句向量模型）；
+    已加载的索引全部失效，磁盘上的索引在下次加载时按新方式从对话记录重建"""
+    global _EMBEDDER
+    with _LOCK:
+        _EMBEDDER = embedder
+        for memory in _INDEXES.values():
+            memory.cancelled = True
+        _INDEXES.clear()
+    info(f"长期记忆向量化方式已切换: {embedder.name}, 维度: {embedder.dim}")
+
+
+def _normalize(vector: Iterable[float]) -> List[float]:
+    vector = list(vector)
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+
+def record_text(entry: dict) -> str:
+    """对话记录参与向量化的文本：用户问题 + 回复开头"""
+    return f"{entry.get('user_message') or ''}\n{(entry.get('bot_response') or '')[:_EMBED_RESPONSE_CHARS]}"
+
+
+class VectorIndex:
+    """单位向量的内存索引，余弦相似度即内积；有 numpy 时为连续的 float32 矩阵，否则为 array 数组"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._count = 0
+        self.max_id = 0  # 已索引的最大记录ID，之后的记录需要补齐
+        if np is not None:
+            self._ids = np.empty(0, dtype=np.int64)
+            self._vectors = np.empty((0, dim), dtype=np.float32)
+        else:
+            self._ids = array('q')
+            self._vectors = array('f')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def extend(self, ids: List[int], vectors: List[List[float]]) -> None:
+        if not ids:
+            return
+        if np is not None:
+            needed = self._count + len(ids)
+            if needed > len(self._ids):
+                capacity = max(needed, 2 * len(self._ids), 64)
+                grown_ids = np.empty(capacity, dtype=np.int64)
+                grown_ids[:self._count] = self._ids[:self._count]
+                grown = np.empty((capacity, self.dim), dtype=np.float32)
+                grown[:self._count] = self._vectors[:self._count]
+                self._ids, self._vectors = grown_ids, grown
+            self._ids[self._count:needed] = ids
+            self._vectors[self._count:needed] = vectors
+        else:
+            self._ids.extend(ids)
+            for vector in vectors:
+                self._vectors.extend(vector)
+        self._count += len(ids)
+        self.max_id = max(self.max_id, max(ids))
+
+    def search(self, query: List[float], k: int) -> List[Tuple[int, float]]:
+        """内积最大的k个 (记录ID, 相似度)，按相似度降序"""
+        n = self._count
+        if not n or k <= 0:
+            return []
+        if np is not None:
+            scores = self._vectors[:n] @ np.asarray(query, dtype=np.float32)
+            top = np.argpartition(-scores, k - 1)[:k] if n > k else np.arange(n)
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [(int(self._ids[i]), float(scores[i])) for i in top]
+        dim, vectors = self.dim, self._vectors
+        scores = [sum(a * b for a, b in zip(vectors[i * dim:(i + 1) * dim], query)) for i in range(n)]
+        top = sorted(range(n), key=lambda i: -scores[i])[:k]
+        return [(self._ids[i], scores[i]) for i in top]
+
+
+class _UserMemory:
+    """一个用户的索引及其文件；索引在后台线程中分批构建（见 build），lock 保护索引与文件的读写"""
+
+    def __init__(self, user_id: int, embedder):
+        self.user_id = user_id
+        self.embedder = embedder
+        self.index = VectorIndex(embedder.dim)
+        self.path = _index_path(user_id)
+        self.loaded = False
+        self.building = False
+        self.cancelled = False  # 索引已失效（对话记录被删除、向量化方式切换），构建中止
+        self.pending: List[dict] = []  # 构建期间写入的对话记录，构建完成时合并
+        self.lock = threading.Lock()
+
+    def _header(self) -> bytes:
+        return _HEADER.pack(_MAGIC, self.embedder.dim, self.embedder.name.encode('utf-8')[:54])
+
+    def _read_file(self) -> Tuple[List[int], object]:
+        """读取索引文件，文件不存在或向量化方式不一致时返回空（随后从数据库重建）"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [], []
+        if len(data) < _HEADER.size or data[:_HEADER.size] != self._header():
+            warning(f"长期记忆索引文件与当前向量化方式不一致，将重建 - 用户ID: {self.user_id}")
+            os.remove(self.path)
+            return [], []
+        dim = self.embedder.dim
+        body = memoryview(data)[_HEADER.size:]
+        count = len(body) // (8 + 4 * dim)  # 忽略写入中断留下的不完整记录
+        if np is not None:
+            dtype = np.dtype([('id', '<i8'), ('vector', '<f4', (dim,))])
+            records = np.frombuffer(body, dtype=dtype, count=count)
+            # 多进程各自追加时可能重复写入同一条记录，按记录ID去重
+            _, first = np.unique(records['id'], return_index=True)
+            records = records[np.sort(first)]
+            return records['id'].tolist(), records['vector']
+        seen, ids, vectors = set(), [], []
+        for record in struct.iter_unpack(f'<q{dim}f', body[:count * (8 + 4 * dim)]):
+            if record[0] not in seen:
+                seen.add(record[0])
+                ids.append(record[0])
+                vectors.append(record[1:])
+        return ids, vectors
+
+    def _append_file(self, ids: List[int], vectors: List[List[float]]) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        new = not os.path.exists(self.path)
+        with open(self.path, 'ab') as f:
+            if new:
+                f.write(self._header())
+            fmt = struct.Struct(f'<q{self.embedder.dim}f')
+            f.write(b''.join(fmt.pack(record_id, *vector) for record_id, vector in zip(ids, vectors)))
+
+    def _embed(self, records: List[dict]) -> Tuple[List[int], List[List[float]]]:
+        return [r['id'] for r in records], [_normalize(self.embedder.embed(record_text(r))) for r in records]
+
+    def build(self, loader: Callable[[int, int], List[dict]]) -> None:
+        """从文件加载索引，再用 loader(after_id, limit) 分批补齐文件之后新增的对话（首次使用时即全量构建）；
+        在后台线程中执行，向量化不持有 lock，检索与写入不被长时间阻塞。
+        构建到新的索引中，全部成功后才替换 self.index：中途失败后重试时从文件重新读取，不会重复索引已有的记录"""
+        index = VectorIndex(self.embedder.dim)
+        with self.lock:
+            if self.cancelled:
+                return
+            ids, vectors = self._read_file()
+            index.extend(ids, vectors)
+        added = 0
+        while not self.cancelled:
+            missing = loader(index.max_id, LONG_TERM_MEMORY_BUILD_BATCH)
+            if missing:
+                ids, vectors = self._embed(missing)
+                with self.lock:
+                    if self.cancelled:
+                        return
+                    self._append_file(ids, vectors)
+                    index.extend(ids, vectors)
+                added += len(missing)
+            if len(missing) < LONG_TERM_MEMORY_BUILD_BATCH:
+                break
+        with self.lock:
+            if self.cancelled:
+                return
+            self.index = index
+            self.add(sorted(self.pending, key=lambda r: r['id']))
+            self.pending = []
+            self.loaded = True
+        debug(f"长期记忆索引已加载 - 用户ID: {self.user_id}, 记录数: {len(self.index)}, 补齐: {added}")
+
+    def add(self, records: List[dict]) -> None:
+        """追加新的对话记录（需持有 lock）"""
+        records = [r for r in records if r['id'] > self.index.max_id]
+        if records:
+            ids, vectors = self._embed(records)
+            self._append_file(ids, vectors)
+            self.index.extend(ids, vectors)
+
+
+# user_id -> 已加载的索引，按访问顺序排列用于LRU淘汰
+_INDEXES: "OrderedDict[int, _UserMemory]" = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _index_path(user_id: int) -> str:
+    return os.path.join(LONG_TERM_MEMORY_DIR, f'user_{user_id}.vec')
+
+
+# 后台构建队列：单个守护线程依次构建，首次检索不阻塞规划
+_BUILD_QUEUE: "queue.Queue[Tuple[_UserMemory, Callable]]" = queue.Queue()
+_BUILDER: Optional[threading.Thread] = None
+
+
+def _build_worker() -> None:
+    while True:
+        memory, loader = _BUILD_QUEUE.get()
+        try:
+            memory.build(loader)
+        except Exception as e:
+            exception(f"构建长期记忆索引失败 - 用户ID: {memory.user_id}, 错误: {e}")
+        finally:
+            memory.building = False
+            metrics.set_gauge('long_term_memory.build_queue', _BUILD_QUEUE.qsize())
+
+
+def _schedule_build(memory: _UserMemory, loader: Callable[[int, int], List[dict]]) -> None:
+    """把尚未加载的索引加入后台构建队列（已在构建中的不重复加入）"""
+    global _BUILDER
+    with _LOCK:
+        if memory.loaded or memory.building:
+            return
+        memory.building = True
+        if _BUILDER is None:
+            _BUILDER = threading.Thread(target=_build_worker, name='long-term-memory-builder', daemon=True)
+            _BUILDER.start()
+    _BUILD_QUEUE.put((memory, loader))
+    metrics.set_gauge('long_term_memory.build_queue', _BUILD_QUEUE.qsize())
+
+
+def _memory(user_id: int) -> _UserMemory:
+    with _LOCK:
+        memory = _INDEXES.get(user_id)
+        if memory is None:
+            memory = _INDEXES[user_id] = _UserMemory(user_id, _EMBEDDER)
+            while len(_INDEXES) > LONG_TERM_MEMORY_MAX_USERS:
+                evicted, old = _INDEXES.popitem(last=False)
+                old.cancelled = True
+                debug(f"长期记忆索引淘汰用户 - 用户ID: {evicted}")
+        else:
+            _INDEXES.move_to_end(user_id)
+        metrics.set_gauge('long_term_memory.users', len(_INDEXES))
+    return memory
+
+
+def record(user_id: int, entry: dict) -> None:
+    """写穿：对话记录写入数据库后追加到已加载的索引（构建中的索引在构建完成时合并）；
+    未加载的用户在下次检索触发构建时从数据库补齐"""
+    if not LONG_TERM_MEMORY_ENABLED:
+        return
+    with _LOCK:
+        memory = _INDEXES.get(user_id)
+    if memory is None:
+        return
+    try:
+        with memory.lock:
+            if memory.loaded:
+                memory.add([entry])
+            elif memory.building:
+                memory.pending.append(entry)
+    except Exception as e:
+        exception(f"写入长期记忆索引失败 - 用户ID: {user_id}, 错误: {e}")
+
+
+def search(user_id: int, query: str, loader: Callable[[int, int], List[dict]], k: int = LONG_TERM_MEMORY_TOP_K,
+           exclude: Iterable[int] = (), min_score: float = LONG_TERM_MEMORY_MIN_SCORE) -> List[Tuple[int, float]]:
+    """与 query 最相关的至多k条历史对话 (记录ID, 相似度)，跳过 exclude 中的记录（如已在短期记忆中的轮次）；
+    loader(after_id, limit) 返回该用户 id 大于 after_id 的至多 limit 条对话记录，用于构建与补齐索引。
+    索引尚未加载时在后台构建，本次返回空结果"""
+    if not LONG_TERM_MEMORY_ENABLED or k <= 0:
+        return []
+    memory = _memory(user_id)
+    if not memory.loaded:
+        _schedule_build(memory, loader)
+        metrics.incr('long_term_memory.building')
+        return []
+    exclude = set(exclude)
+    query_vector = _normalize(memory.embedder.embed(query))
+    with memory.lock:
+        hits = memory.index.search(query_vector, k + len(exclude))
+    results = [(record_id, score) for record_id, score in hits if record_id not in exclude and score >= min_score][:k]
+    metrics.incr('long_term_memory.hit' if results else 'long_term_memory.miss')
+    return results
+
+
+def invalidate(user_id: Optional[int] = None) -> None:
+    """删除用户（user_id 为None时为全部用户）的索引及其文件，如对话记录被删除后"""
+    with _LOCK:
+        for memory in ([*_INDEXES.values()] if user_id is None else [_INDEXES.get(user_id)]):
+            if memory is not None:
+                with memory.lock:  # 等待进行中的批次写完，之后的批次不再写入文件
+                    memory.cancelled = True
+        if user_id is None:
+            _INDEXES.clear()
+            paths = [os.path.join(LONG_TERM_MEMORY_DIR, name) for name in os.listdir(LONG_TERM_MEMORY_DIR)
+                     if name.endswith('.vec')] if os.path.isdir(LONG_TERM_MEMORY_DIR) else []
+        else:
+            _INDEXES.pop(user_id, None)
+            paths = [_index_path(user_id)]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        metrics.set_gauge('long_term_memory.users', len(_INDEXES))
+    debug(f"长期记忆已清除 - 用户ID: {user_id if user_id is not None else '全部'}")
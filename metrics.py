@@ -0,0 +1,55 @@
+import threading
+from typing import Dict
+
+# 进程内轻量指标：计数器、仪表盘与耗时/大小分布摘要，通过 /api/metrics 查看
+_LOCK = threading.Lock()
+_COUNTERS: Dict[str, float] = {}
+_GAUGES: Dict[str, float] = {}
+_SUMMARIES: Dict[str, dict] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    """计数器累加"""
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """设置仪表盘当前值（如队列深度）"""
+    with _LOCK:
+        _GAUGES[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """记录一次观测值（如耗时毫秒、提示词token数），汇总为 count/sum/max/last"""
+    with _LOCK:
+        s = _SUMMARIES.get(name)
+        if s is None:
+            s = {'count': 0, 'sum': 0.0, 'max': value, 'last': value}
+            _SUMMARIES[name] = s
+        s['count'] += 1
+        s['sum'] += value
+        s['last'] = value
+        if value > s['max']:
+            s['max'] = value
+
+
+def snapshot() -> dict:
+    """导出全部指标的快照"""
+    with _LOCK:
+        summaries = {}
+        for name, s in _SUMMARIES.items():
+            summaries[name] = {**s, 'avg': s['sum'] / s['count'] if s['count'] else 0}
+        return {
+            'counters': dict(_COUNTERS),
+            'gauges': dict(_GAUGES),
+            'summaries': summaries,
+        }
+
+
+def reset() -> None:
+    """清空全部指标"""
+    with _LOCK:
+        _COUNTERS.clear()
+        _GAUGES.clear()
+        _SUMMARIES.clear()
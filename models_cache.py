@@ -1,8 +1,9 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import threading
 from log import debug, warning
 from database import db
 from config import Config
+from llm_pool import invalidate_llm_clients
 import time
 
 # TTL（秒），默认从配置读取，回退5分钟
@@ -67,17 +68,37 @@ def get_model_for_user(user_id: int, model_id: int) -> Optional[dict]:
     return models.get(mid)
 
 
-def invalidate_user_models(user_id: int) -> None:
-    """失效指定用户的模型缓存。"""
+def get_group_models_for_user(user_id: int, model_group: str) -> List[dict]:
+    """获取用户可用的、属于同一端点池（model_group）的启用模型，按model_id排序"""
+    if not model_group:
+        return []
+    models = get_models_for_user(user_id)
+    return [models[mid] for mid in sorted(models) if models[mid].get('model_group') == model_group]
+
+
+def invalidate_user_models(user_id: int, old_model: Optional[dict] = None) -> None:
+    """失效指定用户的模型缓存。
+    old_model 为变更前从数据库读取的模型行（修改、删除时传入）：无论该模型是否在缓存中，都失效其旧端点的共享LLM客户端；
+    共享模型（model_flag=0）变更时同时失效所有用户的模型缓存。
+    """
     lock = _USER_LOCKS.get(user_id)
     if lock is None:
         lock = threading.Lock()
         _USER_LOCKS[user_id] = lock
     with lock:
-        if user_id in _USER_MODELS_CACHE:
+        cached = _USER_MODELS_CACHE.pop(user_id, None) or {}
+        _USER_MODELS_EXPIRY.pop(user_id, None)
+        if cached:
             debug(f"失效模型缓存 - 用户ID: {user_id}")
-            _USER_MODELS_CACHE.pop(user_id, None)
-            _USER_MODELS_EXPIRY.pop(user_id, None)
+    if old_model is None:
+        return
+    # 模型行变更（地址/密钥修改、删除）后，失效旧端点的共享LLM客户端
+    invalidate_llm_clients(old_model.get('model_url'), old_model.get('api_key'))
+    if old_model.get('model_flag') == 0:
+        # 其他用户缓存中的共享模型行同样过期
+        for uid in list(_USER_MODELS_CACHE):
+            _USER_MODELS_EXPIRY.pop(uid, None)
+        debug(f"共享模型变更，失效所有用户的模型缓存 - 模型ID: {old_model.get('model_id')}")
 
 # 可选：主动刷新用户模型缓存（重建并续期TTL）
 def refresh_user_models(user_id: int) -> Dict[int, dict]:
@@ -1,13 +1,21 @@
 import json
+
+
+def _render_tools(tools_schema) -> str:
+    """工具schema可直接传入已渲染（经 prompt_budget 裁剪）的字符串，列表则按缩进JSON渲染"""
+    if isinstance(tools_schema, str):
+        return tools_schema
+    return json.dumps(tools_schema, ensure_ascii=False, indent=2)
+
 # 创建提示词模板
-def create_prompt(user_input :str,tools_schema :list, history : str) -> str:
+def create_prompt(user_input :str,tools_schema, history : str) -> str:
     """工具调用提示词，用于生成工具调用的提示词"""
     template = f"""请分析用户问题和之前对话历史，选择合适的工具并提取参数。严格按照JSON格式返回：
 
     用户问题："{user_input}"
     对话历史: {history}
     可用工具（格式：工具名 - 描述 - 参数）：
-    {json.dumps(tools_schema, ensure_ascii=False, indent=2)}
+    {_render_tools(tools_schema)}
 
     请分析用户意图，选择最合适的工具，并提取相应的参数值。
     
@@ -41,17 +49,21 @@ def create_prompt(user_input :str,tools_schema :list, history : str) -> str:
     return template
 
 
-def create_planning_prompt(user_input: str, tools_schema: list, conversation_summary: str) -> str:
-    """创建规划提示词，用于生成执行计划"""
+def create_planning_prompt(user_input: str, tools_schema, conversation_summary: str, long_term_memory: str = '') -> str:
+    """创建规划提示词，用于生成执行计划；long_term_memory 为检索到的相关历史对话（为空时不展示）"""
+    memory_block = f"""
+    相关的更早对话（长期记忆，仅在与当前问题相关时参考）：
+    {long_term_memory}
+""" if long_term_memory else ''
     template = f"""请根据用户问题、对话历史和可用工具，为AI助手创建一个详细的执行计划。
 
     用户问题："{user_input}"
 
     对话历史摘要：
     {conversation_summary}
-
+{memory_block}
     可用工具：
-    {json.dumps(tools_schema, ensure_ascii=False, indent=2)}
+    {_render_tools(tools_schema)}
 
     请按照以下步骤思考：
     1. 分析用户的真实意图和需求
@@ -64,19 +76,32 @@ def create_planning_prompt(user_input: str, tools_schema: list, conversation_sum
     - action: 行动类型（"使用工具"、"直接回答"或"追问用户"）
     - reason: 采取该行动的理由
     - tool_name: 如果action是"使用工具"，请指定工具名称（可选）
+    - parameters: 如果action是"使用工具"且能确定全部参数，给出完整的工具参数（可选）；参数值可以用 "$step序号.result" 引用前序步骤的工具结果，
+      如计算 20+40-20 时第2步的参数为 {{"a": "$step1.result", "b": 20}}；无法确定的参数不要填写
+    - depends_on: 如果action是"使用工具"，列出该步骤需要用到其结果的前序步骤序号；互不依赖的步骤填 []，可以同时执行
 
-    示例输出：
+    示例输出（北京与上海的天气互不依赖）：
     [
       {{
         "step": 1,
         "action": "使用工具",
-        "reason": "用户需要天气信息，使用weather工具查询天气",
-        "tool_name": "weather"
+        "reason": "用户需要北京的天气信息，使用weather工具查询天气",
+        "tool_name": "weather",
+        "parameters": {{"city": "北京"}},
+        "depends_on": []
       }},
       {{
         "step": 2,
+        "action": "使用工具",
+        "reason": "用户需要上海的天气信息，使用weather工具查询天气",
+        "tool_name": "weather",
+        "parameters": {{"city": "上海"}},
+        "depends_on": []
+      }},
+      {{
+        "step": 3,
         "action": "直接回答",
-        "reason": "已获取天气信息，可以总结回答用户"
+        "reason": "已获取两地天气信息，可以总结回答用户"
       }}
       
     ]
@@ -85,6 +110,38 @@ def create_planning_prompt(user_input: str, tools_schema: list, conversation_sum
     return template
 
 
+def create_tool_calling_prompt(user_input: str, history: str, tools_schema=None) -> str:
+    """工具调用模式的提示词（规划与参数提取合为一次调用）
+    tools_schema 为空时工具定义通过接口的 tools 参数传入（原生模式）；否则为JSON模式，在提示词中给出工具定义与输出格式"""
+    template = f"""你是一个可以调用工具的AI助手。请根据用户问题和对话历史判断是否需要调用工具：
+    - 需要时调用合适的工具并给出准确的参数，参数名必须与工具定义完全一致；
+    - 相互独立的工具调用可以在同一轮一起返回，依赖其他工具结果的调用等拿到结果后再发起；
+    - 不需要工具或已获得足够信息时，直接给出简洁、友好的最终回答。
 
+    用户问题："{user_input}"
+    对话历史: {history}"""
+    if tools_schema is not None:
+        template += f"""
+
+    可用工具：
+    {_render_tools(tools_schema)}
+
+    只返回一个JSON对象，不要有其他内容：
+    {{"tool_calls": [{{"name": "工具名称", "arguments": {{"参数名": 参数值}}}}], "answer": "最终回答"}}
+    需要调用工具时 answer 留空；给出最终回答时 tool_calls 为空数组。"""
+    return template
 
 
+def create_rolling_summary_prompt(summary: str, turns: str) -> str:
+    """对话滚动摘要的提示词：把新的对话轮次折叠进已有摘要"""
+    template = f"""你负责维护与用户的对话摘要。请把"新的对话"中的信息合并进"已有摘要"，输出更新后的完整摘要：
+    - 保留用户的身份、偏好、目标、已确认的事实与数值结果，以及尚未解决的问题；
+    - 删除寒暄、重复内容和工具调用细节，较早且已不相关的内容可以压缩；
+    - 使用第三人称陈述句，总长度不超过300字，只输出摘要本身。
+
+    已有摘要：
+    {summary or "暂无"}
+
+    新的对话：
+    {turns}"""
+    return template
@@ -0,0 +1,159 @@
+import json
+import re
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from config import Config
+from log import debug, info, warning
+
+# 提示词预算配置
+PROMPT_CONTEXT_TOKENS = getattr(Config, 'PROMPT_CONTEXT_TOKENS', 8192)
+PROMPT_MODEL_CONTEXT_TOKENS = getattr(Config, 'PROMPT_MODEL_CONTEXT_TOKENS', {})
+PROMPT_RESERVED_OUTPUT_TOKENS = getattr(Config, 'PROMPT_RESERVED_OUTPUT_TOKENS', 2048)
+PROMPT_TOKENIZER = getattr(Config, 'PROMPT_TOKENIZER', 'heuristic')
+
+# 中日韩文字与全角符号，按每字约1个token估算
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def heuristic_count(text: str) -> int:
+    """快速估算token数：中日韩字符每字约1个token，其余字符约4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _load_tokenizer() -> Callable[[str], int]:
+    if PROMPT_TOKENIZER == 'tiktoken':
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding('cl100k_base')
+            info("提示词token计数使用 tiktoken(cl100k_base)")
+            return lambda text: len(encoding.encode(text or '', disallowed_special=()))
+        except Exception as e:
+            warning(f"加载tiktoken失败，使用启发式估算: {e}")
+    return heuristic_count
+
+
+_tokenizer: Optional[Callable[[str], int]] = None
+
+
+def set_tokenizer(fn: Callable[[str], int]) -> None:
+    """替换token计数函数（如接入模型自带的分词器）"""
+    global _tokenizer
+    _tokenizer = fn
+
+
+def count_tokens(text: str) -> int:
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = _load_tokenizer()
+    return _tokenizer(text or '')
+
+
+def truncate_text(text: str, max_tokens: int, keep: str = 'head') -> str:
+    """按token数截断文本；keep='head' 保留开头，'tail' 保留结尾（如对话历史保留最近的内容）"""
+    text = text or ''
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    # 二分查找能放下的最大字符数
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        part = text[:mid] if keep == 'head' else text[-mid:]
+        if count_tokens(part) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    marker = '…(已截断)'
+    return text[:lo] + marker if keep == 'head' else marker + text[-lo:]
+
+
+def context_tokens_for(model: str) -> int:
+    """模型上下文窗口大小：按模型名配置，未配置时使用默认值"""
+    return PROMPT_MODEL_CONTEXT_TOKENS.get(model, PROMPT_CONTEXT_TOKENS)
+
+
+def budget_for(model: str, max_tokens: Optional[int] = None) -> int:
+    """提示词可用预算 = 上下文窗口 - 预留给输出的token数"""
+    reserved = max_tokens if max_tokens is not None else PROMPT_RESERVED_OUTPUT_TOKENS
+    return max(256, context_tokens_for(model) - reserved)
+
+
+class Section:
+    """提示词中的一个可裁剪片段
+    variants: 由完整到精简的若干种渲染，最后一种通常是最精简（或空）的形式
+    priority: 优先级，超出预算时优先降级优先级低的片段"""
+
+    def __init__(self, name: str, variants: List, priority: int):
+        self.name = name
+        self.variants = variants
+        self.priority = priority
+        self.level = 0
+
+    @property
+    def value(self):
+        return self.variants[self.level]
+
+    @property
+    def can_shrink(self) -> bool:
+        return self.level < len(self.variants) - 1
+
+
+def text_variants(text: str, limits=(1024, 256, 0), keep: str = 'head') -> List[str]:
+    """文本片段的候选渲染：完整文本，再依次截断到 limits 中的token数（0 表示丢弃）"""
+    variants = [text or '']
+    for limit in limits:
+        v = truncate_text(text, limit, keep)
+        if v != variants[-1]:
+            variants.append(v)
+    return variants
+
+
+def tools_variants(tools_schema: list, brief: bool = True) -> List[str]:
+    """工具schema的候选渲染：缩进JSON -> 紧凑JSON -> 去掉参数描述 -> 仅工具名与描述（brief=True时）"""
+    variants = [
+        json.dumps(tools_schema, ensure_ascii=False, indent=2),
+        json.dumps(tools_schema, ensure_ascii=False, separators=(',', ':')),
+    ]
+    slim = [{
+        'name': t.get('name'),
+        'description': t.get('description'),
+        'parameters': [{k: p.get(k) for k in ('name', 'type', 'required')} for p in (t.get('parameters') or [])],
+    } for t in tools_schema]
+    variants.append(json.dumps(slim, ensure_ascii=False, separators=(',', ':')))
+    if brief:
+        variants.append(json.dumps([{'name': t.get('name'), 'description': t.get('description')} for t in tools_schema],
+                                   ensure_ascii=False, separators=(',', ':')))
+    return variants
+
+
+def fit(render: Callable[[Dict], str], sections: List[Section], budget: int, stage: str = 'prompt') -> str:
+    """在预算内渲染提示词：超出预算时按优先级从低到高逐级降级片段，直到放下或无法再裁剪；
+    每次调用的提示词大小记录到日志与指标（prompt.tokens.<stage>）"""
+    prompt = render({s.name: s.value for s in sections})
+    tokens = count_tokens(prompt)
+    original = tokens
+    while tokens > budget:
+        shrinkable = [s for s in sections if s.can_shrink]
+        if not shrinkable:
+            break
+        target = min(shrinkable, key=lambda s: s.priority)
+        target.level += 1
+        prompt = render({s.name: s.value for s in sections})
+        tokens = count_tokens(prompt)
+
+    trimmed = {s.name: s.level for s in sections if s.level}
+    metrics.observe(f'prompt.tokens.{stage}', tokens)
+    if trimmed:
+        metrics.incr(f'prompt.trimmed.{stage}')
+        info(f"提示词超出预算已裁剪 - 阶段: {stage}, token: {original} -> {tokens}/{budget}, 降级片段: {trimmed}")
+    else:
+        debug(f"提示词大小 - 阶段: {stage}, token: {tokens}/{budget}")
+    if tokens > budget:
+        metrics.incr(f'prompt.over_budget.{stage}')
+        warning(f"提示词裁剪后仍超出预算 - 阶段: {stage}, token: {tokens}/{budget}")
+    return prompt
@@ -0,0 +1,263 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+import metrics
+from config import Config
+from llm_errors import LLMUnavailableError
+from log import debug, info, warning
+
+# 限流配置：只限流 LLM_RATE_LIMITS 中列出的模型地址（按地址启用），未给出的字段取 LLM_RATE_LIMIT_DEFAULT；
+# 未列出的地址不限速，仅在上游返回429后按 Retry-After 暂停发放许可
+LLM_RATE_LIMIT_ENABLED = getattr(Config, 'LLM_RATE_LIMIT_ENABLED', True)
+LLM_RATE_LIMIT_DEFAULT = getattr(Config, 'LLM_RATE_LIMIT_DEFAULT', {})
+LLM_RATE_LIMITS = {(url or '').rstrip('/'): limits for url, limits in getattr(Config, 'LLM_RATE_LIMITS', {}).items()}
+# 上游返回429且未给出 Retry-After 时的暂停时长（秒）
+LLM_RATE_LIMIT_BACKOFF_SECONDS = getattr(Config, 'LLM_RATE_LIMIT_BACKOFF_SECONDS', 1.0)
+
+
+class RateLimitError(LLMUnavailableError):
+    """请求未能在限流器中取得执行许可（等待队列已满或排队超时）"""
+
+    def __init__(self, url: str, reason: str):
+        self.url = url
+        self.reason = reason
+        super().__init__(f"模型端点限流 - URL: {url}, 原因: {reason}")
+
+
+class _Waiter:
+    """等待队列中的一个请求：异步等待者带有所在事件循环与 asyncio.Event，同步等待者（loop 为None）在条件变量上等待"""
+    __slots__ = ('loop', 'event')
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None, event: Optional[asyncio.Event] = None):
+        self.loop = loop
+        self.event = event
+
+
+class EndpointLimiter:
+    """单个模型地址的限流器：令牌桶限制每秒请求数，同时限制并发在途请求数；
+    取不到许可的请求进入有界等待队列，按到达顺序（FIFO）发放许可，超过排队时长则抛出 RateLimitError"""
+
+    def __init__(self, url: str, rps: float = 0, burst: int = 0, max_concurrency: int = 0,
+                 max_queue: int = 100, queue_timeout: float = 30):
+        self.url = url
+        self.rps = rps  # 每秒请求数，<=0 表示不限
+        self.burst = max(1, burst or int(rps) or 1)  # 令牌桶容量
+        self.max_concurrency = max_concurrency  # 最大并发在途请求数，<=0 表示不限
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0  # 上游返回429后暂停发放许可直到该时刻
+        self._active = 0
+        # 等待队列（_Waiter），只有队首可以取得许可，后到的请求不会越过排队中的请求
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def _try_take(self) -> Optional[float]:
+        """尝试取得许可（需持有锁）：成功返回0；否则返回建议等待秒数，因并发已满而需等待释放时返回None"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.max_concurrency > 0 and self._active >= self.max_concurrency:
+            return None
+        if self.rps > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rps)
+            self._last_refill = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rps
+            self._tokens -= 1
+        self._active += 1
+        return 0
+
+    def _enqueue(self, waiter) -> None:
+        """进入等待队列（需持有锁），队列已满时拒绝"""
+        if len(self._queue) >= self.max_queue:
+            metrics.incr('llm_rate_limit.rejected.queue_full')
+            warning(f"限流等待队列已满 - URL: {self.url}, 队列长度: {len(self._queue)}")
+            raise RateLimitError(self.url, f"等待队列已满({self.max_queue})")
+        self._queue.append(waiter)
+        _update_queue_gauge(1)
+
+    def _dequeue(self, waiter) -> None:
+        """离开等待队列（需持有锁）；队首离开后唤醒新的队首"""
+        head = self._queue[0] is waiter
+        self._queue.remove(waiter)
+        _update_queue_gauge(-1)
+        if head:
+            self._wake_head()
+
+    def _wake_head(self) -> None:
+        """唤醒队首等待者重新尝试取得许可（需持有锁）"""
+        if not self._queue:
+            return
+        head = self._queue[0]
+        if head.loop is None:
+            self._cond.notify_all()
+        else:
+            head.loop.call_soon_threadsafe(head.event.set)
+
+    def _timeout(self, waited: float) -> RateLimitError:
+        metrics.incr('llm_rate_limit.rejected.timeout')
+        warning(f"限流排队超时 - URL: {self.url}, 已等待: {waited:.2f}秒")
+        return RateLimitError(self.url, f"排队超时({self.queue_timeout}秒)")
+
+    def acquire(self) -> None:
+        """同步取得许可（阻塞当前线程直到获得许可或超时）"""
+        start = time.monotonic()
+        waiter = _Waiter()
+        with self._cond:
+            if not self._queue and self._try_take() == 0:
+                return
+            self._enqueue(waiter)
+            try:
+                deadline = start + self.queue_timeout
+                while True:
+                    wait_s = self._try_take() if self._queue[0] is waiter else None
+                    if wait_s == 0:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timeout(time.monotonic() - start)
+                    self._cond.wait(remaining if wait_s is None else min(wait_s, remaining))
+            finally:
+                self._dequeue(waiter)
+        self._observe_wait(start)
+
+    async def aacquire(self) -> None:
+        """异步取得许可：在 asyncio.Event 上等待成为队首或许可释放，不阻塞事件循环"""
+        start = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if not self._queue and self._try_take() == 0:
+                return
+            self._enqueue(waiter)
+        try:
+            deadline = start + self.queue_timeout
+            while True:
+                with self._cond:
+                    # 在锁内清除事件：此后的唤醒都会在下一次等待时被看到
+                    waiter.event.clear()
+                    wait_s = self._try_take() if self._queue[0] is waiter else None
+                if wait_s == 0:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timeout(time.monotonic() - start)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), remaining if wait_s is None else min(wait_s, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._dequeue(waiter)
+        self._observe_wait(start)
+
+    def release(self) -> None:
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._wake_head()
+
+    def _observe_wait(self, start: float) -> None:
+        waited_ms = (time.monotonic() - start) * 1000
+        metrics.observe('llm_rate_limit.wait_ms', waited_ms)
+        debug(f"限流排队后取得许可 - URL: {self.url}, 等待: {waited_ms:.0f}ms")
+
+    def penalize(self, seconds: Optional[float] = None) -> None:
+        """上游返回429时调用：在 seconds 秒内暂停发放许可，并清空令牌桶"""
+        seconds = seconds if seconds and seconds > 0 else LLM_RATE_LIMIT_BACKOFF_SECONDS
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+        metrics.incr('llm_rate_limit.upstream_429')
+        warning(f"上游返回429，暂停发放许可 {seconds:.1f}秒 - URL: {self.url}")
+
+    @contextmanager
+    def slot(self):
+        """同步上下文：持有许可直到退出（流式请求在整个输出期间持有）"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'url': self.url,
+                'rps': self.rps,
+                'burst': self.burst,
+                'max_concurrency': self.max_concurrency,
+                'active': self._active,
+                'queue_depth': len(self._queue),
+                'max_queue': self.max_queue,
+                'tokens': round(self._tokens, 2),
+            }
+
+
+# 进程级限流器表：model_url -> EndpointLimiter
+_LIMITERS: Dict[str, EndpointLimiter] = {}
+_LOCK = threading.Lock()
+_QUEUE_DEPTH = 0
+
+
+def _update_queue_gauge(delta: int) -> None:
+    """所有端点的等待队列总长度"""
+    global _QUEUE_DEPTH
+    with _LOCK:
+        _QUEUE_DEPTH += delta
+        metrics.set_gauge('llm_rate_limit.queue_depth', _QUEUE_DEPTH)
+
+
+def _limits_for(url: str) -> dict:
+    limits = {'rps': 10, 'burst': 20, 'max_concurrency': 8, 'max_queue': 100, 'queue_timeout': 30}
+    limits.update(LLM_RATE_LIMIT_DEFAULT)
+    limits.update(LLM_RATE_LIMITS[url])
+    return limits
+
+
+def get_limiter(url: str, create: bool = False) -> Optional[EndpointLimiter]:
+    """获取模型地址对应的限流器；未开启 LLM_RATE_LIMIT_ENABLED 时返回None。
+    只为 LLM_RATE_LIMITS 中列出的地址创建限流器；create=True 时（上游返回429）为未列出的地址创建不限速的限流器，
+    仅用于按 Retry-After 暂停发放许可"""
+    if not LLM_RATE_LIMIT_ENABLED:
+        return None
+    key = (url or '').rstrip('/')
+    limiter = _LIMITERS.get(key)
+    if limiter is None and (create or key in LLM_RATE_LIMITS):
+        with _LOCK:
+            limiter = _LIMITERS.get(key)
+            if limiter is None:
+                limits = _limits_for(key) if key in LLM_RATE_LIMITS else {}
+                limiter = EndpointLimiter(key, **limits)
+                _LIMITERS[key] = limiter
+                info(f"创建模型端点限流器 - URL: {key}, 配置: {limits or '不限速'}")
+    return limiter
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """若异常为上游429响应，返回 Retry-After 秒数（未给出时返回0）；否则返回None"""
+    if getattr(e, 'status_code', None) != 429:
+        return None
+    response = getattr(e, 'response', None)
+    try:
+        return float(response.headers.get('retry-after', 0))
+    except Exception:
+        return 0.0
+
+
+def snapshot() -> list:
+    with _LOCK:
+        items = list(_LIMITERS.values())
+    return [l.stats() for l in items]
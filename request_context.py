@@ -0,0 +1,128 @@
+import asyncio
+import json
+import re
+import threading
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple
+
+import prompt_budget
+from log import debug
+
+
+# 单个工具schema的序列化结果：Tool -> {渲染方式: JSON文本}；工具注册表重建时会生成新的 Tool 对象，
+# 旧对象回收后缓存随之释放，因此每个注册表版本的每个工具只序列化一次
+_FRAGMENTS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_FRAGMENTS_LOCK = threading.Lock()
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+# 没有对话记录时的对话历史文本
+EMPTY_HISTORY = "暂无历史对话"
+
+
+def _numbers(value) -> set:
+    """值（文本或可序列化为JSON的参数、结果）中出现的数字"""
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return {float(n) for n in _NUMBER_RE.findall(text)}
+
+
+def _render_fragments(tool) -> Dict[str, str]:
+    schema = tool.get_schema()
+    params = schema.get('parameters') or []
+    return {
+        'indent': json.dumps(schema, ensure_ascii=False, indent=2),
+        'compact': json.dumps(schema, ensure_ascii=False, separators=(',', ':')),
+        'slim': json.dumps({
+            'name': schema.get('name'),
+            'description': schema.get('description'),
+            'parameters': [{k: p.get(k) for k in ('name', 'type', 'required')} for p in params],
+        }, ensure_ascii=False, separators=(',', ':')),
+        'brief': json.dumps({'name': schema.get('name'), 'description': schema.get('description')},
+                            ensure_ascii=False, separators=(',', ':')),
+    }
+
+
+def tool_fragments(tool) -> Dict[str, str]:
+    with _FRAGMENTS_LOCK:
+        fragments = _FRAGMENTS.get(tool)
+    if fragments is None:
+        fragments = _render_fragments(tool)
+        with _FRAGMENTS_LOCK:
+            _FRAGMENTS[tool] = fragments
+    return fragments
+
+
+def tools_variants(tools: List, brief: bool = True) -> List[str]:
+    """与 prompt_budget.tools_variants 相同的候选渲染，由各工具缓存的JSON片段拼接而成"""
+    fragments = [tool_fragments(t) for t in tools]
+    if not fragments:
+        return prompt_budget.tools_variants([], brief)
+    indented = ',\n'.join('\n'.join('  ' + line for line in f['indent'].split('\n')) for f in fragments)
+    variants = [
+        f"[\n{indented}\n]",
+        '[' + ','.join(f['compact'] for f in fragments) + ']',
+        '[' + ','.join(f['slim'] for f in fragments) + ']',
+    ]
+    if brief:
+        variants.append('[' + ','.join(f['brief'] for f in fragments) + ']')
+    return variants
+
+
+class RequestContext:
+    """单次请求内各阶段（规划、参数解析、工具调用、直接回答）共享的数据：
+    对话历史只读取一次，工具schema与历史的候选渲染在本次请求内复用"""
+
+    def __init__(self, user_id: int, user_input: str):
+        self.user_id = user_id
+        self.user_input = user_input
+        self._history: Optional[str] = None
+        self._history_lock = asyncio.Lock()
+        self._history_variants: Optional[List[str]] = None
+        self._tools_variants: Dict[Tuple, List[str]] = {}
+        # 本次请求的工具调用 (工具名, 是否成功)，用于判断问答能否写入语义缓存
+        self.tool_calls: List[Tuple[str, bool]] = []
+        # 回答使用了兜底内容（模型调用失败、未知工具等），不写入语义缓存
+        self.degraded = False
+        # 规划提示词包含了长期记忆（随问题检索，不在语义缓存范围内），不写入语义缓存
+        self.long_term_memory_used = False
+        # 工具参数中出现了既不在问题中、也不来自前序工具结果的数字（如追问"再乘以2"取自对话历史的上一轮结果）
+        self.arguments_from_context = False
+        self._known_numbers: Optional[set] = None
+
+    def record_tool_call(self, tool_name: str, ok: bool, parameters, result=None) -> None:
+        """记录一次工具调用，并检查参数中的数字是否都来自问题或前序工具的结果"""
+        if self._known_numbers is None:
+            self._known_numbers = _numbers(self.user_input)
+        if not _numbers(parameters) <= self._known_numbers:
+            self.arguments_from_context = True
+        if ok:
+            self._known_numbers |= _numbers(result)
+        self.tool_calls.append((tool_name, ok))
+
+    @property
+    def has_history(self) -> bool:
+        """本次请求是否加载到了非空的对话历史"""
+        return bool(self._history) and self._history != EMPTY_HISTORY
+
+    async def ahistory(self, loader: Callable[[int], str]) -> str:
+        """对话历史：首次调用时在线程池中执行 loader(user_id) 读取，之后直接返回（并发步骤只读取一次）"""
+        if self._history is None:
+            async with self._history_lock:
+                if self._history is None:
+                    self._history = await asyncio.to_thread(loader, self.user_id)
+                    debug(f"请求上下文加载对话历史 - 用户ID: {self.user_id}, 长度: {len(self._history)}")
+        return self._history
+
+    def history_variants(self, history: str) -> List[str]:
+        """对话历史的候选渲染（完整 -> 逐级截断）；history 为本次请求加载的历史时只计算一次"""
+        if history != self._history:
+            return prompt_budget.text_variants(history, keep='tail')
+        if self._history_variants is None:
+            self._history_variants = prompt_budget.text_variants(history, keep='tail')
+        return self._history_variants
+
+    def tools_variants(self, tools: List, brief: bool = True) -> List[str]:
+        """工具schema的候选渲染，同一组工具在本次请求内只拼接一次"""
+        key = (tuple(id(t) for t in tools), brief)
+        variants = self._tools_variants.get(key)
+        if variants is None:
+            variants = self._tools_variants[key] = tools_variants(tools, brief)
+        return variants
@@ -1,15 +1,50 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context
+import json
+import queue
 import time
 from log import logger, debug, error, exception
 from agent import ReactAgent
-from llmclient import LLMClient
+from llm_pool import get_llm_client
 from log import log_db_operation, log_api_call
-from tools_cache import get_tools_for_user
-from models_cache import get_model_for_user
+from tools_cache import get_tools_for_user, get_tool_index, get_tools_version
+from models_cache import get_model_for_user, get_group_models_for_user
+from llm_router import get_routed_llm_client
+from generation_settings import resolve_stage_settings
 from database import db
+import async_runtime
 
 chat_bp = Blueprint('chat', __name__)
 
+# 流式事件队列的结束标记
+_STREAM_END = object()
+
+
+def _build_agent(user_id, model_info) -> ReactAgent:
+    """根据模型信息构建 ReactAgent（工具与LLM客户端均来自进程级缓存）"""
+    # 使用缓存的工具注册，避免并发下重复构建
+    tools_dict = get_tools_for_user(user_id)
+    # 模型属于端点池时，在池内多个端点间按延迟与健康度路由
+    group_models = get_group_models_for_user(user_id, model_info.get('model_group'))
+    if len(group_models) > 1:
+        debug(f"使用端点池: {model_info['model_group']}，端点数: {len(group_models)}")
+        llm_client = get_routed_llm_client(model_info['model_group'], group_models)
+    else:
+        # 从进程级注册表获取共享连接池的客户端，避免每次请求重新建立TCP/TLS连接
+        llm_client = get_llm_client(
+            model_info['model_url'],
+            model_info['model_name'],
+            model_info['api_key'] or ""
+        )
+    # 各阶段生成参数以模型记录的 temperature/max_tokens 为默认值，再按配置覆盖
+    # 提示词中只包含与问题最相关的 TOOL_RETRIEVAL_TOP_K 个工具；语义缓存按工具注册表版本区分
+    return ReactAgent(llm=llm_client, tools=tools_dict, generation=resolve_stage_settings(model_info),
+                      tool_index=get_tool_index(user_id), tools_version=get_tools_version(user_id))
+
+
+def _sse(event: str, data) -> str:
+    """格式化一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 @chat_bp.route('/api/chat', methods=['POST'])
 def chat():
     start_time = time.time()
@@ -25,21 +60,13 @@ def chat():
     if not user_input:
         log_api_call('/api/chat', 'POST', 400, user_id, (time.time() - start_time) * 1000)
         return jsonify({'error': '消息不能为空'}), 400
-    # 使用缓存的工具注册，避免并发下重复构建
-    tools_dict = get_tools_for_user(user_id)
     try:
         if model_id:
             # 使用模型缓存获取（支持共享模型 + 私有模型，且只缓存启用）
             model_info = get_model_for_user(user_id, model_id)
             if model_info and model_info['is_active']:
                 debug(f"使用指定模型: {model_info['model_name']} (ID: {model_id})")
-                llm_client = LLMClient(
-                    url=model_info['model_url'],
-                    model=model_info['model_name'],
-                    api_key=model_info['api_key'] or "",
-                    timeout=30
-                )
-                t_agent = ReactAgent(llm=llm_client, tools=tools_dict)
+                t_agent = _build_agent(user_id, model_info)
                 plan_text, response_text = t_agent.process_query(user_id, user_input, model_info['model_name'])
 
             else:
@@ -60,6 +87,76 @@ def chat():
         exception("聊天处理异常")
         return jsonify({'error': str(e)}), 500
 
+@chat_bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """流式聊天（SSE）：计划生成后推送 plan，每个工具步骤完成后推送 step，最终回复按 token 推送，结束时推送 done"""
+    start_time = time.time()
+    user_id = session.get('user_id')
+    if 'user_id' not in session:
+        log_api_call('/api/chat/stream', 'POST', 401)
+        return jsonify({'error': '未登录'}), 401
+    data = request.json or {}
+    user_input = data.get('message', '')
+    model_id = data.get('model_id')
+    if not user_input:
+        log_api_call('/api/chat/stream', 'POST', 400, user_id, (time.time() - start_time) * 1000)
+        return jsonify({'error': '消息不能为空'}), 400
+    if not model_id:
+        log_api_call('/api/chat/stream', 'POST', 400, user_id, (time.time() - start_time) * 1000)
+        return jsonify({'error': '未选择模型，请在左侧启用并选择模型后再发送'}), 400
+    events = queue.Queue()
+
+    def on_event(event, payload):
+        # 在专用事件循环线程中调用，queue.Queue 线程安全
+        events.put((event, payload))
+
+    # 开始推送之前的失败（读取模型、构建Agent）与 /api/chat 一样记录并返回JSON错误
+    try:
+        model_info = get_model_for_user(user_id, model_id)
+        if not model_info or not model_info['is_active']:
+            error(f"模型不存在或未启用: {model_id}")
+            log_api_call('/api/chat/stream', 'POST', 400, user_id, (time.time() - start_time) * 1000)
+            return jsonify({'error': '所选模型不存在或未启用，请选择其他模型。'}), 400
+        t_agent = _build_agent(user_id, model_info)
+        future = async_runtime.submit(
+            t_agent.aprocess_query(user_id, user_input, model_info['model_name'], on_event=on_event)
+        )
+    except Exception as e:
+        log_api_call('/api/chat/stream', 'POST', 500, user_id, (time.time() - start_time) * 1000)
+        error(f"流式聊天处理异常 - 用户ID: {user_id}, 错误: {str(e)}")
+        exception("流式聊天处理异常")
+        return jsonify({'error': str(e)}), 500
+    future.add_done_callback(lambda f: events.put(_STREAM_END))
+
+    def generate():
+        try:
+            # 立即输出注释行，让客户端尽快收到首字节
+            yield ": stream-start\n\n"
+            while True:
+                item = events.get()
+                if item is _STREAM_END:
+                    break
+                yield _sse(*item)
+            exc = future.exception() if not future.cancelled() else None
+            if future.cancelled() or exc is not None:
+                error(f"流式聊天处理异常 - 用户ID: {user_id}, 错误: {exc}")
+                log_api_call('/api/chat/stream', 'POST', 500, user_id, (time.time() - start_time) * 1000)
+                yield _sse('error', {'error': str(exc) if exc else '请求已取消'})
+                return
+            plan_text, response_text = future.result()
+            log_api_call('/api/chat/stream', 'POST', 200, user_id, (time.time() - start_time) * 1000)
+            yield _sse('done', {'plan': plan_text, 'response': response_text})
+        finally:
+            # 客户端断开时取消仍在执行的Agent流程
+            if not future.done():
+                future.cancel()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @chat_bp.route('/api/clear_memory', methods=['POST'])
 def clear_memory():
     if 'user_id' not in session:
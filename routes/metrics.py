@@ -0,0 +1,52 @@
+from flask import Blueprint, jsonify, session
+import metrics
+import circuit_breaker
+import code_cache
+import endpoint_stats
+import rate_limiter
+from database import db
+from llm_cache import get_default_cache
+from models_cache import get_models_for_user
+from semantic_cache import get_semantic_cache
+from log import error
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# 管理员角色ID（见 startup.py），可查看全部模型端点的状态
+ADMIN_ROLE_ID = 1
+
+
+def _visible_urls(user_id):
+    """普通用户可查看的模型端点：自己可用的模型（私有与共享）的地址；管理员返回None（不过滤）"""
+    user = db.get_user_info(user_id) or {}
+    if user.get('role_id') == ADMIN_ROLE_ID:
+        return None
+    return {(m.get('model_url') or '').rstrip('/') for m in get_models_for_user(user_id).values()}
+
+
+def _filter_by_url(items, urls):
+    if urls is None:
+        return items
+    return [item for item in items if (item.get('url') or '').rstrip('/') in urls]
+
+
+@metrics_bp.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    try:
+        data = metrics.snapshot()
+        cache = get_default_cache()
+        data['llm_cache'] = cache.stats() if cache is not None else {'enabled': False}
+        answer_cache = get_semantic_cache()
+        data['semantic_cache'] = answer_cache.stats() if answer_cache is not None else {'enabled': False}
+        data['code_cache'] = code_cache.stats()
+        # 端点地址、延迟、限流与熔断状态只返回当前用户可用的模型端点（管理员返回全部）
+        urls = _visible_urls(session['user_id'])
+        data['endpoints'] = _filter_by_url(endpoint_stats.snapshot(), urls)
+        data['rate_limits'] = _filter_by_url(rate_limiter.snapshot(), urls)
+        data['circuits'] = _filter_by_url(circuit_breaker.snapshot(), urls)
+        return jsonify(data)
+    except Exception as e:
+        error(f"获取指标失败: {str(e)}")
+        return jsonify({'error': '获取指标失败'}), 500
@@ -43,6 +43,8 @@ def add_model():
         temperature = data.get('temperature', 0.7)
         max_tokens = data.get('max_tokens', 4096)
         desc = data.get('desc', "暂无")
+        # 模型端点池名称（可选），同名端点组成路由池，按延迟与健康度选择
+        model_group = (data.get('model_group') or '').strip() or None
         # 新增共享标识（0共享，1私有，默认1）
         raw_flag = data.get('model_flag', 1)
         try:
@@ -52,7 +54,7 @@ def add_model():
         model_flag = 0 if model_flag == 0 else 1
         if not model_name or not model_url or not api_key:
             return jsonify({'error': '模型名称、地址和API Key为必填项'}), 400
-        success, result = db.add_model(session['user_id'], model_name, model_url, api_key, temperature, max_tokens, desc, model_flag)
+        success, result = db.add_model(session['user_id'], model_name, model_url, api_key, temperature, max_tokens, desc, model_flag, model_group)
         if success:
             # 模型添加成功后失效当前用户的模型缓存
             invalidate_user_models(session['user_id'])
@@ -76,6 +78,9 @@ def update_model(model_id):
         max_tokens = data.get('max_tokens')
         is_active = data.get('is_active')
         desc = data.get('desc')
+        model_group = data.get('model_group')
+        if model_group is not None:
+            model_group = str(model_group).strip()
         raw_flag = data.get('model_flag')
         model_flag = None
         if raw_flag is not None:
@@ -84,15 +89,17 @@ def update_model(model_id):
             except Exception:
                 model_flag = 1
             model_flag = 0 if model_flag == 0 else 1
-        if 'is_active' in data and model_name is None and model_url is None and api_key is None and raw_flag is None and desc is None and temperature is None and max_tokens is None:
+        # 变更前的模型行，用于失效旧端点的共享LLM客户端
+        old_model = db.get_model_by_id(session['user_id'], model_id)
+        if 'is_active' in data and model_name is None and model_url is None and api_key is None and raw_flag is None and desc is None and temperature is None and max_tokens is None and model_group is None:
             success = db.update_model(user_id=session['user_id'], model_id=model_id, is_active=is_active)
         else:
             if not model_name or not model_url or not api_key:
                 return jsonify({'error': '模型名称、地址和API Key为必填项'}), 400
-            success = db.update_model(user_id=session['user_id'], model_id=model_id, model_name=model_name, model_url=model_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens, is_active=is_active, desc=desc, model_flag=model_flag)
+            success = db.update_model(user_id=session['user_id'], model_id=model_id, model_name=model_name, model_url=model_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens, is_active=is_active, desc=desc, model_flag=model_flag, model_group=model_group)
         if success:
-            # 模型更新成功后失效当前用户的模型缓存
-            invalidate_user_models(session['user_id'])
+            # 模型更新成功后失效当前用户的模型缓存及旧端点的共享客户端
+            invalidate_user_models(session['user_id'], old_model)
             return jsonify({'success': True})
         else:
             return jsonify({'error': '模型不存在或更新失败'}), 404
@@ -112,8 +119,8 @@ def delete_model(model_id):
             return jsonify({'error': '模型不存在或无权限删除'}), 404
         success = db.delete_model(user_id, model_id)
         if success:
-            # 删除成功后失效当前用户的模型缓存
-            invalidate_user_models(user_id)
+            # 删除成功后失效当前用户的模型缓存及该模型端点的共享客户端
+            invalidate_user_models(user_id, model)
             return jsonify({'success': True})
         else:
             return jsonify({'error': '删除失败或无权限'}), 400
@@ -8,7 +8,8 @@ from security_review import review_tool_code
 import ast
 import re
 import importlib.util
-from tools_cache import invalidate_user_tools
+from tools_cache import invalidate_user_tools, invalidate_public_tools
+from fast_router import validate_route_hint
 
 # 简易合规校验：语法、函数名、参数匹配、依赖模块存在
 def _extract_import_modules(tree: ast.AST):
@@ -26,7 +27,10 @@ def _extract_import_modules(tree: ast.AST):
 def validate_python_tool(code: str, tool_name: str | None, parameters):
     try:
         tree = ast.parse(code)
-    except SyntaxError as e:
+        # 注册时工具只保存源代码、首次执行才编译，这里完整编译一次（不执行），
+        # 让 'return' 在函数外、重复参数名等编译期错误在保存时就被拒绝，而不是在对话中首次调用时才暴露
+        compile(tree, f'<tool:{tool_name or "unnamed"}>', 'exec')
+    except (SyntaxError, ValueError) as e:
         return False, f"代码语法错误：{e}"
 
     # 如提供了工具名称，校验命名规则并确保存在同名函数定义
@@ -58,6 +62,10 @@ def validate_python_tool(code: str, tool_name: str | None, parameters):
                 return False, '参数列表与函数签名不匹配，函数缺少参数: ' + ', '.join(missing)
         except Exception:
             pass
+    elif not any(isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.name.startswith('_')
+                 for node in tree.body):
+        # 未提供工具名称时（如只更新代码），与加载逻辑一致，至少需要一个公开的顶层函数
+        return False, '工具代码中没有可注册的函数定义'
 
     # 依赖模块检查（静态import，不执行代码）
     missing_mods = []
@@ -110,6 +118,8 @@ def add_tool():
         code_or_url = data.get('code_or_url', '')
         tool_flag = data.get('tool_flag')
         label = data.get('label')
+        route_hint = (data.get('route_hint') or '').strip() or None
+        is_cacheable = bool(data.get('is_cacheable', False))
         if not tool_name:
             return jsonify({'error': '工具名称为必填项'}), 400
         existing_tool = db.get_function_tool_by_name(user_id, tool_name)
@@ -132,6 +142,11 @@ def add_tool():
             label = str(label).strip() or '通用'
         else:
             label = '通用'
+        if route_hint:
+            ok, msg = validate_route_hint(route_hint, parameters)
+            if not ok:
+                log_api_call('/api/tools', 'POST', 400, user_id, (time.time() - start_time) * 1000)
+                return jsonify({'error': msg}), 400
         # 新增：Python代码合规校验（语法/函数名/参数/依赖）
         if tool_type == 'function' and isinstance(code_or_url, str) and code_or_url.strip():
             ok, msg = validate_python_tool(code_or_url, tool_name, parameters)
@@ -153,11 +168,15 @@ def add_tool():
             True,
             tool_flag=tool_flag,
             label=label,
-            code_content=code_or_url
+            code_content=code_or_url,
+            route_hint=route_hint,
+            is_cacheable=is_cacheable
         )
         if success:
-            # 失效用户工具缓存
+            # 失效用户工具缓存（共享工具同时失效全局注册表）
             invalidate_user_tools(user_id)
+            if tool_flag == 0:
+                invalidate_public_tools()
             log_api_call('/api/tools', 'POST', 201, user_id, (time.time() - start_time) * 1000)
             return jsonify({'success': True, 'tool_id': result})
         else:
@@ -216,6 +235,8 @@ def update_tool(tool_id):
         code_or_url = data.get('code_or_url')
         tool_flag = data.get('tool_flag')
         label = data.get('label')
+        route_hint = data.get('route_hint')
+        is_cacheable = data.get('is_cacheable')
         parameters_json = json.dumps(parameters) if parameters is not None else None
         if tool_flag is not None:
             try:
@@ -228,6 +249,13 @@ def update_tool(tool_id):
                 return jsonify({'error': 'tool_flag必须为0（共享）或1（私有）'}), 400
         if label is not None:
             label = str(label).strip()
+        if route_hint is not None:
+            # 空字符串表示清除快速路由规则
+            route_hint = str(route_hint).strip()
+            ok, msg = validate_route_hint(route_hint, parameters) if route_hint else (True, None)
+            if not ok:
+                log_api_call(f'/api/tools/{tool_id}', 'PUT', 400, user_id, (time.time() - start_time) * 1000)
+                return jsonify({'error': msg}), 400
         # 新增：更新时也进行Python代码合规与安全校验（如提交了代码）
         if isinstance(code_or_url, str) and code_or_url and code_or_url.strip():
             ok, msg = validate_python_tool(code_or_url, tool_name, parameters)
@@ -240,6 +268,7 @@ def update_tool(tool_id):
                 log_api_call(f'/api/tools/{tool_id}', 'PUT', 400, user_id, (time.time() - start_time) * 1000)
                 warning(f"工具安全审查未通过 - 用户ID: {user_id}, 工具ID: {tool_id}, 问题: {review.get('issues')}")
                 return jsonify({'error': '安全审查未通过', 'issues': review.get('issues'), 'summary': review.get('summary')}), 400
+        previous = db.get_function_tool_by_id(user_id, tool_id)
         success = db.update_function_tool(
             user_id,
             tool_id,
@@ -249,11 +278,15 @@ def update_tool(tool_id):
             is_active=is_active,
             tool_flag=tool_flag,
             label=label,
-            code_content=code_or_url
+            code_content=code_or_url,
+            route_hint=route_hint,
+            is_cacheable=bool(is_cacheable) if is_cacheable is not None else None
         )
         if success:
-            # 失效用户工具缓存
+            # 失效用户工具缓存（更新前或更新后为共享工具时同时失效全局注册表）
             invalidate_user_tools(user_id)
+            if tool_flag == 0 or (previous and previous.get('tool_flag') == 0):
+                invalidate_public_tools()
             log_api_call(f'/api/tools/{tool_id}', 'PUT', 200, user_id, (time.time() - start_time) * 1000)
             return jsonify({'message': '工具更新成功'})
         else:
@@ -278,8 +311,10 @@ def delete_tool(tool_id):
             return jsonify({'error': '工具不存在或无权限删除'}), 404
         success = db.delete_function_tool(user_id, tool_id)
         if success:
-            # 失效用户工具缓存
+            # 失效用户工具缓存（共享工具同时失效全局注册表）
             invalidate_user_tools(user_id)
+            if tool_info.get('tool_flag') == 0:
+                invalidate_public_tools()
             log_api_call(f'/api/tools/{tool_id}', 'DELETE', 200, user_id, (time.time() - start_time) * 1000)
             return jsonify({'message': '工具删除成功'}), 200
         else:
@@ -0,0 +1,191 @@
+import hashlib
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import metrics
+from config import Config
+from log import debug
+from tool_index import tokenize
+
+# 语义缓存配置，默认从配置读取
+SEMANTIC_CACHE_ENABLED = getattr(Config, 'SEMANTIC_CACHE_ENABLED', True)
+SEMANTIC_CACHE_THRESHOLD = getattr(Config, 'SEMANTIC_CACHE_THRESHOLD', 0.7)
+SEMANTIC_CACHE_TTL_SECONDS = getattr(Config, 'SEMANTIC_CACHE_TTL_SECONDS', 600)
+SEMANTIC_CACHE_MAX_ENTRIES = getattr(Config, 'SEMANTIC_CACHE_MAX_ENTRIES', 2000)
+# MinHash 签名长度与 LSH 分段数：每段 4 个值，Jaccard 相似度约 0.5 以上的问题大概率落入同一桶
+SEMANTIC_CACHE_NUM_PERM = getattr(Config, 'SEMANTIC_CACHE_NUM_PERM', 64)
+SEMANTIC_CACHE_BANDS = getattr(Config, 'SEMANTIC_CACHE_BANDS', 16)
+
+# 不影响问题含义的口语词，规范化时去掉
+_FILLERS = ('请问', '请', '帮我', '帮忙', '麻烦', '一下', '怎么样', '如何', '吗', '呢', '吧', '呀', '啊', '的', '了')
+_FILLER_RE = re.compile('|'.join(map(re.escape, _FILLERS)))
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(SEMANTIC_CACHE_NUM_PERM)]
+
+
+def normalize_question(text: str) -> str:
+    """规范化问题：全角转半角、小写、去掉口语词与标点空白（英文单词之间保留空格）"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = _FILLER_RE.sub('', text)
+    return ' '.join(re.sub(r'[^\w]+', ' ', text).split())
+
+
+def shingles(text: str) -> FrozenSet[str]:
+    """规范化问题的特征集合：中文单字与相邻两字、英文单词与数字（与工具检索使用相同的分词）"""
+    return frozenset(tokenize(normalize_question(text)))
+
+
+def minhash(features: FrozenSet[str]) -> Tuple[int, ...]:
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode('utf-8'), digest_size=8).digest(), 'little') % _PRIME
+              for f in features]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class SemanticCache:
+    """近似问答缓存：问题的 MinHash 签名按 LSH 分段分桶，命中桶内的候选再以 Jaccard 相似度确认。
+    scope 区分可共享缓存的范围（如工具注册表版本、模型）；问题中的数字也计入 scope，"3加5" 与 "3加6" 不会互相命中"""
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, bands: int = SEMANTIC_CACHE_BANDS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = max(1, SEMANTIC_CACHE_NUM_PERM // bands)
+        # 条目ID -> {'features', 'bucket_keys', 'plan', 'answer', 'latency', 'expires_at'}
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._buckets: Dict[Tuple, set] = {}
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def _signature(self, question: str, scope: Tuple) -> Tuple[FrozenSet[str], List[Tuple]]:
+        features = shingles(question)
+        scope = scope + (tuple(_NUMBER_RE.findall(unicodedata.normalize('NFKC', question or ''))),)
+        if not features:
+            return features, []
+        sig = minhash(features)
+        return features, [(scope, band, sig[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def _remove(self, entry_id: int) -> None:
+        """删除条目及其桶索引（需持有锁）"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in entry['bucket_keys']:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def get(self, question: str, scope: Tuple) -> Optional[dict]:
+        """查找与问题足够相似的缓存问答，返回 {'plan', 'answer', 'similarity'}；未命中返回None"""
+        features, keys = self._signature(question, scope)
+        now = time.time()
+        best, best_score = None, 0.0
+        with self._lock:
+            candidates = set()
+            for key in keys:
+                candidates.update(self._buckets.get(key, ()))
+            for entry_id in candidates:
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                if entry['expires_at'] <= now:
+                    self._remove(entry_id)
+                    continue
+                score = jaccard(features, entry['features'])
+                if score >= self.threshold and score > best_score:
+                    best, best_score = entry_id, score
+            entry = self._entries.get(best) if best is not None else None
+            if entry is not None:
+                self._entries.move_to_end(best)
+                self._hits += 1
+            else:
+                self._misses += 1
+            hit_rate = self._hits / (self._hits + self._misses)
+        metrics.set_gauge('semantic_cache.hit_rate', hit_rate)
+        if entry is None:
+            metrics.incr('semantic_cache.miss')
+            return None
+        metrics.incr('semantic_cache.hit')
+        # 命中即节省了一次完整的规划、工具调用与回答生成
+        metrics.incr('semantic_cache.saved_latency_ms', entry['latency'] * 1000)
+        metrics.observe('semantic_cache.similarity', best_score)
+        debug(f"命中语义缓存 - 相似度: {best_score:.2f}, 候选数: {len(candidates)}")
+        return {'plan': entry['plan'], 'answer': entry['answer'], 'similarity': best_score}
+
+    def set(self, question: str, scope: Tuple, plan: List[Dict], answer: str, latency: float = 0) -> None:
+        features, keys = self._signature(question, scope)
+        if not keys:
+            return
+        entry = {
+            'features': features,
+            'bucket_keys': keys,
+            'plan': plan,
+            'answer': answer,
+            'latency': latency,
+            'expires_at': time.time() + self.ttl,
+        }
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                metrics.incr('semantic_cache.evicted')
+            size = len(self._entries)
+        metrics.incr('semantic_cache.stored')
+        metrics.set_gauge('semantic_cache.entries', size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+        metrics.set_gauge('semantic_cache.entries', 0)
+
+    def stats(self) -> dict:
+        counters = metrics.snapshot()['counters']
+        hits = counters.get('semantic_cache.hit', 0)
+        misses = counters.get('semantic_cache.miss', 0)
+        with self._lock:
+            size = len(self._entries)
+        return {
+            'entries': size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0,
+            'saved_latency_ms': counters.get('semantic_cache.saved_latency_ms', 0),
+        }
+
+
+# 进程级默认缓存（按配置开启）
+_DEFAULT_CACHE: Optional[SemanticCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """获取默认语义缓存；未开启 SEMANTIC_CACHE_ENABLED 时返回None"""
+    global _DEFAULT_CACHE
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if _DEFAULT_CACHE is None:
+        with _DEFAULT_LOCK:
+            if _DEFAULT_CACHE is None:
+                _DEFAULT_CACHE = SemanticCache()
+    return _DEFAULT_CACHE
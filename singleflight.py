@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import metrics
+from log import debug
+
+
+class SingleFlight:
+    """合并并发的相同请求：同一个key在途时只执行一次，所有等待者共享结果或异常。
+    同步调用（线程）与异步调用（专用事件循环）共用同一张在途表，二者之间也能合并。
+    """
+
+    def __init__(self, name: str = 'singleflight'):
+        self.name = name
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str):
+        """返回 (future, 是否为发起者)"""
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                metrics.incr(f'{self.name}.shared')
+                return fut, False
+            fut = Future()
+            self._calls[key] = fut
+            metrics.incr(f'{self.name}.leader')
+            metrics.set_gauge(f'{self.name}.inflight', len(self._calls))
+            return fut, True
+
+    def _finish(self, key: str, fut: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+            metrics.set_gauge(f'{self.name}.inflight', len(self._calls))
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """同步执行；等待者可通过timeout放弃等待（抛出TimeoutError），不影响发起者"""
+        fut, leader = self._join(key)
+        if not leader:
+            debug(f"合并在途请求，等待共享结果 - {self.name}")
+            return fut.result(timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._finish(key, fut)
+
+    async def ado(self, key: str, coro_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """异步执行；实际请求作为独立任务运行，任一等待者（包括发起者）被取消都不会中断共享请求"""
+        fut, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(coro_fn())
+
+            def _done(t: asyncio.Task) -> None:
+                if t.cancelled():
+                    fut.set_exception(asyncio.CancelledError())
+                elif t.exception() is not None:
+                    fut.set_exception(t.exception())
+                else:
+                    fut.set_result(t.result())
+                self._finish(key, fut)
+
+            task.add_done_callback(_done)
+        else:
+            debug(f"合并在途请求，等待共享结果 - {self.name}")
+        return await asyncio.shield(asyncio.wrap_future(fut))
+
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._calls)
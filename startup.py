@@ -23,7 +23,17 @@ def initialize_add_tool_and_admin():
                 parameters=json.dumps(tool['parameters']),
                 tool_flag=0,
                 label='通用',
-                code_content=tool['function']
+                code_content=tool['function'],
+                route_hint=tool.get('route_hint'),
+                is_cacheable=tool.get('is_cacheable', False)
+            )
+            # 旧数据库中已存在的内部工具不会重新添加，补齐迁移新增的路由信息
+            db.backfill_builtin_tool(
+                user_id=1,
+                tool_name=tool['tool_name'],
+                code_content=tool['function'],
+                route_hint=tool.get('route_hint'),
+                is_cacheable=tool.get('is_cacheable', False)
             )
         info(f"{len(in_tools)}个内部工具添加完成")
     except Exception as e:
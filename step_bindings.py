@@ -0,0 +1,64 @@
+import re
+from typing import Any, Dict, Optional, Set, Tuple
+
+# 计划步骤参数中对前序步骤输出的引用：$step1.result、$step2.result.city、$step3.result.items.0
+_REF_RE = re.compile(r'\$step(\d+)\.result((?:\.\w+)*)')
+
+
+class UnresolvedReference(Exception):
+    """引用的步骤不存在、执行失败，或结果中没有对应字段"""
+
+
+def references(value: Any) -> Set[int]:
+    """参数值中引用到的步骤序号"""
+    if isinstance(value, str):
+        return {int(m.group(1)) for m in _REF_RE.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*(references(v) for v in value.values())) if value else set()
+    if isinstance(value, list):
+        return set().union(*(references(v) for v in value)) if value else set()
+    return set()
+
+
+def _lookup(match: re.Match, results: Dict[int, Tuple[bool, Any]]) -> Any:
+    step = int(match.group(1))
+    ok, value = results.get(step, (False, None))
+    if not ok:
+        raise UnresolvedReference(f"第{step}步没有可用的执行结果")
+    for key in filter(None, match.group(2).split('.')):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, (list, tuple)) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            raise UnresolvedReference(f"第{step}步的结果中没有字段 {key}")
+    return value
+
+
+def resolve(value: Any, results: Dict[int, Tuple[bool, Any]]) -> Any:
+    """用前序步骤的结果 {步骤序号: (是否成功, 工具结果)} 替换参数值中的引用；
+    整个值就是一个引用时保留结果的原始类型，嵌在文本中时按字符串替换；无法解析时抛出 UnresolvedReference"""
+    if isinstance(value, str):
+        match = _REF_RE.fullmatch(value.strip())
+        if match:
+            return _lookup(match, results)
+        return _REF_RE.sub(lambda m: str(_lookup(m, results)), value)
+    if isinstance(value, dict):
+        return {k: resolve(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, results) for v in value]
+    return value
+
+
+def bind_parameters(tool, parameters: Any, results: Dict[int, Tuple[bool, Any]]) -> Optional[Dict[str, Any]]:
+    """解析计划中给出的工具参数；参数缺失、含未知参数名或引用无法解析时返回None（需要由模型解析参数）"""
+    if tool is None or not isinstance(parameters, dict):
+        return None
+    names = {p['name'] for p in tool.parameters}
+    required = {p['name'] for p in tool.parameters if p.get('required')}
+    if not required <= parameters.keys() or not parameters.keys() <= names:
+        return None
+    try:
+        return resolve(parameters, results)
+    except UnresolvedReference:
+        return None
@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+
+# 测试使用独立的临时数据库、缓存与日志目录，不触碰项目目录下的数据
+_TMP_DIR = tempfile.mkdtemp(prefix='agent-tests-')
+Config.DB_PATH = os.path.join(_TMP_DIR, 'db.sqlite3')
+Config.LLM_CACHE_DB_PATH = os.path.join(_TMP_DIR, 'llm_cache.sqlite3')
+Config.LONG_TERM_MEMORY_DIR = os.path.join(_TMP_DIR, 'memory_index')
+Config.LOG_DIR = os.path.join(_TMP_DIR, 'logs')
+
+
+class FakeLLM:
+    """按提示词返回预设回复的LLM客户端替身；replies(prompt) 返回回复文本，未提供时回复"好的\""""
+
+    model = 'fake'
+    url = 'http://fake'
+
+    def __init__(self, replies=None):
+        self.replies = replies or (lambda prompt: '好的')
+        self.prompts = []
+
+    def _next(self, prompt):
+        self.prompts.append(prompt)
+        return self.replies(prompt)
+
+    def chat(self, prompt, *args, **kwargs):
+        try:
+            return self._next(prompt)
+        except Exception as e:
+            return f"调用 Ollama API 时出错: {e}"
+
+    def chat_or_raise(self, prompt, *args, **kwargs):
+        return self._next(prompt)
+
+    async def achat(self, prompt, *args, **kwargs):
+        return self.chat(prompt)
+
+    async def achat_or_raise(self, prompt, *args, **kwargs):
+        return self._next(prompt)
+
+    async def astream_chat(self, prompt, *args, raise_errors=False, **kwargs):
+        try:
+            yield self._next(prompt)
+        except Exception as e:
+            if raise_errors:
+                raise
+            yield f"错误: {e}"
+
+
+@pytest.fixture
+def fake_llm():
+    return FakeLLM()
@@ -0,0 +1,32 @@
+import pytest
+from flask import Flask
+
+import routes.chat as chat_routes
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.register_blueprint(chat_routes.chat_bp)
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'admin'
+        yield client
+
+
+def test_stream_agent_build_failure_returns_logged_json_error(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(chat_routes, 'get_model_for_user',
+                        lambda user_id, model_id: {'is_active': True, 'model_name': 'fake', 'model_group': None})
+
+    def broken_build(user_id, model_info):
+        raise RuntimeError('数据库不可用')
+
+    monkeypatch.setattr(chat_routes, '_build_agent', broken_build)
+    monkeypatch.setattr(chat_routes, 'log_api_call', lambda *args, **kwargs: calls.append(args))
+    resp = client.post('/api/chat/stream', json={'message': '你好', 'model_id': 1})
+    assert resp.status_code == 500
+    assert resp.get_json() == {'error': '数据库不可用'}
+    assert calls and calls[-1][:3] == ('/api/chat/stream', 'POST', 500)
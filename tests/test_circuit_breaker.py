@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from rate_limiter import RateLimitError
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+def _fail(breaker, e=None):
+    breaker.before_call()
+    breaker.on_failure(e or ConnectionError('连接失败'))
+
+
+def test_opens_after_consecutive_failures_and_rejects():
+    breaker = CircuitBreaker('http://cb-open', failure_threshold=3, cooldown=30)
+    for _ in range(3):
+        _fail(breaker)
+    assert breaker.state == OPEN
+    assert not breaker.allows_requests
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_probe_closes_or_reopens():
+    breaker = CircuitBreaker('http://cb-half', failure_threshold=1, cooldown=0.05, half_open_max_calls=1)
+    _fail(breaker)
+    time.sleep(0.06)
+    assert breaker.allows_requests
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # 半开状态只放行一个试探请求
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_failure(ConnectionError('仍然失败'))
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.on_success()
+    assert breaker.state == CLOSED
+    assert breaker.consecutive_failures == 0
+
+
+def test_error_rate_in_window_opens():
+    breaker = CircuitBreaker('http://cb-rate', failure_threshold=100, error_rate_threshold=0.5, window=4, min_calls=4)
+    for ok in (True, False, True):
+        breaker.before_call()
+        breaker.on_success() if ok else breaker.on_failure(ConnectionError('x'))
+    assert breaker.state == CLOSED
+    _fail(breaker)
+    assert breaker.state == OPEN
+
+
+def test_client_errors_and_local_rejections_do_not_count():
+    breaker = CircuitBreaker('http://cb-4xx', failure_threshold=1, cooldown=0.05)
+    _fail(breaker, _HTTPError(400))
+    _fail(breaker, RateLimitError('http://cb-4xx', '排队超时'))
+    assert breaker.state == CLOSED
+    _fail(breaker, _HTTPError(503))
+    assert breaker.state == OPEN
+
+    # 半开试探请求遇到不计入的错误时归还试探名额
+    time.sleep(0.06)
+    _fail(breaker, _HTTPError(404))
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+    breaker.on_success()
+    assert breaker.state == CLOSED
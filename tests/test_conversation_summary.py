@@ -0,0 +1,32 @@
+import agent
+import conversation_summary
+from agent import ReactAgent
+
+_HISTORY = [
+    {'id': 1, 'user_message': '第一问', 'bot_response': '第一答'},
+    {'id': 2, 'user_message': '第二问', 'bot_response': '第二答'},
+    {'id': 3, 'user_message': '第三问', 'bot_response': '第三答'},
+]
+
+
+def _summarize(monkeypatch, rolling):
+    monkeypatch.setattr(agent.db, 'get_recent_chat_history', lambda user_id, limit: list(_HISTORY))
+    monkeypatch.setattr(conversation_summary, 'get_summary', lambda user_id: rolling)
+    return ReactAgent._summarize_conversation(None, 1)
+
+
+def test_turns_folded_into_the_summary_are_dropped(monkeypatch):
+    text = _summarize(monkeypatch, {'summary': '早先的对话', 'last_record_id': 2, 'turns': 2})
+    assert text.startswith('[对话摘要: 早先的对话]')
+    assert '第三问' in text
+    assert '第二问' not in text
+
+
+def test_fully_folded_history_returns_the_summary_alone(monkeypatch):
+    text = _summarize(monkeypatch, {'summary': '全部对话', 'last_record_id': 3, 'turns': 3})
+    assert text == '[对话摘要: 全部对话]'
+
+
+def test_without_rolling_summary_all_recent_turns_are_kept(monkeypatch):
+    text = _summarize(monkeypatch, None)
+    assert all(q in text for q in ('第一问', '第二问', '第三问'))
@@ -0,0 +1,60 @@
+import pytest
+
+import fast_router
+
+OPERATOR_TOOLS = {name: object() for name in fast_router.OPERATOR_TOOLS.values()}
+
+
+@pytest.mark.parametrize('text, expression', [
+    ('3*7', '3*7'),
+    ('计算 20+40-20', '20+40-20'),
+    ('（2+3）×4 等于多少？', '(2+3)*4'),
+    ('3-5=?', '3-5'),
+    ('2024 - 10', '2024-10'),
+    ('计算2024-10-18', '2024-10-18'),
+])
+def test_arithmetic_matches(text, expression):
+    hit = fast_router.match_arithmetic(text, OPERATOR_TOOLS)
+    assert hit is not None and hit.expression == expression
+
+
+@pytest.mark.parametrize('text', [
+    '2024-10-18', '138-1234-5678', '1/2/2025', '010-12345678', '2024/10', '7', '你好 3*7',
+])
+def test_dates_phone_numbers_and_plain_text_are_not_arithmetic(text):
+    assert fast_router.match_arithmetic(text, OPERATOR_TOOLS) is None
+
+
+def test_arithmetic_requires_operator_tools():
+    assert fast_router.match_arithmetic('3*7', {'add': object()}) is None
+
+
+def test_parse_respects_precedence():
+    hit = fast_router.match_arithmetic('2+3*4', OPERATOR_TOOLS)
+    assert hit.tree == ('+', 2, ('*', 3, 4))
+
+
+def _command_tools():
+    from tools import Tool
+    return {
+        'search': Tool('search', '搜索', lambda query: query,
+                       [{'name': 'query', 'type': 'str', 'required': True}]),
+        'divide': Tool('divide', '除法', lambda a, b: a / b,
+                       [{'name': 'a', 'type': 'float', 'required': True}, {'name': 'b', 'type': 'float', 'required': True}]),
+    }
+
+
+@pytest.mark.parametrize('text, tool_name, parameters', [
+    ('/search 北京天气', 'search', {'query': '北京天气'}),
+    ('/divide 6 4', 'divide', {'a': 6, 'b': 4}),
+    ('divide a=6 b=4', 'divide', {'a': 6, 'b': 4}),
+    ('search query=北京天气', 'search', {'query': '北京天气'}),
+])
+def test_command_matches(text, tool_name, parameters):
+    hit = fast_router.match_command(text, _command_tools())
+    assert hit is not None and (hit.tool_name, hit.parameters) == (tool_name, parameters)
+
+
+@pytest.mark.parametrize('text', ['search 一下今天的新闻有哪些', 'divide 6 4', '/unknown 1 2'])
+def test_natural_language_starting_with_tool_name_is_not_a_command(text):
+    assert fast_router.match_command(text, _command_tools()) is None
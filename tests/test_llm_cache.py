@@ -0,0 +1,73 @@
+import asyncio
+
+import code_cache
+from llm_cache import ResponseCache
+from llmclient import LLMClient
+
+
+class _Completions:
+    """OpenAI chat.completions 替身，记录上游调用次数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        message = type('Message', (), {'content': f"回复{self.calls}: {messages[0]['content']}"})()
+        choice = type('Choice', (), {'message': message})()
+        return type('Response', (), {'choices': [choice], 'usage': None})()
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model, messages, **kwargs):
+        return _Completions.create(self, model, messages)
+
+
+def _client(completions, cache, async_completions=None):
+    chat = type('Chat', (), {'completions': completions})()
+    openai = type('OpenAI', (), {'chat': chat})()
+    async_openai = None
+    if async_completions is not None:
+        async_openai = type('AsyncOpenAI', (), {'chat': type('Chat', (), {'completions': async_completions})()})()
+    return LLMClient(url='http://cache-test', model='fake', api_key='', client=openai,
+                     async_client=async_openai, cache=cache)
+
+
+def test_repeated_deterministic_request_hits_the_cache():
+    completions = _Completions()
+    client = _client(completions, ResponseCache())
+    first = client.chat_or_raise('你好', temperature=0)
+    assert client.chat_or_raise('  你好 ', temperature=0) == first
+    assert completions.calls == 1
+    # 不同参数与温度大于0的请求不命中缓存
+    client.chat_or_raise('你好', temperature=0, max_tokens=16)
+    client.chat_or_raise('你好', temperature=0.7)
+    assert completions.calls == 3
+    assert client.cache.stats()['entries'] == 2
+
+
+def test_async_request_shares_the_cache():
+    completions, async_completions = _Completions(), _AsyncCompletions()
+    client = _client(completions, ResponseCache(), async_completions)
+    first = asyncio.run(client.achat_or_raise('天气', temperature=0))
+    assert client.chat_or_raise('天气', temperature=0) == first
+    assert asyncio.run(client.achat_or_raise('天气', temperature=0)) == first
+    assert async_completions.calls == 1 and completions.calls == 0
+
+
+def test_code_cache_compiles_each_source_once():
+    loads = []
+
+    def loader(code, tool_name):
+        loads.append(tool_name)
+        namespace = {}
+        exec(code, {}, namespace)
+        return namespace[tool_name]
+
+    source = "def cached_tool(x):\n    return x * 3\n"
+    first = code_cache.get_function(source, 'cached_tool', loader)
+    assert code_cache.get_function(source, 'cached_tool', loader) is first
+    assert first(2) == 6
+    assert loads == ['cached_tool']
+    code_cache.get_function(source + "\n", 'cached_tool', loader)
+    assert len(loads) == 2
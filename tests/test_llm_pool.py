@@ -0,0 +1,57 @@
+import pytest
+
+import llm_pool
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    """记录被关闭的注册表条目，不真正关闭（异步客户端的关闭需要专用事件循环）"""
+    entries = []
+    monkeypatch.setattr(llm_pool, '_close_quietly', entries.append)
+    return entries
+
+
+def test_same_endpoint_shares_one_client(closed):
+    a = llm_pool.get_llm_client('http://pool-share/v1', 'm1', 'key')
+    b = llm_pool.get_llm_client('http://pool-share/v1/', 'm2', 'key')
+    c = llm_pool.get_llm_client('http://pool-share/v1', 'm1', 'other-key')
+    assert a.client is b.client
+    assert a.client is not c.client
+    llm_pool.invalidate_llm_clients('http://pool-share/v1')
+
+
+def test_invalidate_closes_idle_client_immediately(closed):
+    client = llm_pool.get_llm_client('http://pool-idle/v1', 'm', 'key')
+    assert llm_pool.invalidate_llm_clients('http://pool-idle/v1') == 1
+    assert [entry['client'] for entry in closed] == [client.client]
+    # 失效后重新获取得到新的客户端
+    assert llm_pool.get_llm_client('http://pool-idle/v1', 'm', 'key').client is not client.client
+    llm_pool.invalidate_llm_clients('http://pool-idle/v1')
+
+
+def test_retired_client_closes_after_last_lease(closed):
+    client = llm_pool.get_llm_client('http://pool-lease/v1', 'm', 'key')
+    other = llm_pool.get_llm_client('http://pool-lease/v1', 'm', 'key')
+    with client._use():
+        with other._use():
+            llm_pool.invalidate_llm_clients('http://pool-lease/v1')
+            assert closed == []
+        # 仍有一个在途请求
+        assert closed == []
+    assert len(closed) == 1 and closed[0]['client'] is client.client
+    # 再次进出租约不会重复关闭
+    with client._use():
+        pass
+    assert len(closed) == 1
+
+
+def test_idle_clients_are_swept(closed, monkeypatch):
+    monkeypatch.setattr(llm_pool, 'CLIENT_IDLE_SECONDS', 10)
+    client = llm_pool.get_llm_client('http://pool-sweep/v1', 'm', 'key')
+    key = llm_pool._make_key('http://pool-sweep/v1', 'key', client.timeout)
+    llm_pool._CLIENTS[key]['last_used'] -= 60
+    monkeypatch.setattr(llm_pool, '_LAST_SWEEP', 0.0)
+    llm_pool.get_llm_client('http://pool-sweep-other/v1', 'm', 'key')
+    assert key not in llm_pool._CLIENTS
+    assert [entry['client'] for entry in closed] == [client.client]
+    llm_pool.invalidate_llm_clients('http://pool-sweep-other/v1')
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+import llm_router
+import metrics
+from llm_router import RoutedLLMClient
+
+
+class _Endpoint:
+    """端点替身：按设定的延迟返回或失败，记录被调用的次数"""
+
+    def __init__(self, url, delay=0.0, fail=False):
+        self.url = url
+        self.model = 'fake'
+        self.timeout = 30
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = False
+
+    def chat_or_raise(self, message, *args, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError(f'{self.url} 不可用')
+        return f'{self.url}: {message}'
+
+    async def achat_or_raise(self, message, *args, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.fail:
+            raise ConnectionError(f'{self.url} 不可用')
+        return f'{self.url}: {message}'
+
+
+def _hedged_client(monkeypatch, primary, backup, delay=0.05):
+    client = RoutedLLMClient('hedge-test', [primary, backup], hedge=True)
+    monkeypatch.setattr(client, '_ranked', lambda: [primary, backup])
+    monkeypatch.setattr(client, '_hedge_delay', lambda c: delay)
+    return client
+
+
+def _counter(name):
+    return metrics.snapshot()['counters'].get(name, 0)
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    primary, backup = _Endpoint('http://primary'), _Endpoint('http://backup')
+    client = _hedged_client(monkeypatch, primary, backup, delay=1)
+    assert client.chat_or_raise('hi') == 'http://primary: hi'
+    assert backup.calls == 0
+
+
+def test_slow_primary_is_hedged_and_backup_wins(monkeypatch):
+    primary, backup = _Endpoint('http://slow', delay=0.5), _Endpoint('http://fast')
+    client = _hedged_client(monkeypatch, primary, backup)
+    hedged = _counter('llm_router.hedged')
+    start = time.monotonic()
+    assert client.chat_or_raise('hi') == 'http://fast: hi'
+    assert time.monotonic() - start < 0.4
+    assert _counter('llm_router.hedged') == hedged + 1
+
+
+def test_async_hedge_cancels_the_loser(monkeypatch):
+    primary, backup = _Endpoint('http://aslow', delay=0.5), _Endpoint('http://afast')
+    client = _hedged_client(monkeypatch, primary, backup)
+
+    async def main():
+        result = await client.achat_or_raise('hi')
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 'http://afast: hi'
+    assert primary.cancelled
+
+
+def test_failed_primary_hedges_immediately(monkeypatch):
+    primary, backup = _Endpoint('http://down', fail=True), _Endpoint('http://up')
+    client = _hedged_client(monkeypatch, primary, backup, delay=1)
+    start = time.monotonic()
+    assert client.chat_or_raise('hi') == 'http://up: hi'
+    assert time.monotonic() - start < 0.5
+
+
+def test_failover_in_ranked_order(monkeypatch):
+    endpoints = [_Endpoint('http://a', fail=True), _Endpoint('http://b', fail=True), _Endpoint('http://c')]
+    client = RoutedLLMClient('failover-test', endpoints, hedge=False)
+    monkeypatch.setattr(client, '_ranked', lambda: list(endpoints))
+    assert client.chat_or_raise('hi') == 'http://c: hi'
+    assert [e.calls for e in endpoints] == [1, 1, 1]
+    assert asyncio.run(client.achat_or_raise('hi')) == 'http://c: hi'
+
+
+def test_all_endpoints_failing(monkeypatch):
+    endpoints = [_Endpoint('http://x', fail=True), _Endpoint('http://y', fail=True)]
+    client = RoutedLLMClient('all-down-test', endpoints, hedge=False)
+    monkeypatch.setattr(client, '_ranked', lambda: list(endpoints))
+    with pytest.raises(ConnectionError, match='http://y'):
+        client.chat_or_raise('hi')
+    # chat 与 LLMClient 一致，返回错误文本
+    assert client.chat('hi').startswith('调用 Ollama API 时出错')
+
+
+def test_ranking_prefers_healthy_low_latency_endpoints():
+    import endpoint_stats
+    slow, fast, broken = _Endpoint('http://rank-slow'), _Endpoint('http://rank-fast'), _Endpoint('http://rank-broken')
+    for _ in range(5):
+        endpoint_stats.record(slow.url, slow.model, 0.5, ok=True)
+        endpoint_stats.record(fast.url, fast.model, 0.05, ok=True)
+        endpoint_stats.record(broken.url, broken.model, 0.01, ok=False)
+    client = RoutedLLMClient('rank-test', [slow, broken, fast], hedge=False)
+    assert [c.url for c in client._ranked()] == [fast.url, slow.url, broken.url]
@@ -0,0 +1,34 @@
+import pytest
+
+import long_term_memory
+from long_term_memory import HashingEmbedder, _UserMemory
+
+
+def _records(after_id, limit, total=5):
+    return [{'id': i, 'user_message': f'问题{i}', 'bot_response': f'回答{i}'}
+            for i in range(after_id + 1, min(after_id + limit, total) + 1)]
+
+
+def test_retry_after_partial_failure_does_not_duplicate_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(long_term_memory, 'LONG_TERM_MEMORY_BUILD_BATCH', 2)
+    memory = _UserMemory(990001, HashingEmbedder(32))
+    memory.path = str(tmp_path / 'user_990001.vec')
+    calls = []
+
+    def flaky_loader(after_id, limit):
+        calls.append(after_id)
+        if len(calls) == 2:
+            raise RuntimeError('数据库暂时不可用')
+        return _records(after_id, limit)
+
+    # 第一批已写入文件后失败：索引不替换，仍为空且未加载
+    with pytest.raises(RuntimeError):
+        memory.build(flaky_loader)
+    assert not memory.loaded
+    assert len(memory.index) == 0
+
+    memory.build(_records)
+    assert memory.loaded
+    assert len(memory.index) == 5
+    ids = sorted(record_id for record_id, _ in memory.index.search([0.0] * 32, 10))
+    assert ids == [1, 2, 3, 4, 5]
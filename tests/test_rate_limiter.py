@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import EndpointLimiter, RateLimitError
+
+
+def _wait_for_queue(limiter, depth, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while limiter.stats()['queue_depth'] < depth:
+        assert time.monotonic() < deadline, '等待者未进入队列'
+        time.sleep(0.005)
+
+
+def test_waiters_get_permits_in_arrival_order():
+    limiter = EndpointLimiter('http://rl-fifo', max_concurrency=1, queue_timeout=5)
+    limiter.acquire()
+    order = []
+
+    def worker(n):
+        with limiter.slot():
+            order.append(n)
+
+    threads = []
+    for n in range(4):
+        t = threading.Thread(target=worker, args=(n,))
+        t.start()
+        threads.append(t)
+        _wait_for_queue(limiter, n + 1)
+    limiter.release()
+    for t in threads:
+        t.join(5)
+    assert order == [0, 1, 2, 3]
+    assert limiter.stats()['active'] == 0
+
+
+def test_async_waiter_does_not_jump_the_queue():
+    limiter = EndpointLimiter('http://rl-async', max_concurrency=1, queue_timeout=5)
+    limiter.acquire()
+    order = []
+
+    def sync_worker():
+        with limiter.slot():
+            order.append('sync')
+
+    t = threading.Thread(target=sync_worker)
+    t.start()
+    _wait_for_queue(limiter, 1)
+
+    async def async_worker():
+        async with limiter.aslot():
+            order.append('async')
+
+    async def main():
+        task = asyncio.ensure_future(async_worker())
+        while limiter.stats()['queue_depth'] < 2:
+            await asyncio.sleep(0.005)
+        limiter.release()
+        await task
+
+    asyncio.run(main())
+    t.join(5)
+    assert order == ['sync', 'async']
+
+
+def test_full_queue_and_queue_timeout_are_rejected():
+    limiter = EndpointLimiter('http://rl-reject', max_concurrency=1, max_queue=1, queue_timeout=0.2)
+    limiter.acquire()
+    errors = []
+
+    def queued():
+        try:
+            limiter.acquire()
+        except RateLimitError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=queued)
+    t.start()
+    _wait_for_queue(limiter, 1)
+    with pytest.raises(RateLimitError, match='队列已满'):
+        limiter.acquire()
+    t.join(5)
+    assert len(errors) == 1
+    start = time.monotonic()
+    with pytest.raises(RateLimitError, match='排队超时'):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_token_bucket_limits_request_rate():
+    limiter = EndpointLimiter('http://rl-rps', rps=20, burst=1, queue_timeout=5)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release()
+    # 桶容量为1：第2、3次各等待约 1/20 秒
+    assert time.monotonic() - start >= 0.08
+
+
+def test_only_configured_endpoints_are_limited(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'LLM_RATE_LIMITS', {'http://rl-listed': {'rps': 2}})
+    monkeypatch.setattr(rate_limiter, '_LIMITERS', {})
+    assert rate_limiter.get_limiter('http://rl-unlisted') is None
+    listed = rate_limiter.get_limiter('http://rl-listed/')
+    assert listed.rps == 2 and listed.max_concurrency == 8
+    # 上游返回429时为未列出的地址创建不限速的限流器，只用于暂停发放许可
+    created = rate_limiter.get_limiter('http://rl-unlisted', create=True)
+    assert created.rps == 0 and created.max_concurrency == 0
+
+
+def test_upstream_429_pauses_permits():
+    limiter = EndpointLimiter('http://rl-429', queue_timeout=5)
+    limiter.penalize(0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    limiter.release()
+    assert time.monotonic() - start >= 0.15
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': headers or {}})()
+
+
+def test_retry_after_is_read_only_from_429():
+    assert rate_limiter.retry_after_seconds(_HTTPError(429, {'retry-after': '3'})) == 3.0
+    assert rate_limiter.retry_after_seconds(_HTTPError(429)) == 0.0
+    assert rate_limiter.retry_after_seconds(_HTTPError(500)) is None
+    assert rate_limiter.retry_after_seconds(ValueError('x')) is None
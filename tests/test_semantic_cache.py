@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+import chat_memory
+import semantic_cache
+from agent import ReactAgent
+from database import db
+from semantic_cache import SemanticCache
+from startup import initialize_add_tool_and_admin
+from tools_cache import get_tool_index, get_tools_for_user, get_tools_version
+
+
+def test_similar_question_hits():
+    cache = SemanticCache(threshold=0.5)
+    cache.set('12加30等于多少', ('v1', 'm'), [{'step': 1}], '42')
+    hit = cache.get('请问12加30等于多少？', ('v1', 'm'))
+    assert hit is not None and hit['answer'] == '42'
+
+
+def test_numbers_and_scope_must_match():
+    cache = SemanticCache(threshold=0.5)
+    cache.set('12加30等于多少', ('v1', 'm'), [], '42')
+    assert cache.get('12加31等于多少', ('v1', 'm')) is None
+    assert cache.get('12加30等于多少', ('v2', 'm')) is None
+
+
+def test_expired_entry_misses():
+    cache = SemanticCache(threshold=0.5, ttl=0)
+    cache.set('12加30等于多少', ('v1', 'm'), [], '42')
+    assert cache.get('12加30等于多少', ('v1', 'm')) is None
+
+
+def _plan(name, a, b):
+    return json.dumps([
+        {"step": 1, "action": "使用工具", "reason": name, "tool_name": name, "parameters": {"a": a, "b": b}},
+        {"step": 2, "action": "直接回答", "reason": "总结"},
+    ], ensure_ascii=False)
+
+
+class _Planner:
+    """规划提示词按问题返回预设计划，其余提示词返回 "结果"；记录规划调用次数"""
+
+    def __init__(self, plans):
+        self.plans = plans
+        self.plan_calls = 0
+
+    def __call__(self, prompt):
+        if '执行计划' in prompt and '可用工具' in prompt:
+            self.plan_calls += 1
+            question = prompt.split('用户问题：')[1].split('\n')[0]
+            for key, plan in self.plans.items():
+                if key in question:
+                    return plan
+        return '结果'
+
+
+@pytest.fixture
+def agent_factory(fake_llm):
+    initialize_add_tool_and_admin()
+    semantic_cache.get_semantic_cache().clear()
+
+    def build(user_id, replies):
+        fake_llm.replies = replies
+        return ReactAgent(llm=fake_llm, tools=get_tools_for_user(user_id), tool_index=get_tool_index(user_id),
+                          tools_version=get_tools_version(user_id))
+    return build
+
+
+def _reset_history(user_id):
+    db.delete_chat_history(user_id)
+    chat_memory.invalidate(user_id)
+
+
+def test_repeated_cacheable_question_hits_across_turns_and_users(agent_factory):
+    planner = _Planner({'12加30': _plan('add', 12, 30)})
+    _reset_history(1)
+    agent = agent_factory(1, planner)
+    hits = semantic_cache.get_semantic_cache().stats()['hits']
+    for _ in range(3):
+        agent.process_query(1, '12加30等于多少', 'fake')
+    assert planner.plan_calls == 1
+    db.register_user(username='cache_user2', password='Passw0rd!x')
+    _, user2 = db.login_user('cache_user2', 'Passw0rd!x')
+    agent_factory(user2, planner).process_query(user2, '请问12加30等于多少？', 'fake')
+    assert planner.plan_calls == 1
+    assert semantic_cache.get_semantic_cache().stats()['hits'] - hits == 3
+
+
+def test_follow_up_using_history_is_not_cached(agent_factory):
+    planner = _Planner({'3乘以5': _plan('multiply', 3, 5), '再乘以2': _plan('multiply', 15, 2)})
+    _reset_history(1)
+    agent = agent_factory(1, planner)
+    agent.process_query(1, '3乘以5', 'fake')
+    agent.process_query(1, '再乘以2', 'fake')
+    assert planner.plan_calls == 2
+    # 另一段对话中的同一追问不能命中上一段对话的结果
+    _reset_history(1)
+    agent.process_query(1, '3乘以5', 'fake')
+    agent.process_query(1, '再乘以2', 'fake')
+    assert planner.plan_calls == 3
+
+
+def test_failed_summary_is_not_cached(agent_factory):
+    planner = _Planner({'7加8': _plan('add', 7, 8)})
+
+    def replies(prompt):
+        if '总结回答用户问题' in prompt:
+            raise RuntimeError('upstream 500')
+        return planner(prompt)
+    _reset_history(1)
+    agent = agent_factory(1, replies)
+    agent.process_query(1, '7加8等于多少', 'fake')
+    assert agent._ctx.degraded
+    agent.process_query(1, '7加8等于多少', 'fake')
+    assert planner.plan_calls == 2
+
+
+def test_question_without_history_is_cached_even_if_numbers_are_words(agent_factory):
+    planner = _Planner({'十二与三十': _plan('add', 12, 30)})
+    _reset_history(1)
+    agent = agent_factory(1, planner)
+    agent.process_query(1, '十二与三十之和是多少', 'fake')
+    _reset_history(1)
+    agent.process_query(1, '十二与三十之和是多少', 'fake')
+    assert planner.plan_calls == 1
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from tool_sandbox import ToolSandbox, ToolSandboxError, ToolTimeoutError
+
+SLEEP = "import time\ndef nap(seconds):\n    time.sleep(seconds)\n    return seconds"
+PID = "def pid():\n    import os\n    return os.getpid()"
+FAIL = "def fail():\n    raise ValueError('boom')"
+
+
+@pytest.fixture
+def sandbox_factory():
+    created = []
+
+    def build(**kwargs):
+        sandbox = ToolSandbox(**kwargs)
+        created.append(sandbox)
+        return sandbox
+    yield build
+    for sandbox in created:
+        sandbox.shutdown()
+
+
+def test_result_and_error(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout=10)
+    assert sandbox.call('nap', SLEEP, {'seconds': 0}) == 0
+    with pytest.raises(ToolSandboxError, match='boom'):
+        sandbox.call('fail', FAIL, {})
+
+
+def test_timeout_kills_and_replaces_worker(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout=0.5)
+    before = sandbox.call('pid', PID, {})
+    with pytest.raises(ToolTimeoutError):
+        sandbox.call('nap', SLEEP, {'seconds': 5})
+    assert sandbox.call('pid', PID, {}) != before
+
+
+def test_worker_is_recycled_after_max_calls(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout=10, max_calls=2)
+    first = sandbox.call('pid', PID, {})
+    assert sandbox.call('pid', PID, {}) == first
+    assert sandbox.call('pid', PID, {}) != first
+
+
+def test_queue_wait_does_not_count_against_execution_timeout(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout=1.0, queue_timeout=10)
+    sandbox.call('nap', SLEEP, {'seconds': 0})
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(sandbox.call('nap', SLEEP, {'seconds': 0.7}))
+        except ToolSandboxError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and results == [0.7, 0.7]
+
+
+def test_busy_sandbox_rejects_after_queue_timeout(sandbox_factory):
+    sandbox = sandbox_factory(workers=1, timeout=10, queue_timeout=0.2)
+    sandbox.call('nap', SLEEP, {'seconds': 0})
+    t = threading.Thread(target=sandbox.call, args=('nap', SLEEP, {'seconds': 1}))
+    t.start()
+    try:
+        with pytest.raises(ToolSandboxError, match='繁忙'):
+            sandbox.call('nap', SLEEP, {'seconds': 0})
+    finally:
+        t.join()
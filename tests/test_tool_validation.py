@@ -0,0 +1,30 @@
+import pytest
+
+from routes.tools import validate_python_tool
+
+
+def test_valid_tool_passes():
+    ok, msg = validate_python_tool("def add_one(x):\n    return x + 1\n", 'add_one', [{'name': 'x'}])
+    assert ok, msg
+
+
+@pytest.mark.parametrize('code', [
+    "def broken(x:\n    return x\n",
+    "def broken(x):\n    return x\nreturn 1\n",
+    "def broken(x, x):\n    return x\n",
+    "def broken(x):\n    nonlocal y\n    return x\n",
+    "def broken(x):\n    return x\nbreak\n",
+])
+def test_compile_errors_are_rejected_at_save_time(code):
+    ok, msg = validate_python_tool(code, 'broken', None)
+    assert not ok
+    assert '语法错误' in msg
+
+
+def test_missing_function_is_rejected():
+    ok, _ = validate_python_tool("def other(x):\n    return x\n", 'wanted', None)
+    assert not ok
+    ok, _ = validate_python_tool("x = 1\n", None, None)
+    assert not ok
+    ok, msg = validate_python_tool("def anything(x):\n    return x\n", None, None)
+    assert ok, msg
@@ -0,0 +1,62 @@
+import json
+
+import tools_cache
+from database import db
+from startup import initialize_add_tool_and_admin
+
+
+def _add_private_tool(user_id, name, body):
+    ok, tool_id = db.add_function_tool(
+        user_id=user_id, tool_name=name, description='测试工具',
+        parameters=json.dumps([{'name': 'x', 'type': 'int', 'required': True}]),
+        tool_flag=1, code_content=f"def {name}(x):\n    return {body}")
+    assert ok
+    return tool_id
+
+
+def test_fingerprint_changes_on_edit_within_the_same_second():
+    initialize_add_tool_and_admin()
+    tool_id = _add_private_tool(1, 'fp_tool', 'x')
+    before = db.get_private_function_tools_fingerprint(1)
+    assert db.update_function_tool(1, tool_id, code_content="def fp_tool(x):\n    return x + 1")
+    after = db.get_private_function_tools_fingerprint(1)
+    assert before != after
+
+
+def test_expired_cache_rebuilds_after_edit_from_another_process():
+    initialize_add_tool_and_admin()
+    tool_id = _add_private_tool(1, 'fp_tool2', 'x')
+    assert tools_cache.refresh_user_tools(1)['fp_tool2'].source.endswith('return x')
+    # 其他进程修改工具：本进程没有收到失效通知，只能在TTL到期后比较指纹
+    db.update_function_tool(1, tool_id, code_content="def fp_tool2(x):\n    return x * 2")
+    tools_cache._USER_TOOLS_EXPIRY[1] = 0
+    assert tools_cache.get_tools_for_user(1)['fp_tool2'].source.endswith('return x * 2')
+
+
+def test_concurrent_index_requests_sync_once(monkeypatch):
+    import threading
+    import time
+    from tool_index import ToolIndex
+
+    initialize_add_tool_and_admin()
+    _add_private_tool(1, 'idx_tool', 'x')
+    tools_cache.invalidate_user_tools(1)
+    tools_cache._USER_INDEX_VERSION.pop(1, None)
+    calls = []
+    original = ToolIndex.sync
+
+    def slow_sync(self, docs):
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        original(self, docs)
+
+    monkeypatch.setattr(ToolIndex, 'sync', slow_sync)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tools_cache.get_tool_index(1))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len({id(r) for r in results}) == 1
+    assert 'idx_tool' in results[0].search('idx_tool', 5)
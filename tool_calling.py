@@ -0,0 +1,124 @@
+import json
+import re
+import threading
+from typing import Dict, List, Tuple
+
+from config import Config
+from log import info
+
+# 工具调用模式：
+# auto   依次尝试 native（tools/tool_calls 接口）-> json（JSON模式结构化输出），端点都不支持时回退到提示词规划流程
+# native / json  只尝试指定模式，不支持时回退到提示词规划流程
+# prompt 始终使用提示词规划流程（create_plan + parse_user_input）
+AGENT_TOOL_CALLING_MODE = getattr(Config, 'AGENT_TOOL_CALLING_MODE', 'auto')
+# 单次查询中与模型往返的最大轮数（每轮可返回多个工具调用，依赖上一轮结果的调用放在下一轮）
+AGENT_MAX_TOOL_ROUNDS = getattr(Config, 'AGENT_MAX_TOOL_ROUNDS', 4)
+
+NATIVE = 'native'
+JSON = 'json'
+
+# Python类型注解名 -> JSON Schema 类型
+_TYPE_MAP = {
+    'int': 'integer', 'float': 'number', 'str': 'string', 'bool': 'boolean',
+    'list': 'array', 'dict': 'object', 'tuple': 'array',
+    'integer': 'integer', 'number': 'number', 'string': 'string', 'boolean': 'boolean',
+    'array': 'array', 'object': 'object',
+}
+
+
+class ToolCallingUnsupportedError(Exception):
+    """端点不支持当前工具调用模式（如不识别 tools 或 response_format 参数）"""
+
+
+# 端点不支持 tools/response_format 参数时常见的错误信息（OpenAI、vLLM、Ollama、pydantic 校验等），需同时提到对应参数
+_UNSUPPORTED_PATTERNS = re.compile(
+    r'does not support|not supported|unsupported|unrecognized request argument|extra inputs are not permitted'
+    r'|extra_forbidden|unknown (?:field|parameter|argument)|enable-auto-tool-choice')
+
+
+def is_unsupported_error(error: Exception, mode: str) -> bool:
+    """请求错误是否表示端点不支持该工具调用模式：状态码为 400/422，且错误体的 param 指向对应参数，
+    或错误信息同时提到对应参数与"不支持"类描述；其他400错误（如上下文超长、参数值非法）不算"""
+    if getattr(error, 'status_code', None) not in (400, 422):
+        return False
+    params = ('tools', 'tool_choice') if mode == NATIVE else ('response_format',)
+    body = getattr(error, 'body', None)
+    detail = body.get('error', body) if isinstance(body, dict) else None
+    if isinstance(detail, dict) and detail.get('param') in params:
+        return True
+    text = str(error).lower()
+    return any(p in text for p in params) and bool(_UNSUPPORTED_PATTERNS.search(text))
+
+
+def to_openai_tools(tools_schema: List[Dict]) -> List[Dict]:
+    """将 Tool.get_schema() 转换为 OpenAI 兼容接口的 tools 定义"""
+    tools = []
+    for schema in tools_schema:
+        properties = {}
+        required = []
+        for p in schema.get('parameters') or []:
+            prop = {'description': p.get('description') or p['name']}
+            json_type = _TYPE_MAP.get(str(p.get('type', '')).lower())
+            if json_type:
+                prop['type'] = json_type
+            properties[p['name']] = prop
+            if p.get('required'):
+                required.append(p['name'])
+        tools.append({
+            'type': 'function',
+            'function': {
+                'name': schema['name'],
+                'description': schema.get('description') or '',
+                'parameters': {'type': 'object', 'properties': properties, 'required': required},
+            },
+        })
+    return tools
+
+
+def parse_json_reply(content: str) -> Tuple[str, List[Dict]]:
+    """解析JSON模式的输出，返回 (最终回答, 工具调用列表)；无法解析时把原文当作最终回答"""
+    text = (content or '').strip()
+    if '</think>' in text:
+        text = text.split('</think>')[-1].strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        try:
+            data = json.loads(match.group()) if match else None
+        except json.JSONDecodeError:
+            data = None
+    if not isinstance(data, dict):
+        return text, []
+    calls = []
+    for i, call in enumerate(data.get('tool_calls') or []):
+        if isinstance(call, dict) and call.get('name'):
+            arguments = call.get('arguments') or {}
+            calls.append({'id': f'call_{i}', 'name': call['name'],
+                          'arguments': arguments if isinstance(arguments, dict) else {}})
+    return str(data.get('answer') or ''), calls
+
+
+# 端点对各模式的支持情况：(model_url, model) -> 已确认不支持的模式集合
+_UNSUPPORTED: Dict[Tuple[str, str], set] = {}
+_LOCK = threading.Lock()
+
+
+def _key(llm) -> Tuple[str, str]:
+    return ((getattr(llm, 'url', '') or '').rstrip('/'), getattr(llm, 'model', ''))
+
+
+def modes_for(llm) -> List[str]:
+    """该客户端可尝试的工具调用模式（按优先级），为空表示使用提示词规划流程"""
+    if AGENT_TOOL_CALLING_MODE == 'prompt' or not hasattr(llm, 'achat_tools'):
+        return []
+    modes = [NATIVE, JSON] if AGENT_TOOL_CALLING_MODE == 'auto' else [AGENT_TOOL_CALLING_MODE]
+    with _LOCK:
+        unsupported = _UNSUPPORTED.get(_key(llm), set())
+    return [m for m in modes if m not in unsupported]
+
+
+def mark_unsupported(llm, mode: str) -> None:
+    with _LOCK:
+        _UNSUPPORTED.setdefault(_key(llm), set()).add(mode)
+    info(f"端点不支持工具调用模式 {mode}，后续请求不再尝试 - URL: {getattr(llm, 'url', '')}, 模型: {getattr(llm, 'model', '')}")
@@ -0,0 +1,146 @@
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from log import debug
+
+# 提示词中最多包含的工具数（按与问题的相关度取前k个），0 表示不筛选、发送全部工具
+TOOL_RETRIEVAL_TOP_K = getattr(Config, 'TOOL_RETRIEVAL_TOP_K', 8)
+# BM25 参数
+TOOL_INDEX_BM25_K1 = getattr(Config, 'TOOL_INDEX_BM25_K1', 1.5)
+TOOL_INDEX_BM25_B = getattr(Config, 'TOOL_INDEX_BM25_B', 0.75)
+# 各字段的词频权重：工具名最能说明用途，参数描述最弱
+_FIELD_WEIGHTS = {'name': 3, 'description': 2, 'label': 1, 'parameters': 1}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+')
+_CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]')
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文/数字按单词（snake_case 拆开），中文按单字 + 相邻两字（无需分词词典）"""
+    tokens = []
+    for run in _TOKEN_RE.findall((text or '').lower().replace('_', ' ')):
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def tool_fields(name: str, description: str = '', label: str = '', parameters: Optional[Iterable] = None) -> Dict[str, str]:
+    """工具的索引字段：名称、描述、标签、参数名与参数描述"""
+    params = []
+    for p in parameters or []:
+        if isinstance(p, dict):
+            params.append(f"{p.get('name') or ''} {p.get('description') or ''}")
+    return {'name': name or '', 'description': description or '', 'label': label or '', 'parameters': ' '.join(params)}
+
+
+class ToolIndex:
+    """工具的 BM25 倒排索引，支持增量增删（sync 只重建内容有变化的工具）"""
+
+    def __init__(self, k1: float = TOOL_INDEX_BM25_K1, b: float = TOOL_INDEX_BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}  # 词 -> {工具名: 加权词频}
+        self._lengths: Dict[str, int] = {}  # 工具名 -> 文档长度
+        self._terms: Dict[str, List[str]] = {}  # 工具名 -> 包含的词，删除时只需访问这些倒排表
+        self._digests: Dict[str, str] = {}  # 工具名 -> 索引内容摘要，用于判断是否需要重建
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._lengths
+
+    @staticmethod
+    def _digest(fields: Dict[str, str]) -> str:
+        return hashlib.md5('\x00'.join(fields[k] for k in sorted(fields)).encode('utf-8')).hexdigest()
+
+    def _remove(self, name: str) -> None:
+        """删除工具（需持有锁）"""
+        if name not in self._lengths:
+            return
+        for term in self._terms.pop(name, []):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(name, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(name)
+        self._digests.pop(name, None)
+
+    def _add(self, name: str, fields: Dict[str, str]) -> None:
+        """添加或替换工具（需持有锁）"""
+        self._remove(name)
+        tf = Counter()
+        for field, text in fields.items():
+            weight = _FIELD_WEIGHTS.get(field, 1)
+            for token in tokenize(text):
+                tf[token] += weight
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[name] = count
+        self._terms[name] = list(tf)
+        length = sum(tf.values())
+        self._lengths[name] = length
+        self._total_length += length
+        self._digests[name] = self._digest(fields)
+
+    def add(self, name: str, fields: Dict[str, str]) -> None:
+        with self._lock:
+            self._add(name, fields)
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._remove(name)
+
+    def sync(self, docs: Dict[str, Dict[str, str]]) -> None:
+        """与当前工具集合同步：删除已不存在的工具，只重建新增或内容变化的工具"""
+        with self._lock:
+            removed = [name for name in self._lengths if name not in docs]
+            for name in removed:
+                self._remove(name)
+            changed = [name for name, fields in docs.items() if self._digests.get(name) != self._digest(fields)]
+            for name in changed:
+                self._add(name, docs[name])
+        if removed or changed:
+            debug(f"工具索引已更新 - 新增/变更: {len(changed)}, 删除: {len(removed)}, 工具总数: {len(docs)}")
+
+    def search(self, query: str, k: int) -> List[str]:
+        """按 BM25 相关度返回最多k个工具名"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._lengths)
+            if not n or not terms:
+                return []
+            avgdl = self._total_length / n or 1
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for name, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[name] / avgdl)
+                    scores[name] = scores.get(name, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return [name for name, _ in sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:k]]
+
+
+def select_tools(tools: Dict, index: Optional[ToolIndex], query: str, k: int = TOOL_RETRIEVAL_TOP_K) -> List:
+    """选出提示词中包含的工具：工具数不超过k或没有索引时返回全部；
+    否则按相关度取前k个，命中不足k个时按注册顺序补齐"""
+    if not k or index is None or len(tools) <= k:
+        return list(tools.values())
+    names = [name for name in index.search(query, k) if name in tools]
+    if len(names) < k:
+        picked = set(names)
+        names.extend([name for name in tools if name not in picked][:k - len(names)])
+    debug(f"工具检索 - 候选: {len(tools)}, 选中: {names}")
+    return [tools[name] for name in names]
@@ -1,4 +1,5 @@
 from tools import Tool
+import code_cache
 import time
 import inspect
 from log import logger, debug, info, warning, error, critical, exception
@@ -30,7 +31,7 @@ class Toolregister:
 
     
     def _convert_string_to_function(self, code_content: str, tool_name: Optional[str] = None) -> Callable:
-        """将字符串形式的函数代码转换为可调用函数对象
+        """将字符串形式的函数代码转换为可调用函数对象（按代码内容缓存编译结果，见 code_cache.py）
         
         Args:
             code_content: 包含函数定义的字符串代码
@@ -39,11 +40,15 @@ class Toolregister:
         Returns:
             Callable: 转换后的可调用函数对象
         """
+        return code_cache.get_function(code_content, tool_name, self._load_function)
+
+    def _load_function(self, code, tool_name: Optional[str] = None) -> Callable:
+        """执行编译后的代码对象，从命名空间中提取工具函数"""
         # 创建一个空的命名空间来执行代码
         local_namespace = {}
         
-        # 执行代码字符串，将定义的函数加载到命名空间，列：{'multiply': <function multiply at 0x00000204FF705D80>}
-        exec(code_content, globals(), local_namespace)
+        # 执行代码，将定义的函数加载到命名空间，列：{'multiply': <function multiply at 0x00000204FF705D80>}
+        exec(code, globals(), local_namespace)
         # info(f"注册的函数空间：{local_namespace}")
         # 优先根据 tool_name 查找函数
         if tool_name:
@@ -61,11 +66,12 @@ class Toolregister:
                 return obj
         
         # 如果没有找到函数，抛出异常
-        error(f"无法从代码字符串中提取函数: {code_content}")
+        error(f"无法从代码对象中提取函数: {code.co_filename}")
         raise ValueError("无法从代码字符串中提取函数")
 
     
-    def register_tool(self, tool_name: str, description: str, function: Union[Callable, str], parameters: Optional[Any] = None):
+    def register_tool(self, tool_name: str, description: str, function: Union[Callable, str], parameters: Optional[Any] = None,
+                      route_hint: Optional[str] = None, cacheable: bool = False, trusted: bool = False):
         """注册新工具
         
         Args:
@@ -73,13 +79,20 @@ class Toolregister:
             description: 工具描述
             function: 可调用函数或函数代码字符串
             parameters: 工具参数（可选）
+            route_hint: 快速路由正则（可选）
+            cacheable: 是否可进入语义缓存（可选）
+            trusted: 是否为可信的内置工具（可选），不可信的代码字符串工具在沙箱进程中执行
         """
-        # 如果function是字符串，则将其转换为可调用函数
+        # 如果function是字符串，只保留源代码：首次执行时才编译（沙箱中执行的工具在当前进程内不编译），
+        # 参数信息未提供时从源代码的语法树中提取
+        source = None
         if isinstance(function, str):
-            function = self._convert_string_to_function(function, tool_name)
+            if not function.strip():
+                raise ValueError("工具代码为空")
+            source, function = function, None
         
         # 加载函数工具到内存，并注册到工具列表中
-        self.tools[tool_name] = Tool(tool_name, description, function, parameters)
+        self.tools[tool_name] = Tool(tool_name, description, function, parameters, route_hint, cacheable, source, trusted)
     
     
     # 数学工具函数
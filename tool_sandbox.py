@@ -0,0 +1,261 @@
+import atexit
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+from config import Config
+from log import debug, info, warning
+
+try:
+    import resource  # 仅 POSIX 系统提供，Windows 上不设置资源限制
+except ImportError:
+    resource = None
+
+# 工具沙箱配置，默认从配置读取
+TOOL_SANDBOX_ENABLED = getattr(Config, 'TOOL_SANDBOX_ENABLED', True)
+TOOL_SANDBOX_WORKERS = getattr(Config, 'TOOL_SANDBOX_WORKERS', 4)
+TOOL_SANDBOX_TIMEOUT_SECONDS = getattr(Config, 'TOOL_SANDBOX_TIMEOUT_SECONDS', 30)
+TOOL_SANDBOX_QUEUE_TIMEOUT_SECONDS = getattr(Config, 'TOOL_SANDBOX_QUEUE_TIMEOUT_SECONDS', 30)
+TOOL_SANDBOX_CPU_SECONDS = getattr(Config, 'TOOL_SANDBOX_CPU_SECONDS', 10)
+TOOL_SANDBOX_MEMORY_MB = getattr(Config, 'TOOL_SANDBOX_MEMORY_MB', 512)
+TOOL_SANDBOX_MAX_CALLS = getattr(Config, 'TOOL_SANDBOX_MAX_CALLS', 200)
+TOOL_SANDBOX_START_METHOD = getattr(Config, 'TOOL_SANDBOX_START_METHOD',
+                                    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+class ToolSandboxError(Exception):
+    """工具在沙箱进程中执行失败（进程异常退出、资源超限、沙箱繁忙等）"""
+
+
+class ToolTimeoutError(ToolSandboxError):
+    """工具执行超过 TOOL_SANDBOX_TIMEOUT_SECONDS，执行进程已被终止"""
+
+
+def is_trusted_builtin(tool_name: str, tool_flag: Any, code_content: Optional[str]) -> bool:
+    """共享（tool_flag=0）且代码与内置工具完全一致的工具视为可信，在进程内执行；其余用户代码进入沙箱"""
+    from internal_tools import in_tools
+    if tool_flag not in (0, '0'):
+        return False
+    return any(t['tool_name'] == tool_name and t['function'] == code_content for t in in_tools)
+
+
+def _set_cpu_limit(seconds: float) -> None:
+    """本次调用的CPU时间上限：软限制设为已用CPU时间 + seconds，超出时进程收到 SIGXCPU 退出"""
+    if resource is None or seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _set_memory_limit(megabytes: int) -> None:
+    if resource is None or megabytes <= 0:
+        return
+    limit = megabytes * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn, memory_mb: int, cpu_seconds: float) -> None:
+    """沙箱进程主循环：接收 (工具名, 代码, 参数)，逐个执行并回传结果（编译结果在进程内按代码摘要缓存，见 code_cache.py）"""
+    from tool_process import Toolregister  # 与进程内注册使用相同的编译方式（相同的全局命名空间）
+    register = Toolregister()
+    _set_memory_limit(memory_mb)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        tool_name, code, kwargs = message
+        try:
+            function = register._convert_string_to_function(code, tool_name)
+            _set_cpu_limit(cpu_seconds)
+            result = function(**kwargs)
+            try:
+                pickle.dumps(result)
+            except Exception:
+                result = repr(result)
+            reply = ('ok', result)
+        except KeyboardInterrupt:
+            break
+        except BaseException as e:  # 用户代码中的 exit() 等也只影响本次调用
+            reply = ('error', f"{type(e).__name__}: {e}")
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+
+
+class _Worker:
+    """一个沙箱进程及其管道"""
+
+    def __init__(self, ctx, memory_mb: int, cpu_seconds: float):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_mb, cpu_seconds),
+                                   name='tool-sandbox', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.calls = 0
+
+    def stop(self, kill: bool = False) -> None:
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=1)
+        self.conn.close()
+
+    def exit_reason(self, cpu_seconds: float) -> str:
+        self.process.join(timeout=1)
+        code = self.process.exitcode
+        if resource is not None and code is not None and code < 0:
+            import signal
+            if -code == signal.SIGXCPU:
+                return f"CPU时间超过{cpu_seconds}秒"
+            if -code == signal.SIGKILL:
+                return "进程被强制终止（可能超出内存限制）"
+        return f"进程异常退出，退出码: {code}"
+
+
+class ToolSandbox:
+    """用户工具的沙箱进程池：进程预先启动并常驻，编译后的工具在进程内缓存；
+    每次调用限制墙钟时间（超时终止进程）、CPU时间与内存（resource.setrlimit），进程执行 max_calls 次后替换"""
+
+    def __init__(self, workers: int = TOOL_SANDBOX_WORKERS, timeout: float = TOOL_SANDBOX_TIMEOUT_SECONDS,
+                 cpu_seconds: float = TOOL_SANDBOX_CPU_SECONDS, memory_mb: int = TOOL_SANDBOX_MEMORY_MB,
+                 max_calls: int = TOOL_SANDBOX_MAX_CALLS, start_method: str = TOOL_SANDBOX_START_METHOD,
+                 queue_timeout: float = TOOL_SANDBOX_QUEUE_TIMEOUT_SECONDS):
+        self.size = max(1, workers)
+        self.timeout = timeout  # 执行的墙钟时间上限，从进程收到调用时开始计算
+        self.queue_timeout = queue_timeout  # 等待空闲进程的时间上限，与执行时间分别计算
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_calls = max_calls
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx, self.memory_mb, self.cpu_seconds)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _retire(self, worker: _Worker, kill: bool = False) -> None:
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop(kill)
+
+    def _replace(self, worker: _Worker, kill: bool = False) -> None:
+        """停止进程并补充一个新进程到空闲队列"""
+        self._retire(worker, kill)
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def start(self) -> None:
+        """启动全部沙箱进程（首次调用时自动执行）"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        metrics.set_gauge('tool_sandbox.workers', self.size)
+        info(f"工具沙箱进程池已启动 - 进程数: {self.size}, 启动方式: {self._ctx.get_start_method()}, "
+             f"超时: {self.timeout}s, CPU: {self.cpu_seconds}s, 内存: {self.memory_mb}MB")
+
+    def call(self, tool_name: str, code: str, kwargs: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """在沙箱进程中执行工具代码，返回工具结果；工具抛出的异常、超时与资源超限均以 ToolSandboxError 抛出。
+        等待空闲进程（queue_timeout）与执行（timeout）分别计时，沙箱繁忙时排队不会占用工具的执行时间"""
+        if self._closed:
+            raise ToolSandboxError("工具沙箱已关闭")
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            metrics.incr('tool_sandbox.busy')
+            raise ToolSandboxError(f"工具沙箱繁忙，等待空闲进程超过{self.queue_timeout}秒")
+        metrics.observe('tool_sandbox.queue_wait_ms', (time.perf_counter() - start) * 1000)
+        try:
+            worker.conn.send((tool_name, code, kwargs))
+            if not worker.conn.poll(timeout):
+                metrics.incr('tool_sandbox.timeout')
+                warning(f"工具执行超时，终止沙箱进程 - 工具: {tool_name}, 超时: {timeout}s")
+                self._replace(worker, kill=True)
+                raise ToolTimeoutError(f"工具 {tool_name} 执行超过{timeout}秒，已终止")
+            status, payload = worker.conn.recv()
+        except (EOFError, OSError, pickle.PicklingError) as e:
+            reason = str(e) if isinstance(e, pickle.PicklingError) else worker.exit_reason(self.cpu_seconds)
+            metrics.incr('tool_sandbox.crashed')
+            warning(f"沙箱进程执行工具失败 - 工具: {tool_name}, 原因: {reason}")
+            self._replace(worker, kill=True)
+            raise ToolSandboxError(f"工具 {tool_name} 执行失败：{reason}")
+        metrics.observe('tool_sandbox.latency_ms', (time.perf_counter() - start) * 1000)
+        worker.calls += 1
+        if worker.calls >= self.max_calls:
+            debug(f"沙箱进程达到调用次数上限，替换 - 调用次数: {worker.calls}")
+            metrics.incr('tool_sandbox.recycled')
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        if status == 'error':
+            raise ToolSandboxError(payload)
+        return payload
+
+    def shutdown(self) -> None:
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            self._retire(worker)
+
+
+_DEFAULT_SANDBOX: Optional[ToolSandbox] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_sandbox() -> ToolSandbox:
+    """进程级默认沙箱（进程退出时关闭全部沙箱进程）"""
+    global _DEFAULT_SANDBOX
+    if _DEFAULT_SANDBOX is None:
+        with _DEFAULT_LOCK:
+            if _DEFAULT_SANDBOX is None:
+                _DEFAULT_SANDBOX = ToolSandbox()
+                atexit.register(_DEFAULT_SANDBOX.shutdown)
+    return _DEFAULT_SANDBOX
+
+
+def should_sandbox(tool) -> bool:
+    """由用户代码注册、且不是可信内置工具的工具在沙箱中执行"""
+    return TOOL_SANDBOX_ENABLED and bool(getattr(tool, 'source', None)) and not getattr(tool, 'trusted', False)
+
+
+def execute(tool, parameters: Dict[str, Any]) -> Any:
+    """执行工具：需要隔离的工具在沙箱进程中执行，其余在当前进程内执行"""
+    if should_sandbox(tool):
+        return get_sandbox().call(tool.name, tool.source, parameters)
+    return tool.execute(**parameters)
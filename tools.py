@@ -1,3 +1,4 @@
+import ast
 import inspect
 from typing import Dict, Any, List, Callable, Optional
 
@@ -7,15 +8,35 @@ from typing import Dict, Any, List, Callable, Optional
 # function: Callable[[int, str], bool]  # 接受 (int, str) 参数，返回 bool
 class Tool:
     """工具基类"""
-    def __init__(self, name: str, description: str, function: Callable, parameters: Optional[List[Dict]] = None):
+    def __init__(self, name: str, description: str, function: Optional[Callable], parameters: Optional[List[Dict]] = None,
+                 route_hint: Optional[str] = None, cacheable: bool = False, source: Optional[str] = None,
+                 trusted: bool = False):
         self.name = name
         self.description = description
-        self.function = function  #这个值确保了不同工具创建的Tool实列对应的函数工具，在execute中执行
+        # 这个值确保了不同工具创建的Tool实列对应的函数工具，在execute中执行；
+        # 只提供源代码（function 为None）时延迟到首次使用才编译（见 function 属性）
+        self._function = function
+        self.source = source  # 由代码字符串注册时的源代码，不可信工具在沙箱进程中按源代码执行（见 tool_sandbox.py）
         self.parameters = parameters or self._extract_parameters() # 也可以根据用户传人
+        self.route_hint = route_hint  # 快速路由正则，命名分组对应参数名（见 fast_router.py）
+        self.cacheable = cacheable  # 结果只取决于参数，只使用此类工具的问答可进入语义缓存（见 semantic_cache.py）
+        self.trusted = trusted  # 可信的内置工具在当前进程内执行
         # self.parameters = self._extract_parameters() # 也可以根据用户传人
     
+    @property
+    def function(self) -> Callable:
+        """工具函数；延迟注册的工具在首次访问时编译（按代码内容缓存，见 code_cache.py）"""
+        if self._function is None:
+            from tool_process import Toolregister
+            self._function = Toolregister()._convert_string_to_function(self.source, self.name)
+        return self._function
+
     def _extract_parameters(self) -> List[Dict]:
-        """从函数签名中提取其参数信息"""
+        """从函数签名中提取其参数信息；尚未编译的工具优先从源代码的语法树中提取，不执行代码"""
+        if self._function is None and self.source:
+            parameters = _parameters_from_source(self.source, self.name)
+            if parameters is not None:
+                return parameters
         sig = inspect.signature(self.function) #得到对应函数的签名
         parameters = []
         
@@ -47,3 +68,47 @@ class Tool:
             "description": self.description,
             "parameters": self.parameters
         }
+
+
+def _annotation_name(node) -> str:
+    """类型注解节点对应的类型名（与 inspect 提取的 __name__ 一致，如 float、List）"""
+    if node is None:
+        return "any"
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Subscript):
+        return _annotation_name(node.value)
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return "any"
+
+
+def _parameters_from_source(source: str, tool_name: str) -> Optional[List[Dict]]:
+    """从源代码的语法树中提取工具函数的参数信息（与 Toolregister 相同的函数选择规则）；
+    无法确定工具函数（语法错误、没有顶层函数定义等）时返回None"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    functions = [node for node in tree.body
+                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.name.startswith('_')]
+    target = next((node for node in functions if node.name == tool_name), None) or (functions[0] if functions else None)
+    if target is None:
+        return None
+    args = target.args
+    positional = args.posonlyargs + args.args
+    defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+    params = list(zip(positional, defaults))
+    if args.vararg:
+        params.append((args.vararg, None))
+    params.extend(zip(args.kwonlyargs, args.kw_defaults))
+    if args.kwarg:
+        params.append((args.kwarg, None))
+    return [{
+        "name": arg.arg,
+        "type": _annotation_name(arg.annotation),
+        "description": f"参数 {arg.arg}",
+        "required": default is None
+    } for arg, default in params]
@@ -1,23 +1,84 @@
 import time
 import json
+import hashlib
 import threading
-from typing import Dict
+from types import MappingProxyType
+from typing import Dict, Iterator, Mapping, Optional
 
+import metrics
 from database import db
 from tool_process import Toolregister
 from tools import Tool
+from tool_index import ToolIndex, tool_fields
+from tool_sandbox import is_trusted_builtin
 from log import debug, info, warning, error, exception
 from config import Config
-import time
 
 # TTL（秒），默认从配置读取，回退5分钟
 DEFAULT_TOOLS_CACHE_TTL_SECONDS = getattr(Config, 'TOOLS_CACHE_TTL_SECONDS', 300)
 
-# 按用户缓存已注册工具，降低并发场景下的重复构建成本
-_USER_TOOLS_CACHE: Dict[int, Dict[str, Tool]] = {}
+
+class _Registry:
+    """一组已注册工具的不可变快照：工具、检索文档、每个工具定义的摘要与构建时数据库中工具集合的指纹；
+    重建时生成新快照，定义未变化的工具沿用原 Tool 对象"""
+
+    def __init__(self, tools: Dict[str, Tool], docs: Dict[str, Dict[str, str]], digests: Dict[str, str],
+                 fingerprint: Optional[tuple] = None):
+        self.tools = MappingProxyType(tools)
+        self.docs = docs
+        self.digests = digests
+        self.fingerprint = fingerprint
+        self.version = hashlib.sha256(
+            json.dumps(sorted(digests.items()), ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+_EMPTY = _Registry({}, {}, {})
+
+# 全局共享工具（tool_flag=0）注册表：所有用户共用同一份，更新时整体替换，所有用户的视图随即可见
+_PUBLIC: _Registry = _EMPTY
+_PUBLIC_EXPIRY = 0.0
+_PUBLIC_STALE = False  # 已显式失效：跳过指纹比较，直接增量重建
+_PUBLIC_INDEX = ToolIndex()  # 共享工具的检索索引，没有私有工具的用户直接使用
+_PUBLIC_LOCK = threading.Lock()
+
+# 按用户缓存私有工具（覆盖层），降低并发场景下的重复构建成本
+_USER_TOOLS_CACHE: Dict[int, _Registry] = {}
 _USER_LOCKS: Dict[int, threading.Lock] = {}
 # 每个用户的缓存过期时间戳
 _USER_TOOLS_EXPIRY: Dict[int, float] = {}
+# 已显式失效（工具变更）的用户：跳过指纹比较，直接增量重建
+_USER_TOOLS_STALE: set = set()
+# 有私有工具的用户的检索索引（共享工具 + 私有工具）及其同步时的注册表版本；增量同步，不随缓存删除
+_USER_TOOL_INDEX: Dict[int, ToolIndex] = {}
+_USER_INDEX_VERSION: Dict[int, str] = {}
+
+
+class ToolsView(Mapping):
+    """用户可见的工具：私有工具覆盖同名的共享工具。只读视图，不复制工具；
+    共享部分始终读取当前的全局注册表，共享工具更新后所有用户立即可见"""
+
+    def __init__(self, private: Mapping[str, Tool]):
+        self._private = private
+
+    def __getitem__(self, name: str) -> Tool:
+        tool = self._private.get(name)
+        if tool is None:
+            return _PUBLIC.tools[name]
+        return tool
+
+    def __contains__(self, name) -> bool:
+        return name in self._private or name in _PUBLIC.tools
+
+    def __iter__(self) -> Iterator[str]:
+        private = self._private
+        for name in _PUBLIC.tools:
+            if name not in private:
+                yield name
+        yield from private
+
+    def __len__(self) -> int:
+        private = self._private
+        return len(private) + sum(1 for name in _PUBLIC.tools if name not in private)
 
 
 def _parse_params(val):
@@ -33,64 +94,157 @@ def _parse_params(val):
             return None
 
 
-def _build_tools_for_user(user_id: int) -> Dict[str, Tool]:
-    tools = db.get_all_function_tools(user_id)
+def _tool_digest(t: dict) -> str:
+    return hashlib.sha256(json.dumps(
+        [t['tool_name'], t.get('description'), t.get('parameters'), t.get('code_content'), t.get('route_hint'),
+         bool(t.get('is_cacheable')), t.get('tool_flag'), t.get('label')], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _build_registry(rows, previous: _Registry, owner: str, fingerprint: Optional[tuple] = None) -> _Registry:
+    """由数据库记录构建注册表快照；与 previous 中定义相同的工具直接复用，只注册新增或变化的工具"""
     reg = Toolregister()
-    count = 0
-    for t in tools:
+    tools, docs, digests = {}, {}, {}
+    reused = 0
+    for t in rows:
         try:
             # 仅注册启用的工具
             if not t.get('is_active', True):
                 continue
-            reg.register_tool(
-                t['tool_name'],
-                t.get('description', ''),
-                t.get('code_content', ''),
-                _parse_params(t.get('parameters')),
-            )
-            count += 1
+            name = t['tool_name']
+            digest = _tool_digest(t)
+            if previous.digests.get(name) == digest:
+                tools[name] = previous.tools[name]
+                docs[name] = previous.docs[name]
+                reused += 1
+            else:
+                params = _parse_params(t.get('parameters'))
+                reg.register_tool(
+                    name,
+                    t.get('description', ''),
+                    t.get('code_content', ''),
+                    params,
+                    t.get('route_hint'),
+                    bool(t.get('is_cacheable')),
+                    is_trusted_builtin(name, t.get('tool_flag'), t.get('code_content')),
+                )
+                tools[name] = reg.tools[name]
+                docs[name] = tool_fields(name, t.get('description'), t.get('label'), params)
+            digests[name] = digest
         except Exception as e:
-            warning(f"注册工具失败，已跳过 - 用户ID: {user_id}, 工具: {t.get('tool_name')}, 错误: {e}")
-    debug(f"构建工具缓存 - 用户ID: {user_id}, 有效工具数: {count}")
-    return reg.tools
+            warning(f"注册工具失败，已跳过 - {owner}, 工具: {t.get('tool_name')}, 错误: {e}")
+    removed = sum(1 for name in previous.digests if name not in digests)
+    metrics.incr('tools_cache.rebuilt')
+    metrics.incr('tools_cache.registered', len(tools) - reused)
+    debug(f"构建工具缓存 - {owner}, 有效工具数: {len(tools)}, 复用: {reused}, 删除: {removed}")
+    return _Registry(tools, docs, digests, fingerprint)
+
+
+def _unchanged(registry: _Registry, fingerprint: Optional[tuple]) -> bool:
+    """缓存过期时用一次统计查询判断工具集合是否有变化；未变化时只续期，不重建"""
+    if fingerprint is None or registry.fingerprint != fingerprint:
+        return False
+    metrics.incr('tools_cache.unchanged')
+    return True
+
 
-def get_tools_for_user(user_id: int) -> Dict[str, Tool]:
-    """获取用户的已注册工具（带缓存 + TTL）。"""
+def _get_public_registry() -> _Registry:
+    """获取共享工具注册表（带 TTL），过期或失效后重建并整体替换"""
+    global _PUBLIC, _PUBLIC_EXPIRY, _PUBLIC_STALE
+    if _PUBLIC_EXPIRY > time.time():
+        return _PUBLIC
+    with _PUBLIC_LOCK:
+        now = time.time()
+        if _PUBLIC_EXPIRY > now:
+            return _PUBLIC
+        stale, _PUBLIC_STALE = _PUBLIC_STALE, False
+        fingerprint = db.get_public_function_tools_fingerprint()
+        if not stale and _unchanged(_PUBLIC, fingerprint):
+            _PUBLIC_EXPIRY = now + DEFAULT_TOOLS_CACHE_TTL_SECONDS
+            return _PUBLIC
+        registry = _build_registry(db.get_public_function_tools(), _PUBLIC, '共享工具', fingerprint)
+        _PUBLIC_INDEX.sync(registry.docs)
+        _PUBLIC = registry
+        _PUBLIC_EXPIRY = now + DEFAULT_TOOLS_CACHE_TTL_SECONDS
+        return registry
+
+
+def _user_lock(user_id: int) -> threading.Lock:
     lock = _USER_LOCKS.get(user_id)
     if lock is None:
-        lock = threading.Lock()
-        _USER_LOCKS[user_id] = lock
-    with lock:
+        lock = _USER_LOCKS.setdefault(user_id, threading.Lock())
+    return lock
+
+
+def _get_private_registry(user_id: int, force: bool = False) -> _Registry:
+    with _user_lock(user_id):
         now = time.time()
         cached = _USER_TOOLS_CACHE.get(user_id)
-        expiry = _USER_TOOLS_EXPIRY.get(user_id, 0)
-        if cached is not None and expiry > now:
-            debug(f"命中工具缓存 - 用户ID: {user_id}, 工具数: {len(cached)}")
+        if not force and cached is not None and _USER_TOOLS_EXPIRY.get(user_id, 0) > now:
             return cached
-        built = _build_tools_for_user(user_id)
+        stale = force or user_id in _USER_TOOLS_STALE
+        _USER_TOOLS_STALE.discard(user_id)
+        fingerprint = db.get_private_function_tools_fingerprint(user_id)
+        if cached is not None and not stale and _unchanged(cached, fingerprint):
+            _USER_TOOLS_EXPIRY[user_id] = now + DEFAULT_TOOLS_CACHE_TTL_SECONDS
+            return cached
+        built = _build_registry(db.get_private_function_tools(user_id), cached or _EMPTY, f"用户ID: {user_id}",
+                                fingerprint)
         _USER_TOOLS_CACHE[user_id] = built
         _USER_TOOLS_EXPIRY[user_id] = now + DEFAULT_TOOLS_CACHE_TTL_SECONDS
         return built
 
 
+def get_tools_for_user(user_id: int) -> Mapping[str, Tool]:
+    """获取用户的已注册工具（带缓存 + TTL）：共享工具注册表与用户私有工具合并后的只读视图"""
+    _get_public_registry()
+    return ToolsView(_get_private_registry(user_id).tools)
+
+
+def get_tool_index(user_id: int) -> ToolIndex:
+    """获取用户的工具检索索引（BM25，见 tool_index.py），与 get_tools_for_user 返回的工具集合一致；
+    没有私有工具的用户共用共享工具的索引"""
+    public = _get_public_registry()
+    private = _get_private_registry(user_id)
+    if not private.docs:
+        return _PUBLIC_INDEX
+    version = f"{public.version}:{private.version}"
+    # 与私有注册表共用用户锁（先取注册表再加锁，锁不可重入）：同一用户的并发请求不会同时同步同一个索引
+    with _user_lock(user_id):
+        index = _USER_TOOL_INDEX.get(user_id)
+        if index is None:
+            index = _USER_TOOL_INDEX.setdefault(user_id, ToolIndex())
+        if _USER_INDEX_VERSION.get(user_id) != version:
+            index.sync({**public.docs, **private.docs})
+            _USER_INDEX_VERSION[user_id] = version
+    return index
+
+
+def get_tools_version(user_id: int) -> str:
+    """获取用户工具注册表的版本（共享与私有工具定义的摘要），与 get_tools_for_user 返回的工具集合一致"""
+    public = _get_public_registry()
+    private = _get_private_registry(user_id)
+    return hashlib.sha256(f"{public.version}:{private.version}".encode('utf-8')).hexdigest()[:16]
+
+
 def invalidate_user_tools(user_id: int) -> None:
-    """在工具变更后失效缓存。"""
+    """在工具变更后失效缓存（下次访问时增量重建，只重新注册新增或变化的工具）。"""
     if user_id in _USER_TOOLS_CACHE:
-        del _USER_TOOLS_CACHE[user_id]
+        _USER_TOOLS_STALE.add(user_id)
         _USER_TOOLS_EXPIRY.pop(user_id, None)
         debug(f"已失效用户工具缓存 - 用户ID: {user_id}")
 
+
+def invalidate_public_tools() -> None:
+    """共享工具（tool_flag=0）变更后失效共享工具注册表，下次访问时重建，所有用户随之更新"""
+    global _PUBLIC_EXPIRY, _PUBLIC_STALE
+    _PUBLIC_STALE = True
+    _PUBLIC_EXPIRY = 0.0
+    debug("已失效共享工具缓存")
+
 # 可选：主动刷新用户工具缓存（重建并续期TTL）
-def refresh_user_tools(user_id: int) -> Dict[str, Tool]:
-    lock = _USER_LOCKS.get(user_id)
-    if lock is None:
-        lock = threading.Lock()
-        _USER_LOCKS[user_id] = lock
-    with lock:
-        built = _build_tools_for_user(user_id)
-        _USER_TOOLS_CACHE[user_id] = built
-        _USER_TOOLS_EXPIRY[user_id] = time.time() + DEFAULT_TOOLS_CACHE_TTL_SECONDS
-        return built
+def refresh_user_tools(user_id: int) -> Mapping[str, Tool]:
+    _get_public_registry()
+    return ToolsView(_get_private_registry(user_id, force=True).tools)
 
 # 可选：动态设置TTL（全局）
 def set_tools_cache_ttl(seconds: int) -> None:
@@ -98,4 +252,4 @@ def set_tools_cache_ttl(seconds: int) -> None:
     try:
         DEFAULT_TOOLS_CACHE_TTL_SECONDS = max(30, int(seconds))
     except Exception:
-        warning("设置工具缓存TTL失败：参数非法，保持默认值")
\ No newline at end of file
+        warning("设置工具缓存TTL失败：参数非法，保持默认值")